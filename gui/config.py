@@ -10,7 +10,7 @@ from dataclasses import dataclass
 from gui.events import ApplyValueEvent, EVT_APPLY_VALUE
 from gui.widget import *
 from lib.common_data import common_data
-from lib.config import config, DataSaveFmt, SkinLoadWay, PlayerColorPickWay
+from lib.config import config, DataSaveFmt, DataCompress, SkinLoadWay, PlayerColorPickWay
 from lib.data import MAX_SIZE
 from lib.skin import skin_mgr
 
@@ -222,9 +222,41 @@ class ConfigLinePanel(wx.SplitterWindow):
             ConfigGroup("数据", [
                 ConfigData("启用保存数据功能", "enable_data_save", bool, "一般用于远程路径查看数据"),
                 ConfigData("数据文件夹", "data_dir", str, "存放路径点数据文件的文件夹\n需要重新启动程序以生效"),
-                ConfigData("点/文件", "points_per_file", int, "每个文件存储的最大数据点数量", (100, 5000)),
-                ConfigData("点/保存", "saved_per_points", int, "获取多少个数据点后保存一次数据", (1, 20)),
-                ConfigData("数据加载线程数", "data_load_threads", int, "一般越大越快, 推荐 4-8", (1, 32)),
+                ConfigData("文件时间跨度", "chunk_span_hours", int,
+                           "每个数据文件存储多少小时的数据点 (按UTC对齐)\n需要重新启动程序以生效, 旧文件会在后台压实时重新切分", (1, 168)),
+                ConfigData("点/同步", "saved_per_points", int, "获取多少个数据点后把预写日志同步到磁盘一次", (1, 20)),
+                ConfigData("点/检查点", "checkpoint_per_points", int,
+                           "预写日志中积累多少条记录后生成一次完整的数据文件", (100, 5000)),
+                ConfigData("数据加载线程数", "data_load_threads", int, "一般越大越快, 推荐 4-8\n多进程加载时为进程数", (1, 32)),
+                ConfigData("多进程加载数据", "data_load_process", bool,
+                           "使用多个进程解码数据文件, 数据量大时加载更快\n需要重新启动程序以生效"),
+                ConfigData("按需加载数据", "lazy_load", bool,
+                           "启动时只把最近的数据常驻内存, 更早的数据在查询时按需加载\n需要重新启动程序以生效"),
+                ConfigData("数据块缓存大小", "chunk_cache_mb", int, "按需加载时缓存的数据块的内存预算 (MB)", (16, 4096)),
+                ConfigData("常驻数据时长", "hot_window_hours", int,
+                           "按需加载时常驻内存的最近数据的时长 (小时)\n图表和数据点列表只显示这些数据", (1, 720)),
+                ConfigData("启动时先加载的时长", "startup_load_hours", int,
+                           "启动时只加载最近这么多小时的数据并立即显示窗口, 更早的数据在后台从新到旧分批加载\n"
+                           "0 表示加载完全部数据后再显示窗口\n需要重新启动程序以生效", (0, 720)),
+                ConfigData("启动快照", "startup_snapshot", bool,
+                           "正常退出时把整理好的数据写入快照文件, 下次启动时直接读取, 不需要重新解析没有改动过的数据文件"),
+                ConfigData("后台压实", "background_compact", bool,
+                           "在后台逐个把旧格式或旧切分方式的数据文件转换为当前设置\n关闭时切换格式后会在下次保存时一次性重写全部文件"),
+                ConfigData("压实间隔", "compact_interval", float, "后台压实处理两个数据块之间的最短间隔 (秒)", (0.1, 30.0)),
+                ConfigData("原始数据保留天数", "raw_retention_days", int,
+                           "超过该天数的数据块在后台移出数据文件夹, 启动时不再加载\n0 表示一直保留", (0, 3650)),
+                ConfigData("归档原始数据", "archive_old_data", bool,
+                           "移出的数据块以紧凑格式存入 archive 文件夹\n关闭时只保留按小时和按天的汇总, 原始数据点会被删除"),
+            ]),
+            ConfigGroup("备份", [
+                ConfigData("定时备份", "enable_backup", bool,
+                           "在后台定时备份数据文件夹, 内容没有变化的文件不会被重复复制\n需要重新启动程序以生效"),
+                ConfigData("备份文件夹", "backup_dir", str,
+                           "存放备份的文件夹, 可以使用 tools/backup_data.py 查看、恢复和清理备份"),
+                ConfigData("备份间隔", "backup_interval_hours", float, "两次备份之间的间隔 (小时)", (0.5, 720.0)),
+                ConfigData("保留备份数", "backup_keep", int, "只保留最近的这么多次备份, 更早的备份会被清理", (1, 365)),
+                ConfigData("备份速度限制", "backup_io_mb", float,
+                           "备份时平均每秒读写的数据量上限 (MB), 避免影响状态获取\n0 表示不限制", (0.0, 1024.0)),
             ]),
             ConfigData("分析最短在线时间", "min_online_time", int,
                        "数据分析时使用的单次最小在线时间\n小于该时间忽略此次在线 (秒)", (0, 600)),
@@ -233,12 +265,26 @@ class ConfigLinePanel(wx.SplitterWindow):
                        (100, 600)),
             ConfigData("服务器名", "server_name", str, "重启程序生效"),
             ConfigData("数据文件格式", "data_save_fmt", DataSaveFmt,
-                       tip="使用新的数据格式, 可以安全地随意切换数据格式 (保存性能有差别)\n下一次保存数据时使用新的格式",
+                       tip="使用新的数据格式, 可以安全地随意切换数据格式 (保存性能有差别)\n新写入的文件使用新的格式, 旧文件由后台压实逐个转换",
                        items_desc={
                            DataSaveFmt.NORMAL: "普通格式 (速度中等) (100%)",
                            DataSaveFmt.PLAYER_LIST_MAPPING: "玩家列表映射格式 (速度快) (50%)",
                            DataSaveFmt.PLAYER_MAPPING: "玩家映射格式 (速度中等) (36%)",
+                           DataSaveFmt.COLUMNAR: "列式二进制格式 (速度极快) (5%)",
+                           DataSaveFmt.RUN_LENGTH: "游程格式 (有损, 时间按均匀间隔重建, 按需加载时统计历史数据不展开游程) (4%-7%)",
+                       }),
+            ConfigData("数据文件压缩", "data_compress", DataCompress,
+                       tip="压缩数据文件以减少磁盘占用, 可以安全地随意切换\n新写入的文件使用新的压缩方式, 旧文件由后台压实逐个转换",
+                       items_desc={
+                           DataCompress.NONE: "不压缩",
+                           DataCompress.ZLIB: "zlib + 共享玩家字典 (速度快)",
+                           DataCompress.LZMA: "lzma (体积最小, 速度慢)",
+                           DataCompress.BZ2: "bz2 (速度中等)",
                        }),
+            ConfigData("打包存储数据块", "pack_chunks", bool,
+                       "把数据块追加写入 packs 文件夹中少量的大打包文件, 代替每个数据块一个文件\n"
+                       "减少数据文件夹中的文件数量, 在网络路径或同步盘上加载和保存更快\n"
+                       "可以安全地随意切换, 已有的文件由后台压实逐个转换"),
             ConfigGroup("全部玩家", [
                 ConfigData("启用获取全部玩家", "enable_full_players", bool, "重复获取服务器状态直到获取到全部玩家名称"),
                 ConfigData("FP循环获取间隔", "fp_re_status_inv", float, "重获全部玩家 的间隔", (1.0, 10.0)),
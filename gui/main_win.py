@@ -14,7 +14,9 @@ from gui.overview import OverviewPanel, ServerStatus
 from gui.players_info import PlayerPanel
 from gui.status_plot import StatusPanel
 from gui.widget import *
+from lib.backup import BackupScheduler
 from lib.common_data import common_data
+from lib.compactor import ChunkCompactor
 from lib.data import *
 from lib.perf import Counter
 from lib.skin import skin_mgr
@@ -22,6 +24,8 @@ from lib.skin import skin_mgr
 mpl_rcParams["font.family"] = "Microsoft YaHei"
 plt.rcParams["axes.unicode_minus"] = False
 ID_SELECT_ALL = wx.NewIdRef(count=1)
+HISTORY_BATCH_FILES = 4  # 后台加载历史数据时每批加载的文件数
+HISTORY_OVERVIEW_INV = 2.0  # 后台加载历史数据时刷新总览统计的最短间隔 (秒)
 
 
 def translate_status(status: JavaStatusResponse, ping: float) -> ServerPoint:
@@ -61,6 +65,25 @@ class NameTitle(CenteredText):
         self.SetFont(ft(20))
 
 
+class HistoryProgress(wx.Panel):
+    """后台加载历史数据的进度条, 加载完成后隐藏"""
+
+    def __init__(self, parent: wx.Window, total: int):
+        super().__init__(parent)
+        self.info_text = FormatedText(self, fmt="正在加载历史数据: {}")
+        self.info_text.SetFont(ft(10))
+        self.progress_bar = wx.Gauge(self, range=max(total, 1))
+        sizer = wx.BoxSizer(wx.HORIZONTAL)
+        sizer.Add(self.info_text, flag=wx.ALIGN_CENTER_VERTICAL | wx.RIGHT, border=5)
+        sizer.Add(self.progress_bar, flag=wx.EXPAND, proportion=1)
+        self.SetSizer(sizer)
+        self.set_progress(0, total)
+
+    def set_progress(self, done: int, total: int):
+        self.info_text.format(f"{done}/{total} 个文件")
+        self.progress_bar.SetValue(done)
+
+
 def get_server_status_raw(use_ping: bool = True) -> ServerPoint | None:
     try:
         server = JavaServer.lookup(config.addr, timeout=config.time_out)
@@ -98,8 +121,11 @@ class GUI(wx.Frame):
         super().__init__(None, title=f"CloudStatus - {config.server_name}", size=(1350, 850))
         logger.info("初始化GUI")
         self.data_manager = DataManager(config.data_dir)
-        self.data_manager.load_data()
+        self.data_manager.load_data(config.startup_load_hours)
         common_data.data_manager = self.data_manager
+        self.compactor = ChunkCompactor(self.data_manager)
+        self.backup = BackupScheduler(self.data_manager)
+        self.history_total = len(self.data_manager.unloaded_files)
         self.init_ui()
         self.server_status = ServerStatus.OFFLINE
         self.event_flag = Event()
@@ -108,6 +134,16 @@ class GUI(wx.Frame):
         self.status_flag = Event()
         self.status_thread = Thread(target=self.status_thread_func, daemon=True)
         self.status_thread.start()
+        self.history_stop_flag = Event()
+        self.history_thread: Thread | None = None
+        self.last_overview_update = perf_counter()
+        if self.data_manager.unloaded_files:  # 压实和保存会改写数据文件, 等历史数据加载完成后再启动
+            self.history_thread = Thread(name="HistoryLoader", target=self.history_thread_func, daemon=True)
+            self.history_thread.start()
+        else:
+            self.compactor.start()
+            self.backup.start()
+            self.data_manager.start_saver()
         self.Bind(wx.EVT_CLOSE, self.on_close)
         self.status_flag.set()
         wx.CallLater(200, self.load_points_gui)
@@ -169,7 +205,7 @@ class GUI(wx.Frame):
             self.event_flag.wait(timeout=config.fp_re_status_inv)
             if self.event_flag.is_set():
                 return "event", None
-        point.players = list(players)
+        point.players = player_pool.intern(players)
         point.time = com_point.time
         logger.debug("完整玩家列表获取完成")
         self.set_status(StatusStatus(ProgressStatus.WAIT))
@@ -177,7 +213,13 @@ class GUI(wx.Frame):
 
     def on_close(self, _):
         logger.info("程序停止中...")
-        self.data_manager.save_data()
+        if self.history_thread is not None:
+            self.history_stop_flag.set()
+            self.history_thread.join()
+        self.compactor.stop()
+        self.backup.stop()
+        self.data_manager.stop_saver()
+        self.data_manager.save_snapshot()
         skin_mgr.save_cache()
         config.save()
         self.stop_flag.set()
@@ -205,11 +247,40 @@ class GUI(wx.Frame):
             self.overview_panel.update_data([], time(), ServerStatus.UNKNOWN)
         logger.info(f"GUI数据加载完成! (耗时: {timer.endT()})")
 
+    def history_thread_func(self):
+        """后台从新到旧分批加载启动时没有加载的历史数据 的绑定函数"""
+        logger.info("历史数据加载线程已启动")
+        while self.data_manager.unloaded_files and not self.history_stop_flag.is_set():
+            points = self.data_manager.load_older_files(HISTORY_BATCH_FILES)
+            wx.CallAfter(self.load_history_gui, points, self.history_total - len(self.data_manager.unloaded_files))
+        if not self.data_manager.unloaded_files:
+            wx.CallAfter(self.on_history_loaded)
+
+    def load_history_gui(self, points: list[ServerPoint], done: int):
+        """把后台加载的一批更早的数据点加入GUI"""
+        self.history_progress.set_progress(done, self.history_total)
+        if points:
+            self.status_panel.cap_list.load_history(points)
+            self.status_panel.plot.load_history(points)
+        if perf_counter() - self.last_overview_update >= HISTORY_OVERVIEW_INV:
+            self.last_overview_update = perf_counter()
+            self.overview_panel.player_online_overview.update_data()
+
+    def on_history_loaded(self):
+        """历史数据加载完成, 隐藏进度条并启动压实和保存"""
+        self.history_progress.Hide()
+        self.Layout()
+        self.overview_panel.player_online_overview.update_data()
+        self.compactor.start()
+        self.backup.start()
+        self.data_manager.start_saver()
+
     # noinspection PyAttributeOutsideInit
     def init_ui(self):
         self.SetFont(ft(12))
         sizer = wx.BoxSizer(wx.VERTICAL)
         name_title = NameTitle(self)
+        self.history_progress = HistoryProgress(self, self.history_total)
         self.notebook = wx.Notebook(self)
         self.overview_panel = OverviewPanel(self.notebook)
         self.status_panel = StatusPanel(self.notebook)
@@ -223,8 +294,10 @@ class GUI(wx.Frame):
         self.notebook.AddPage(self.about_panel, "关于")
         sizer.Add(name_title, flag=wx.EXPAND | wx.LEFT | wx.RIGHT | wx.TOP, border=5)
         sizer.Add(wx.StaticLine(self), flag=wx.EXPAND | wx.TOP | wx.BOTTOM, border=5)
+        sizer.Add(self.history_progress, flag=wx.EXPAND | wx.LEFT | wx.RIGHT | wx.BOTTOM, border=5)
         sizer.Add(self.notebook, flag=wx.EXPAND | wx.LEFT | wx.RIGHT | wx.BOTTOM, border=5)
         self.SetSizer(sizer)
+        self.history_progress.Show(self.history_total > 0)
 
         name_title.SetMinSize((MAX_SIZE[0], 36))
         self.Bind(EVT_GET_STATUS_NOW, self.on_req_get_status)
@@ -310,10 +310,7 @@ class PlayerOnlineOverviewPanel(wx.Panel):
     def update_data(self, *_):
         ranges = self.data_manager.get_all_online_ranges().items()
 
-        total_players = set()
-        for pt in self.data_manager.points:
-            for player in pt.players:
-                total_players.add(player.name)
+        total_players = set(player for player, _ in ranges)  # 出现过的玩家都有在线时间段
         self.total_players.SetData(str(len(total_players)))
 
         day_end = datetime.now().timestamp()
@@ -391,7 +388,7 @@ class OverviewPanel(wx.Panel):
 
     def on_reset(self, _):
         if len(self.data_manager.points) > 0:
-            point: ServerPoint = list(self.data_manager.points)[-1]
+            point: ServerPoint = self.data_manager.points[-1]
             self.update_data([p.name for p in point.players], point.time, ServerStatus.ONLINE)
 
     def on_update(self, _):
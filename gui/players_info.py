@@ -14,7 +14,7 @@ from gui.online_widget import PlayerOnlineWin
 from gui.widget import TimeSelector, ft, string_fmt_time, PilImg2WxImg, EasyMenu
 from lib.common_data import common_data
 from lib.config import config
-from lib.data import Player
+from lib.data import Player, PointRun
 from lib.log import logger
 from lib.skin import skin_mgr, HeadLoadData, ContentStatus
 
@@ -588,37 +588,48 @@ class PlayerInfoPanel(wx.Panel):
                 self.player_info_lc.SetItem(line, col, content)
 
     def get_player_infos(self) -> dict[str, PlayerOnlineInfo]:
-        """获取玩家在线时间信息"""
+        """获取玩家在线时间信息, 逐个数据块获取玩家列表不变的游程, 只在获取时持有数据锁"""
         last_players: set[Player] = set()
+        last_list: tuple[Player, ...] = ()
+        last_time: float | None = None
         player_infos: dict[str, PlayerOnlineInfo] = {}
-        length = len(self.data_manager.points)
         last_progress = perf_counter()
         logger.info("开始分析玩家数据")
-        for i, point in enumerate(self.data_manager.points):
-            players_set = set(point.players)  # 获取当前数据点的玩家集合
-            # 计算新增和下线玩家
-            added_players = players_set - last_players  # 获取新增玩家的集合
-            for player in added_players:
-                if player.name not in player_infos:
-                    player_infos[player.name] = PlayerOnlineInfo(player.name, point.time)  # 新增当前不存在在线数据的玩家
-                else:
-                    player_infos[player.name].last_offline_time = point.time  # 修改已存在玩家的最后在线时间
+        with self.data_manager.data_ctl_lock:
+            chunks = list(self.data_manager.chunks)
 
-            if i == length - 1:  # 获取下线玩家的集合, 最后的数据点处理所有玩家
-                lose_players = players_set
-            else:
-                lose_players = last_players - players_set
-            for player in lose_players:
+        def lose_players(players: set[Player], lose_time: float):
+            for player in players:
                 info = player_infos[player.name]
-                info.online_times.append((info.last_offline_time, point.time))  # 添加玩家在线时间段
-                info.total_online_time += point.time - info.last_offline_time  # 累加玩家在线时间
-                info.last_offline_time = point.time  # 修改玩家最后在线时间
+                info.online_times.append((info.last_offline_time, lose_time))  # 添加玩家在线时间段
+                info.total_online_time += lose_time - info.last_offline_time  # 累加玩家在线时间
+                info.last_offline_time = lose_time  # 修改玩家最后在线时间
+
+        for i, chunk in enumerate(chunks):
+            with self.data_manager.data_ctl_lock:
+                if chunk not in self.data_manager.chunks:  # 已经被归档
+                    continue
+                runs: list[PointRun] = list(self.data_manager.get_chunk_runs(chunk))
+            for run in runs:
+                last_time = run.end
+                if run.players is last_list:  # 与上一个游程共享同一个玩家列表, 没有玩家上下线
+                    continue
+                last_list = run.players
+                players_set = set(run.players)  # 获取当前游程的玩家集合
+                # 计算新增和下线玩家
+                for player in players_set - last_players:
+                    if player.name not in player_infos:
+                        player_infos[player.name] = PlayerOnlineInfo(player.name, run.start)  # 新增当前不存在在线数据的玩家
+                    else:
+                        player_infos[player.name].last_offline_time = run.start  # 修改已存在玩家的最后在线时间
+                lose_players(last_players - players_set, run.start)
+                last_players = players_set
 
-            # 善后工作awa
-            last_players = players_set
             if perf_counter() - last_progress > 0.5:  # OMG这个脚本怎么跑这么快
-                wx.CallAfter(self.analyze_gauge.SetValue, (i / length) * 100)
+                wx.CallAfter(self.analyze_gauge.SetValue, (i / len(chunks)) * 100)
                 last_progress = perf_counter()
+        if last_time is not None:  # 最后的数据点处理所有玩家
+            lose_players(last_players, last_time)
 
         wx.CallAfter(self.analyze_gauge.SetValue, 100)
         logger.info("分析完成")
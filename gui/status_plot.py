@@ -2,9 +2,9 @@
 状态面板
 提供 在线人数图表 的GUI定义文件
 """
-from bisect import bisect_right
 from time import localtime, strftime, time, perf_counter
 
+import numpy as np
 from matplotlib import pyplot as plt
 from matplotlib import rcParams as mpl_rcParams
 from matplotlib.backends import backend_wxagg as wxagg
@@ -18,6 +18,8 @@ from gui.widget import *
 from lib.common_data import common_data
 from lib.data import *
 from lib.perf import Counter
+from lib.point_arrays import PointArrays, to_local_datetimes
+from lib.point_store import PointStore
 
 mpl_rcParams["font.family"] = "Microsoft YaHei"
 plt.rcParams["axes.unicode_minus"] = False
@@ -36,63 +38,6 @@ class UniqueIntFormatter(Formatter):
         return [str(v)[:-2] if v in unique_ints else '' for v in values]
 
 
-class BiDict:
-    def __init__(self):
-        self._forward = dict()  # int -> str
-        self._reverse = dict()  # str -> int
-
-    def __getitem__(self, key):
-        if isinstance(key, int):
-            return self._forward[key]
-        elif isinstance(key, str):
-            return self._reverse[key]
-        else:
-            raise TypeError("Keys must be int or str")
-
-    def __setitem__(self, key, value):
-        if not isinstance(key, int):
-            raise TypeError("Keys must be integers")
-        if not isinstance(value, str):
-            raise TypeError("Values must be strings")
-        # 移除旧的映射（如果存在）
-        if key in self._forward:
-            old_value = self._forward[key]
-            del self._reverse[old_value]
-        # 检查新值是否重复
-        if value in self._reverse:
-            raise ValueError(f"Duplicate value '{value}' found")
-        # 更新双向映射
-        self._forward[key] = value
-        self._reverse[value] = key
-
-    def __delitem__(self, key):
-        if isinstance(key, int):
-            value = self._forward.pop(key)
-            del self._reverse[value]
-        elif isinstance(key, str):
-            original_key = self._reverse.pop(key)
-            del self._forward[original_key]
-        else:
-            raise TypeError("Key must be int or str")
-
-    def __len__(self):
-        return len(self._forward)
-
-    def __iter__(self):
-        return iter(self._forward)
-
-    def values(self):
-        return self._forward.values()
-
-    def clear(self):
-        self._forward.clear()
-        self._reverse.clear()
-
-    def update(self, other):
-        for key, value in iter(other):
-            self[key] = value
-
-
 class StatusPanel(wx.SplitterWindow):
     def __init__(self, parent: wx.Window):
         super().__init__(parent)
@@ -137,7 +82,6 @@ class CapList(wx.Panel):
     def __init__(self, parent: wx.Window):
         super().__init__(parent)
         self.data_manager = common_data.data_manager
-        self.point_id_mapping = BiDict()
         sizer = wx.BoxSizer(wx.VERTICAL)
         title = CenteredText(self, label="数据点列表")
         title.SetFont(ft(14))
@@ -159,6 +103,8 @@ class CapList(wx.Panel):
             wx.AcceleratorTable([wx.AcceleratorEntry(wx.ACCEL_CTRL, ord("A"), ID_SELECT_ALL)])
         )
         self.line_height = self.get_line_height()
+        self.shift_seq = self.data_manager.shift_seq  # 列表当前行号对应的数据点位置移动序号
+        self.sync_pending = False
         self.cap_list.SetItemCount(10000)
         self.cap_list.OnGetItemText = self.OnGetItemText
         self.cap_list.Bind(wx.EVT_LIST_ITEM_RIGHT_CLICK, self.on_item_menu)
@@ -172,7 +118,17 @@ class CapList(wx.Panel):
         return height
 
     def OnGetItemText(self, item: int, col: int):
-        pt = self.data_manager.get_point(self.point_id_mapping[item])
+        if self.data_manager.shift_seq != self.shift_seq:  # 数据块被加载或释放, 行号已经移动, 换算前不显示旧行号的内容
+            if not self.sync_pending:
+                self.sync_pending = True
+                wx.CallAfter(self.sync_rows)
+            return ""
+        if item >= len(self.data_manager.points):
+            return ""
+        return self.get_point_text(self.data_manager.points[item], item, col)
+
+    @staticmethod
+    def get_point_text(pt: ServerPoint, item: int, col: int) -> str:
         if col == 0:
             return str(item + 1)
         elif col == 1:
@@ -186,18 +142,76 @@ class CapList(wx.Panel):
         else:
             return ""
 
+    def map_rows(self, rows: list[int], since: int, until: int, snap: bool = False) -> list[int] | None:
+        """
+        按数据管理器的位置移动记录换算行号
+        :param rows: 移动序号为 since 时的行号
+        :param since: 起始移动序号
+        :param until: 目标移动序号
+        :param snap: 数据点已被释放时, 为True则换算为释放处的行号, 否则为-1
+        :return: 移动序号为 until 时的行号, 记录已经不完整时返回None
+        """
+        shifts = [shift for shift in list(self.data_manager.shift_log) if since < shift[0] <= until]
+        if len(shifts) != until - since:
+            return None
+        for _, start, delta in shifts:
+            released_to = start if snap else -1
+            if delta >= 0:
+                rows = [row + delta if row >= start else row for row in rows]
+            else:
+                rows = [row + delta if row >= start - delta else (released_to if row >= start else row) for row in rows]
+        return rows
+
+    def sync_rows(self):
+        """数据块被加载或释放后, 更新行数并换算顶部行和选中的行, 保持显示的内容不变"""
+        self.sync_pending = False
+        since, until = self.shift_seq, self.data_manager.shift_seq
+        if since == until:
+            return
+        top = self.cap_list.GetTopItem()
+        selected = []
+        item = self.cap_list.GetFirstSelected()
+        while item != -1:
+            selected.append(item)
+            item = self.cap_list.GetNextSelected(item)
+        for item in selected:
+            self.cap_list.Select(item, False)
+        rows = self.map_rows([top], since, until, snap=True)
+        selected = self.map_rows(selected, since, until)
+        self.shift_seq = until
+        self.cap_list.SetItemCount(len(self.data_manager.points))
+        if rows is not None:
+            self.cap_list.ScrollList(0, (rows[0] - self.cap_list.GetTopItem()) * self.line_height)
+        for item in selected or []:
+            if item >= 0:
+                self.cap_list.Select(item)
+        self.cap_list.Refresh()
+
+    def get_row_point(self, item: int) -> tuple[int, ServerPoint] | None:
+        """列表第 item 行当前的行号和数据点, 数据点已被释放出内存时返回None"""
+        since = self.shift_seq
+        self.sync_rows()
+        rows = self.map_rows([item], since, self.shift_seq)
+        if rows is None or not 0 <= rows[0] < len(self.data_manager.points):
+            logger.warning(f"第 {item + 1} 行的数据点已被释放出内存, 请重新选择")
+            return None
+        return rows[0], self.data_manager.points[rows[0]]
+
     def on_item_menu(self, event: wx.ListEvent):
         item = event.GetIndex()
-        if item >= 0:
+        row_point = self.get_row_point(item) if item >= 0 else None
+        if row_point is not None:
+            row, point = row_point
+
             def get_data(column: int):
-                return self.cap_list.GetItem(item, column).GetText()
+                return self.get_point_text(point, row, column)
 
             def copy_data(column: int):
                 wx.TheClipboard.SetData(wx.TextDataObject(get_data(column)))
 
             def copy_detail():
                 text = f"ID: {get_data(0)}\n时间: {get_data(1)}\n在线: {get_data(3)}\n玩家们: "
-                player_names = self.cap_list.GetItem(item, 4).GetText().split(", ")
+                player_names = get_data(4).split(", ")
                 players = ""
                 for i, player in enumerate(player_names):
                     if i == len(player_names) - 1:
@@ -219,42 +233,46 @@ class CapList(wx.Panel):
             menu.Bind(wx.EVT_MENU, lambda e: copy_data(4), id=line.GetId())
             menu.AppendSeparator()
             line: wx.MenuItem = menu.Append(-1, "设为预览")
-            menu.Bind(wx.EVT_MENU, lambda e: self.set_as_overview(item), id=line.GetId())
+            menu.Bind(wx.EVT_MENU, lambda e: self.set_as_overview(point), id=line.GetId())
             line: wx.MenuItem = menu.Append(-1, "删除")
-            menu.Bind(wx.EVT_MENU, lambda e: self.delete_item(item), id=line.GetId())
+            menu.Bind(wx.EVT_MENU, lambda e: self.delete_item(point), id=line.GetId())
             self.PopupMenu(menu, event.GetPoint())
         else:
             event.Skip()
 
-    def delete_item(self, item: int):
-        point: ServerPoint = self.data_manager.get_point(self.point_id_mapping[item])
+    def delete_item(self, point: ServerPoint):
+        """菜单弹出期间数据块可能被释放, 按数据点删除, 不再使用弹出时的行号"""
+        self.sync_rows()
         self.data_manager.remove_point(point)
-        del self.point_id_mapping[item]
-        values = list(self.point_id_mapping.values())
-        self.point_id_mapping.clear()
-        self.point_id_mapping.update(enumerate(values))
-        self.cap_list.SetItemCount(self.cap_list.GetItemCount() - 1)
+        self.sync_rows()
+        self.cap_list.SetItemCount(len(self.data_manager.points))
         self.cap_list.Refresh()
 
-    def set_as_overview(self, item: int):
-        point: ServerPoint = self.data_manager.get_point(self.point_id_mapping[item])
+    def set_as_overview(self, point: ServerPoint):
         event = SetAsOverviewEvent(point)
         event.SetEventObject(self)
         self.ProcessEvent(event)
 
     def load_point(self, point: ServerPoint, runtime_add: bool = False):
-        line = self.cap_list.GetItemCount()
-        self.point_id_mapping[line] = point.id_
-        self.cap_list.SetItemCount(line + 1)
-        if runtime_add:
+        """列表直接按位置读取数据管理器中的数据点, 只需要更新行数"""
+        self.sync_rows()
+        line = self.data_manager.points.index(point)
+        self.cap_list.SetItemCount(len(self.data_manager.points))
+        if runtime_add and line >= 0:
             self.cap_list.ScrollList(0, (line - 1) * self.line_height)
 
+    def load_history(self, points: list[ServerPoint]):
+        """后台加载的更早的数据点排在列表前面, 滚动相同的行数以保持当前显示的内容"""
+        self.sync_rows()
+        self.cap_list.SetItemCount(len(self.data_manager.points))
+        self.cap_list.ScrollList(0, len(points) * self.line_height)
+        self.cap_list.Refresh()
+
     def points_init(self, points: list[ServerPoint]):
         timer = Counter()
         timer.start()
+        self.shift_seq = self.data_manager.shift_seq
         self.cap_list.SetItemCount(len(points))
-        for i, point in enumerate(points):
-            self.point_id_mapping[i] = point.id_
         logger.debug(f"数据点列表初始化用时: {timer.endT()}")
         self.cap_list.ScrollList(0, (self.cap_list.GetItemCount() - 1) * self.line_height)
 
@@ -263,8 +281,11 @@ class CapList(wx.Panel):
             self.cap_list.Select(i)
 
     def jump_to_point(self, point: ServerPoint):
+        self.sync_rows()
+        line = self.data_manager.points.index(point)
+        if line < 0:  # 按需加载的历史数据点和修复空隙的数据点不在列表中
+            return
         show_lines = self.cap_list.GetSize()[1] // self.line_height
-        line = self.point_id_mapping[point.id_]
         self.cap_list.Select(line)
         self.cap_list.ScrollList(0, (line - show_lines // 2 - self.cap_list.GetScrollPos(wx.VERTICAL)) * self.line_height)
 
@@ -346,9 +367,10 @@ class Plot(wxagg.FigureCanvasWxAgg):
         axes.set_title("在线人数")
         axes.set_xlabel("时间")
         axes.set_ylabel("在线人数")
-        self.raw_datas: dict[float, ServerPoint] = {}
-        self.datas: dict[float, ServerPoint] = {}
-        self.showing_datas: dict[float, ServerPoint] = {}
+        self.raw_datas: PointStore[ServerPoint] = PointStore()
+        self.datas: PointStore[ServerPoint] = PointStore(arrays=PointArrays())  # 绘图时直接切片列式数组
+        self.showing_datas: list[ServerPoint] = []
+        self.showing_times: np.ndarray = np.empty(0)
         self.axes = axes
         self.offset: int = 0  # 当前显示的起始索引
         self.scale: float = 1.0  # 显示的数据占总数据的百分比
@@ -372,12 +394,11 @@ class Plot(wxagg.FigureCanvasWxAgg):
         if percent < 0 or percent > 1:
             self.tooltip.set_tip("")
             return
-        times = sorted(self.showing_datas.keys())
-        min_time = min(times)
-        exact_time = (max(times) - min_time) * percent + min_time
-        index = bisect_right(times, exact_time)
-        closest_time = times[index - 1]
-        point = self.active_mouse_point = self.showing_datas[closest_time]
+        min_time = self.showing_times[0]
+        exact_time = (self.showing_times[-1] - min_time) * percent + min_time
+        index = int(np.searchsorted(self.showing_times, exact_time, "right"))
+        point = self.active_mouse_point = self.showing_datas[max(index - 1, 0)]
+        closest_time = point.time
 
         time_str = datetime.fromtimestamp(closest_time).strftime('%Y-%m-%d %H:%M:%S')
         players = ""
@@ -393,7 +414,12 @@ class Plot(wxagg.FigureCanvasWxAgg):
 
     def update_filter(self, filter_: DataFilter):
         self.activate_filter = filter_
-        self.datas = {p.time: p for p in filter_.filter_points(self.raw_datas)}  # 根据筛选条件更新数据
+        points = filter_.filter_points(self.raw_datas)  # 根据筛选条件更新数据
+        if (config.lazy_load or config.raw_retention_days) and filter_.from_time is not None:  # 补上未常驻内存和已归档的历史数据
+            known_times = {p.time for p in points}
+            points += [p for p in common_data.data_manager.get_points_range(filter_.from_time, filter_.to_time, True)
+                       if p.time not in known_times]
+        self.datas = PointStore(points, PointArrays())
         if filter_.from_time is not None:
             self.scale = 1.0
             self.offset = 0
@@ -466,19 +492,45 @@ class Plot(wxagg.FigureCanvasWxAgg):
         """
         if point.time >= self.last_point_time + config.fix_sep:
             self.add_data(point.copy(self.last_point_time + ((point.time - self.last_point_time) / 2)), fix_add=True)
-        self.raw_datas[point.time] = point
+        self.raw_datas.add(point)
         if self.activate_filter.check(point):
-            self.datas[point.time] = point
+            self.datas.add(point)
         if not fix_add:
             self.last_point_time = point.time
 
+    def load_history(self, points: list[ServerPoint]):
+        """
+        加入后台加载的一批更早的数据点, 保持当前显示的时间范围不变
+        :param points: 数据点列表
+        """
+        showing = int(len(self.datas) * self.scale)
+        first_time = self.showing_times[0] if len(self.showing_times) else float("inf")
+        for point in points:
+            self.raw_datas.append(point)
+        self.raw_datas.sort()
+        added = [point for point in points if self.activate_filter.check(point)]
+        for point in added:
+            self.datas.append(point)
+        self.datas.sort()
+        if not self.datas:
+            return
+        if showing:
+            self.offset += sum(1 for point in added if point.time < first_time)
+            self.scale = clamp(showing / len(self.datas), 0, 1)
+        else:
+            self.offset = int(len(self.datas) * (1 - self.scale))
+        if self.draw_call.IsRunning():
+            self.draw_call.Restart()
+        else:
+            self.draw_call.Start()
+
     def points_init(self, points: list[ServerPoint]):
         """
         用数据点初始化图表
         :param points: 数据点列表
         """
-        self.raw_datas = {p.time: p for p in points}
-        self.datas = {p.time: p for p in points}
+        self.raw_datas = PointStore(points)
+        self.datas = PointStore(points, PointArrays())
         self.last_point_time = points[-1].time if points else time()
         self.scale = 0.15
         self.offset = int(len(self.datas) * (1 - self.scale))
@@ -493,16 +545,27 @@ class Plot(wxagg.FigureCanvasWxAgg):
         self.axes.cla()
         self.axes.grid(True)
         start, stop = self.offset, self.offset + int(len(self.datas) * self.scale)
-        self.showing_datas = slice_dict(self.datas, start, stop)
+        self.showing_datas = self.datas[start:stop]
+        self.showing_times = self.datas.arrays.times[start:stop]
         if len(self.showing_datas) == 0:
             return
-        self.axes.set_xlim(datetime.fromtimestamp(min(self.showing_datas.keys())),
-                           datetime.fromtimestamp(max(self.showing_datas.keys())))
-        self.axes.plot(
-            [datetime.fromtimestamp(t) for t in self.showing_datas.keys()],
-            [p.online for p in self.showing_datas.values()],
-            color="#31AAC6", linewidth=1.5, alpha=0.8
-        )
+        min_time, max_time = float(self.showing_times[0]), float(self.showing_times[-1])
+        self.axes.set_xlim(datetime.fromtimestamp(min_time), datetime.fromtimestamp(max_time))
+        rollup = None
+        if len(self.showing_datas) > self.GetSize()[0] * 2:  # 数据点远多于像素时使用预先汇总的数据绘制
+            rollup = common_data.data_manager.get_rollup(min_time, max_time, self.GetSize()[0], True)
+        if rollup is not None and rollup[1]:
+            _, buckets = rollup
+            times = [datetime.fromtimestamp(start) for start, _ in buckets]
+            self.axes.fill_between(times, [b.online_min for _, b in buckets], [b.online_max for _, b in buckets],
+                                   color="#31AAC6", alpha=0.25, linewidth=0)
+            self.axes.plot(times, [b.online_mean for _, b in buckets], color="#31AAC6", linewidth=1.5, alpha=0.8)
+        else:
+            self.axes.plot(
+                to_local_datetimes(self.showing_times),
+                self.datas.arrays.online[start:stop],
+                color="#31AAC6", linewidth=1.5, alpha=0.8
+            )
         self.axes.xaxis.set_major_formatter(DateFormatter('%d %H:%M'))
         self.axes.yaxis.set_major_formatter(UniqueIntFormatter())
         self.figure.canvas.draw()
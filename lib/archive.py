@@ -0,0 +1,87 @@
+"""
+数据归档
+超过保留期限的数据块从数据文件夹移入 archive 文件夹, 启动时不再加载
+归档文件使用最紧凑的无损格式; 关闭原始数据归档时只保留汇总
+索引中记录每个归档时间窗口的时间范围、数据点数和粗粒度汇总, 查询很早的历史时不需要打开归档文件
+"""
+import json
+from dataclasses import dataclass
+from os import mkdir, replace
+from os.path import join, exists
+from typing import Iterator
+
+from lib.config import DataSaveFmt, DataCompress
+from lib.log import logger
+from lib.rollup import ChunkRollup
+
+ARCHIVE_DIR_NAME = "archive"
+ARCHIVE_INDEX_NAME = "index.json"
+ARCHIVE_VERSION = 1
+ARCHIVE_FMT = DataSaveFmt.PLAYER_LIST_MAPPING  # 无损且较紧凑的格式
+ARCHIVE_COMPRESS = DataCompress.LZMA
+ARCHIVE_MIN_TIER = 3600  # 归档后只保留不低于该精度的汇总 (秒)
+
+
+@dataclass
+class ArchiveEntry:
+    """一个已归档时间窗口的索引记录"""
+    file_name: str | None  # 归档文件名, None 表示只保留了汇总
+    min_time: float
+    max_time: float
+    count: int
+    rollup: ChunkRollup
+
+
+class ArchiveStore:
+    """归档文件夹, 索引在第一次使用时读取, 键为时间窗口的文件名 (不含扩展名)"""
+
+    def __init__(self, data_dir: str):
+        self.dir_path = join(data_dir, ARCHIVE_DIR_NAME)
+        self.index_path = join(self.dir_path, ARCHIVE_INDEX_NAME)
+        self.entries: dict[str, ArchiveEntry] | None = None
+
+    def load(self) -> dict[str, ArchiveEntry]:
+        """读取索引, 已读取过时直接返回"""
+        if self.entries is not None:
+            return self.entries
+        self.entries = {}
+        if not exists(self.index_path):
+            return self.entries
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data["version"] != ARCHIVE_VERSION:
+                logger.warning(f"归档索引版本不同 -> {data['version']}")
+                return self.entries
+            for stem, raw in data["windows"].items():
+                self.entries[stem] = ArchiveEntry(raw["file"], raw["min_time"], raw["max_time"], raw["count"],
+                                                  ChunkRollup.from_json(raw["rollup"]))
+        except (OSError, ValueError, KeyError, TypeError, IndexError) as e:
+            logger.error(f"读取归档索引失败 -> {e}")
+        return self.entries
+
+    def save(self):
+        windows = {}
+        for stem, entry in sorted(self.load().items()):
+            windows[stem] = {"file": entry.file_name, "min_time": entry.min_time, "max_time": entry.max_time,
+                             "count": entry.count, "rollup": entry.rollup.to_json(ARCHIVE_MIN_TIER)}
+        self.ensure_dir()
+        with open(self.index_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"version": ARCHIVE_VERSION, "windows": windows}, f, separators=(",", ":"))
+        replace(self.index_path + ".tmp", self.index_path)
+
+    def ensure_dir(self):
+        if not exists(self.dir_path):
+            mkdir(self.dir_path)
+
+    def get(self, stem: str) -> ArchiveEntry | None:
+        return self.load().get(stem)
+
+    def put(self, stem: str, entry: ArchiveEntry):
+        self.load()[stem] = entry
+
+    def iter_range(self, from_time: float, to_time: float) -> Iterator[ArchiveEntry]:
+        """按时间顺序遍历和时间范围有交集的归档记录"""
+        for entry in sorted(self.load().values(), key=lambda e: e.min_time):
+            if entry.max_time >= from_time and entry.min_time <= to_time:
+                yield entry
@@ -0,0 +1,321 @@
+"""
+数据定时备份
+数据文件夹中的文件按内容的哈希存放在备份文件夹的 objects 中, 内容没有变化的文件只会被复制一次
+每次备份只写入一个很小的快照清单 (snapshots/<时间>.json), 记录每个文件的相对路径、哈希、大小和修改时间
+大小和修改时间与上一个快照相同的文件直接沿用记录的哈希, 不需要重新读取
+后台线程按配置的间隔备份, 每复制完一个文件按读写的字节数休眠, 限制对磁盘的占用; 备份完成后清理多余的旧快照
+持有写数据文件的锁时只把文件复制到备份文件夹中的临时文件, 计算哈希在锁外进行; 锁外不会打开数据文件,
+Windows 上打开的文件 (包括硬链接) 会让保存时替换和删除数据文件失败
+"""
+import hashlib
+import json
+from contextlib import AbstractContextManager
+from dataclasses import dataclass
+from os import listdir, makedirs, remove, replace, stat, utime, walk
+from os.path import join, exists, relpath, abspath, dirname, isdir, splitext
+from threading import Thread, Event
+from time import time, perf_counter, strftime, localtime
+
+from lib.config import config
+from lib.data import DataManager
+from lib.log import logger
+from lib.snapshot import SNAPSHOT_FILE_NAME
+
+BACKUP_VERSION = 1
+OBJECTS_DIR_NAME = "objects"
+SNAPSHOTS_DIR_NAME = "snapshots"
+STAGING_FILE_NAME = "staging.tmp"  # objects 中暂存正在备份的文件的临时文件
+COPY_BLOCK_SIZE = 1 << 20
+EXCLUDE_FILES = {SNAPSHOT_FILE_NAME}  # 启动快照可以由数据文件重建, 且每次退出都会重写
+MAX_PASSES = 3  # 备份过程中数据文件夹有变动时, 最多重新扫描几次
+IDLE_WAIT = 60.0  # 备份关闭或还没到备份时间时, 等待多久再检查 (秒)
+RETRY_WAIT = 600.0  # 备份失败后, 等待多久再重试 (秒)
+
+
+@dataclass
+class BackupFile:
+    """快照中的一个文件"""
+    digest: str  # 内容的 sha256
+    size: int
+    mtime_ns: int
+
+    def to_json(self) -> list:
+        return [self.digest, self.size, self.mtime_ns]
+
+    @staticmethod
+    def from_json(raw: list) -> "BackupFile":
+        return BackupFile(raw[0], raw[1], raw[2])
+
+
+class IoThrottle:
+    """按字节数休眠, 把平均读写速度限制在配置的速度以下, 停止标志被设置时立即返回"""
+
+    def __init__(self, mb_per_sec: float, stop_flag: Event):
+        self.bytes_per_sec = mb_per_sec * 1024 * 1024
+        self.stop_flag = stop_flag
+
+    def consume(self, size: int, cost: float):
+        """
+        :param size: 刚刚读写的字节数
+        :param cost: 读写实际花费的时间 (秒)
+        """
+        if self.bytes_per_sec > 0 and size:
+            self.stop_flag.wait(max(0.0, size / self.bytes_per_sec - cost))
+
+
+class BackupStore:
+    """备份文件夹, 快照按名称 (创建时间) 排序"""
+
+    def __init__(self, backup_dir: str):
+        self.dir_path = backup_dir
+        self.objects_dir = join(backup_dir, OBJECTS_DIR_NAME)
+        self.snapshots_dir = join(backup_dir, SNAPSHOTS_DIR_NAME)
+
+    def ensure_dirs(self):
+        makedirs(self.objects_dir, exist_ok=True)
+        makedirs(self.snapshots_dir, exist_ok=True)
+
+    def object_path(self, digest: str) -> str:
+        return join(self.objects_dir, digest[:2], digest)
+
+    def list_snapshots(self) -> list[str]:
+        """按时间顺序返回全部快照名"""
+        if not exists(self.snapshots_dir):
+            return []
+        return sorted(splitext(file)[0] for file in listdir(self.snapshots_dir) if file.endswith(".json"))
+
+    def load_snapshot(self, name: str) -> tuple[float, dict[str, BackupFile]]:
+        """
+        读取快照
+        :return: (备份时间, 相对路径 -> 文件)
+        :raises OSError: 读取失败
+        :raises ValueError: 快照损坏或版本不同
+        """
+        with open(join(self.snapshots_dir, name + ".json"), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != BACKUP_VERSION:
+            raise ValueError(f"快照版本不同 -> {data.get('version')}")
+        try:
+            return data["time"], {path: BackupFile.from_json(raw) for path, raw in data["files"].items()}
+        except (KeyError, TypeError, IndexError) as e:
+            raise ValueError(f"快照损坏 -> {e}")
+
+    def save_snapshot(self, created: float, files: dict[str, BackupFile]) -> str:
+        """写入快照, 返回快照名"""
+        base = strftime("%Y%m%d-%H%M%S", localtime(created))
+        name = base
+        index = 1
+        while exists(join(self.snapshots_dir, name + ".json")):
+            name = f"{base}-{index}"
+            index += 1
+        path = join(self.snapshots_dir, name + ".json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"version": BACKUP_VERSION, "time": created,
+                       "files": {rel: file.to_json() for rel, file in sorted(files.items())}},
+                      f, separators=(",", ":"))
+        replace(path + ".tmp", path)
+        return name
+
+    def latest_files(self) -> dict[str, BackupFile]:
+        """最近一个可以读取的快照中的文件, 没有快照时返回空字典"""
+        for name in reversed(self.list_snapshots()):
+            try:
+                return self.load_snapshot(name)[1]
+            except (OSError, ValueError) as e:
+                logger.warning(f"读取备份快照 [{name}] 失败 -> {e}")
+        return {}
+
+    def list_source_files(self, data_dir: str) -> list[str]:
+        """数据文件夹中需要备份的文件的相对路径 (使用 / 分隔), 备份文件夹位于数据文件夹内时会被跳过"""
+        skip_dir = abspath(self.dir_path)
+        paths = []
+        for root, dirs, files in walk(data_dir):
+            dirs[:] = [d for d in dirs if abspath(join(root, d)) != skip_dir]
+            for file in files:
+                if file.endswith(".tmp") or file in EXCLUDE_FILES:
+                    continue
+                paths.append(relpath(join(root, file), data_dir).replace("\\", "/"))
+        return sorted(paths)
+
+    def store_file(self, file_path: str, previous: BackupFile | None,
+                   lock: AbstractContextManager) -> tuple[BackupFile, int] | None:
+        """
+        把一个文件存入 objects, 内容已经存在时不会重复写入
+        持有锁时把文件复制到 objects 中的临时文件, 保证复制的是完整写入的文件; 释放锁后再计算哈希并改名
+        :param previous: 上一个快照中同一路径的文件, 大小和修改时间相同时直接沿用
+        :param lock: 写数据文件时持有的锁
+        :return: (文件记录, 读写的字节数), 文件已经不存在时返回None
+        :raises OSError: 读写失败
+        """
+        staging_path = join(self.objects_dir, STAGING_FILE_NAME)
+        with lock:
+            try:
+                st = stat(file_path)
+            except FileNotFoundError:
+                return None
+            if previous is not None and previous.size == st.st_size and previous.mtime_ns == st.st_mtime_ns and \
+                    exists(self.object_path(previous.digest)):
+                return previous, 0
+            with open(file_path, "rb") as src, open(staging_path, "wb") as dst:
+                size = st.st_size  # 预写日志可能在复制时被追加, 只复制获取信息时的长度
+                while size > 0 and (block := src.read(min(COPY_BLOCK_SIZE, size))):
+                    size -= len(block)
+                    dst.write(block)
+        sha = hashlib.sha256()
+        with open(staging_path, "rb") as f:
+            while block := f.read(COPY_BLOCK_SIZE):
+                sha.update(block)
+        digest = sha.hexdigest()
+        record = BackupFile(digest, st.st_size, st.st_mtime_ns)
+        obj_path = self.object_path(digest)
+        if exists(obj_path):
+            remove(staging_path)
+        else:
+            makedirs(dirname(obj_path), exist_ok=True)
+            replace(staging_path, obj_path)
+        return record, st.st_size * 3
+
+    def backup(self, data_dir: str, lock: AbstractContextManager, throttle: IoThrottle,
+               stop_flag: Event) -> str | None:
+        """
+        备份数据文件夹
+        每个文件在持有锁时复制到临时文件, 保证读到的是完整写入的文件, 见 store_file; 扫描完成后重新列出文件, 补上备份过程中新出现的文件
+        :param lock: 写数据文件时持有的锁
+        :return: 快照名, 被停止时返回None
+        :raises OSError: 读写失败
+        """
+        self.ensure_dirs()
+        created = time()
+        previous = self.latest_files()
+        files: dict[str, BackupFile] = {}
+        written = 0
+        for _ in range(MAX_PASSES):
+            with lock:
+                paths = set(self.list_source_files(data_dir))
+            files = {rel: file for rel, file in files.items() if rel in paths}  # 去掉已经被删除的文件
+            pending = sorted(paths - files.keys())
+            if not pending:
+                break
+            for rel in pending:
+                if stop_flag.is_set():
+                    return None
+                start = perf_counter()
+                result = self.store_file(join(data_dir, *rel.split("/")), previous.get(rel), lock)
+                if result is None:
+                    continue
+                files[rel], size = result
+                written += size
+                throttle.consume(size, perf_counter() - start)
+        name = self.save_snapshot(created, files)
+        total = sum(file.size for file in files.values())
+        logger.info(f"已备份数据文件夹到快照 [{name}], 共 {len(files)} 个文件 ({total / 1024 / 1024:.1f} MB), "
+                    f"读写 {written / 1024 / 1024:.1f} MB")
+        return name
+
+    def restore(self, name: str, target_dir: str) -> int:
+        """
+        把快照恢复到一个空的文件夹, 逐个校验文件的哈希, 并恢复文件的修改时间 (数据块清单依靠它判断文件是否改动过)
+        :return: 恢复的文件数
+        :raises OSError: 读写失败
+        :raises ValueError: 快照损坏、目标文件夹不为空或文件校验失败
+        """
+        _, files = self.load_snapshot(name)
+        if isdir(target_dir) and listdir(target_dir):
+            raise ValueError(f"目标文件夹不为空 -> {target_dir}")
+        for rel, file in files.items():
+            dst_path = join(target_dir, *rel.split("/"))
+            makedirs(dirname(dst_path), exist_ok=True)
+            sha = hashlib.sha256()
+            with open(self.object_path(file.digest), "rb") as src, open(dst_path, "wb") as dst:
+                while block := src.read(COPY_BLOCK_SIZE):
+                    sha.update(block)
+                    dst.write(block)
+            if sha.hexdigest() != file.digest:
+                raise ValueError(f"文件 [{rel}] 的备份已损坏")
+            utime(dst_path, ns=(file.mtime_ns, file.mtime_ns))
+        logger.info(f"已从快照 [{name}] 恢复 {len(files)} 个文件到 [{target_dir}]")
+        return len(files)
+
+    def prune(self, keep: int) -> tuple[int, int]:
+        """
+        只保留最近的若干个快照, 并删除不再被任何快照引用的文件
+        读取失败的快照不会被删除, 它引用的文件也无法确定, 这时不删除任何文件
+        :return: (删除的快照数, 删除的文件数)
+        """
+        names = self.list_snapshots()
+        removed_names = names[:-keep] if keep > 0 else []
+        for name in removed_names:
+            remove(join(self.snapshots_dir, name + ".json"))
+        referenced: set[str] = set()
+        for name in names[len(removed_names):]:
+            try:
+                referenced.update(file.digest for file in self.load_snapshot(name)[1].values())
+            except (OSError, ValueError) as e:
+                logger.warning(f"读取备份快照 [{name}] 失败, 跳过清理文件 -> {e}")
+                return len(removed_names), 0
+        removed_objects = 0
+        if exists(self.objects_dir):
+            for root, _, files in walk(self.objects_dir):
+                for file in files:
+                    if file not in referenced:  # 包括中断时留下的 .tmp 文件
+                        remove(join(root, file))
+                        removed_objects += 1
+        if removed_names or removed_objects:
+            logger.info(f"已清理 {len(removed_names)} 个旧的备份快照和 {removed_objects} 个不再引用的文件")
+        return len(removed_names), removed_objects
+
+
+class BackupScheduler:
+    """后台定时备份线程"""
+
+    def __init__(self, data_manager: DataManager):
+        self.data_manager = data_manager
+        self.stop_flag = Event()
+        self.thread = Thread(name="Backup", target=self.backup_thread_func, daemon=True)
+        self.last_backup: tuple[str, float] | None = None  # (备份文件夹, 最近一次备份的时间)
+
+    def start(self):
+        if config.enable_backup and not self.thread.is_alive():
+            self.thread.start()
+
+    def stop(self):
+        """停止备份, 正在复制的文件完成后退出, 未完成的备份不会写入快照"""
+        self.stop_flag.set()
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def get_last_backup_time(self, store: BackupStore) -> float:
+        """备份文件夹中最近一次备份的时间, 备份文件夹改变时重新读取"""
+        if self.last_backup is None or self.last_backup[0] != store.dir_path:
+            names = store.list_snapshots()
+            last_time = 0.0
+            if names:
+                try:
+                    last_time = store.load_snapshot(names[-1])[0]
+                except (OSError, ValueError) as e:
+                    logger.warning(f"读取备份快照 [{names[-1]}] 失败 -> {e}")
+            self.last_backup = (store.dir_path, last_time)
+        return self.last_backup[1]
+
+    def backup_thread_func(self):
+        logger.info("定时备份已启动")
+        while not self.stop_flag.is_set():
+            if not config.enable_backup:
+                self.stop_flag.wait(IDLE_WAIT)
+                continue
+            store = BackupStore(config.backup_dir)
+            wait_time = self.get_last_backup_time(store) + config.backup_interval_hours * 3600 - time()
+            if wait_time > 0:
+                self.stop_flag.wait(min(IDLE_WAIT, wait_time))
+                continue
+            logger.info(f"开始备份数据文件夹到 [{store.dir_path}]...")
+            try:
+                name = store.backup(self.data_manager.data_dir, self.data_manager.save_lock,
+                                    IoThrottle(config.backup_io_mb, self.stop_flag), self.stop_flag)
+                if name is None:
+                    break
+                self.last_backup = (store.dir_path, time())
+                store.prune(config.backup_keep)
+            except OSError as e:
+                logger.error(f"备份数据文件夹时发生错误 -> {e}")
+                self.stop_flag.wait(RETRY_WAIT)
@@ -0,0 +1,61 @@
+"""
+数据块缓存
+按需加载模式下, 不常用的数据块只在查询时从文件解码, 解码结果放在这个LRU缓存里
+缓存按估算的内存占用淘汰最久没用过的数据块
+"""
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Callable
+
+from lib.log import logger
+
+
+class ChunkCache:
+    """带内存预算的LRU缓存, 键为数据文件名"""
+
+    def __init__(self, budget_bytes: int):
+        self.budget_bytes = budget_bytes
+        self.used_bytes = 0
+        self.entries: OrderedDict[str, tuple[Any, int]] = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str, loader: Callable[[], tuple[Any, int]]) -> Any:
+        """
+        获取缓存的数据块, 不存在时调用loader加载
+        :param key: 数据文件名
+        :param loader: 返回 (数据, 估算字节数) 的加载函数
+        """
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+        value, size = loader()
+        self.put(key, value, size)
+        return value
+
+    def put(self, key: str, value: Any, size: int):
+        with self.lock:
+            if key in self.entries:
+                self.used_bytes -= self.entries.pop(key)[1]
+            if size > self.budget_bytes:  # 单个数据块超过预算时不缓存
+                return
+            self.entries[key] = (value, size)
+            self.used_bytes += size
+            while self.used_bytes > self.budget_bytes:
+                old_key, (_, old_size) = self.entries.popitem(last=False)
+                self.used_bytes -= old_size
+                logger.debug(f"数据块缓存已满, 淘汰 [{old_key}]")
+
+    def discard(self, key: str):
+        with self.lock:
+            if key in self.entries:
+                self.used_bytes -= self.entries.pop(key)[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.used_bytes = 0
@@ -0,0 +1,82 @@
+"""
+后台压实
+在低优先级的后台线程中逐个处理数据块: 把旧的按数量切分的数据块按时间窗口重新切分, 把旧格式的数据块转换为当前格式
+没有需要压实的数据块时, 把超过保留期限的数据块移入归档, 再重新打包被覆盖的记录过多的打包文件
+每次只处理一个数据块, 处理完后按耗时休眠, 限制对磁盘和数据锁的占用, 避免影响状态获取和界面
+"""
+from threading import Thread, Event
+from time import perf_counter
+
+from lib.config import config
+from lib.data import DataManager
+from lib.log import logger
+
+IDLE_WAIT = 60.0  # 没有需要压实的数据块时, 等待多久再检查 (秒)
+BUSY_RATIO = 0.2  # 压实占用的时间比例上限
+
+
+class ChunkCompactor:
+    """后台压实线程"""
+
+    def __init__(self, data_manager: DataManager):
+        self.data_manager = data_manager
+        self.stop_flag = Event()
+        self.thread = Thread(name="Compactor", target=self.compact_thread_func, daemon=True)
+        self.compacted = 0
+
+    def start(self):
+        if config.background_compact and config.enable_data_save:
+            self.thread.start()
+
+    def stop(self):
+        """停止压实, 等待正在处理的数据块完成"""
+        self.stop_flag.set()
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def compact_thread_func(self):
+        logger.info("后台压实已启动")
+        while not self.stop_flag.is_set():
+            if not config.background_compact or not config.enable_data_save:
+                self.stop_flag.wait(IDLE_WAIT)
+                continue
+            chunk = self.data_manager.get_compact_chunk()
+            if chunk is None:
+                with self.data_manager.data_ctl_lock:
+                    expired = self.data_manager.get_expired_chunk()
+            else:
+                expired = None
+            sparse_pack = self.data_manager.packs.get_sparse_pack() if chunk is None and expired is None else None
+            if expired is not None:
+                start = perf_counter()
+                msg = self.data_manager.archive_chunk(expired)
+                cost = perf_counter() - start
+                if msg is not None:
+                    logger.warning(f"后台归档暂停 -> {msg}")
+                    self.stop_flag.wait(IDLE_WAIT)
+                    continue
+                self.stop_flag.wait(max(config.compact_interval, cost * (1 - BUSY_RATIO) / BUSY_RATIO))
+                continue
+            if sparse_pack is not None:
+                msg = self.data_manager.repack(sparse_pack)
+                if msg is not None:
+                    logger.warning(f"后台压实暂停 -> {msg}")
+                    self.stop_flag.wait(IDLE_WAIT)
+                    continue
+                self.stop_flag.wait(config.compact_interval)
+                continue
+            if chunk is None:
+                if self.compacted:
+                    logger.info(f"后台压实完成, 共处理 {self.compacted} 个数据块")
+                    self.compacted = 0
+                self.stop_flag.wait(IDLE_WAIT)
+                continue
+            start = perf_counter()
+            msg = self.data_manager.compact_chunk(chunk)
+            cost = perf_counter() - start
+            if msg is not None:
+                logger.warning(f"后台压实暂停 -> {msg}")
+                self.stop_flag.wait(IDLE_WAIT)
+                continue
+            self.compacted += 1
+            self.stop_flag.wait(max(config.compact_interval, cost * (1 - BUSY_RATIO) / BUSY_RATIO))
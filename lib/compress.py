@@ -0,0 +1,230 @@
+"""
+数据文件压缩
+支持 zlib / lzma / bz2 三种标准库编码, 压缩后的文件在原扩展名后追加压缩扩展名
+zlib 压缩会使用数据文件夹下的共享字典 (玩家名, UUID, 玩家列表哈希), 让小数据块也能压得很小
+"""
+import bz2
+import io
+import lzma
+import re
+import zlib
+from hashlib import md5
+from os import listdir, mkdir, replace
+from os.path import join, exists, dirname, getmtime
+from typing import BinaryIO, Iterable
+
+from lib.config import DataCompress
+from lib.log import logger
+
+COMPRESS_EXTS = {
+    DataCompress.ZLIB: ".z",
+    DataCompress.LZMA: ".xz",
+    DataCompress.BZ2: ".bz2",
+}
+ZDICT_DIR_NAME = "zdict"
+ZDICT_MAX_SIZE = 32 * 1024  # zlib 的窗口大小, 超出部分不会被使用
+ZLIB_MAGIC = b"CSZ1"
+ZDICT_ID_SIZE = 8
+STREAM_BLOCK_SIZE = 64 * 1024
+ZDICT_NAME_RE = re.compile(rb'\{"name": "([^"]*)", "uuid": "')
+JSON_KEYS = '{"fmt": 2, "points": [{"time": , "online": , "players": , "ping": }], "player_list_mapping": ' \
+            '"players_mapping": {"name": "", "uuid": "00000000-0000-0000-0000-000000000000"}'
+
+
+def get_compress_way(file_name: str) -> DataCompress:
+    """根据文件扩展名判断压缩方式"""
+    for way, ext in COMPRESS_EXTS.items():
+        if file_name.endswith(ext):
+            return way
+    return DataCompress.NONE
+
+
+def strip_compress_ext(file_name: str) -> str:
+    """去掉压缩扩展名, 得到原始的数据文件名"""
+    way = get_compress_way(file_name)
+    return file_name[:-len(COMPRESS_EXTS[way])] if way != DataCompress.NONE else file_name
+
+
+class SharedDict:
+    """zlib 共享字典, 内容不可变, 以内容哈希作为id"""
+
+    def __init__(self, content: bytes, names: set[str]):
+        self.content = content
+        self.names = names
+        self.dict_id = md5(content, usedforsecurity=False).digest()[:ZDICT_ID_SIZE]
+
+    @staticmethod
+    def build(players: Iterable[tuple[str, str]], list_hashes: Iterable[str]) -> "SharedDict":
+        """
+        构建共享字典, zlib 优先匹配字典末尾的内容, 所以把最常见的玩家名放在最后
+        :param players: (玩家名, UUID) 按出现次数从少到多排列
+        :param list_hashes: 玩家列表哈希, 按出现次数从少到多排列
+        """
+        parts = [JSON_KEYS]
+        parts.extend(f'"{list_hash}", ' for list_hash in list_hashes)
+        names = set()
+        for name, uuid in players:
+            parts.append(f'{{"name": "{name}", "uuid": "{uuid}"}}, ')
+            names.add(name)
+        content = "".join(parts).encode("utf-8")[-ZDICT_MAX_SIZE:]
+        return SharedDict(content, names)
+
+    @staticmethod
+    def from_content(content: bytes) -> "SharedDict":
+        """从字典文件的内容恢复字典, 玩家名从内容中解析 (开头被截断的玩家不计入)"""
+        names = {match.group(1).decode("utf-8", "replace") for match in ZDICT_NAME_RE.finditer(content)
+                 if match.group(1)}
+        return SharedDict(content, names)
+
+
+class SharedDictStore:
+    """管理数据文件夹下的共享字典, 旧字典会一直保留以便解压旧文件"""
+
+    def __init__(self, data_dir: str):
+        self.dict_dir = join(data_dir, ZDICT_DIR_NAME)
+        self.current: SharedDict | None = None
+
+    def load_latest(self):
+        """把最近生成的字典作为当前字典, 重启后玩家变化不大时继续使用, 不会每次启动都生成新字典"""
+        if not exists(self.dict_dir):
+            return
+        paths = [join(self.dict_dir, file) for file in listdir(self.dict_dir) if file.endswith(".zdict")]
+        if not paths:
+            return
+        latest = max(paths, key=getmtime)
+        try:
+            with open(latest, "rb") as f:
+                self.current = SharedDict.from_content(f.read())
+        except OSError as e:
+            logger.warning(f"读取压缩字典失败, 下次保存时重新生成 -> {e}")
+            return
+        logger.info(f"已加载压缩字典 [{self.current.dict_id.hex()}], 包含 {len(self.current.names)} 个玩家")
+
+    def update(self, players: list[tuple[str, str]], list_hashes: list[str]) -> SharedDict:
+        """
+        玩家名变化较大时重建字典, 否则继续使用当前字典
+        :param players: (玩家名, UUID) 按出现次数从少到多排列
+        :param list_hashes: 玩家列表哈希, 按出现次数从少到多排列
+        """
+        names = {name for name, _ in players}
+        if self.current is not None and len(names - self.current.names) <= len(names) // 10:
+            return self.current
+        self.current = SharedDict.build(players, list_hashes)
+        if not exists(self.dict_dir):
+            mkdir(self.dict_dir)
+        dict_path = join(self.dict_dir, self.current.dict_id.hex() + ".zdict")
+        if not exists(dict_path):
+            with open(dict_path + ".tmp", "wb") as f:
+                f.write(self.current.content)
+            replace(dict_path + ".tmp", dict_path)
+            logger.info(f"已生成压缩字典 [{self.current.dict_id.hex()}], 包含 {len(names)} 个玩家")
+        return self.current
+
+
+def load_zdict(file_path: str, dict_id: bytes) -> bytes:
+    """读取数据文件所在文件夹中的共享字典"""
+    if dict_id == bytes(ZDICT_ID_SIZE):
+        return b""
+    with open(join(dirname(file_path), ZDICT_DIR_NAME, dict_id.hex() + ".zdict"), "rb") as f:
+        return f.read()
+
+
+class ZlibDictReader(io.RawIOBase):
+    """流式解压带共享字典的 zlib 数据文件"""
+
+    def __init__(self, file_path: str, data: bytes | None = None):
+        super().__init__()
+        self.file = open(file_path, "rb") if data is None else io.BytesIO(data)
+        header = self.file.read(len(ZLIB_MAGIC) + ZDICT_ID_SIZE)
+        if header[:len(ZLIB_MAGIC)] != ZLIB_MAGIC:
+            self.file.close()
+            raise ValueError(f"不是压缩数据文件 -> {file_path}")
+        zdict = load_zdict(file_path, header[len(ZLIB_MAGIC):])
+        self.decompressor = zlib.decompressobj(zdict=zdict) if zdict else zlib.decompressobj()
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        buffer = b""
+        while not buffer and not self.decompressor.eof:
+            data = self.decompressor.unconsumed_tail or self.file.read(STREAM_BLOCK_SIZE)
+            if not data:
+                break
+            buffer = self.decompressor.decompress(data, len(b))  # 限制输出大小, 内存只占用一个块
+        b[:len(buffer)] = buffer
+        return len(buffer)
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+
+class ZlibDictWriter(io.RawIOBase):
+    """流式压缩带共享字典的 zlib 数据文件, 写入传入的流时关闭后不会关闭这个流"""
+
+    def __init__(self, file_path: str, shared_dict: SharedDict | None = None, raw: BinaryIO | None = None):
+        super().__init__()
+        self.file = open(file_path, "wb") if raw is None else raw
+        self.own_file = raw is None
+        if shared_dict is not None:
+            self.compressor = zlib.compressobj(9, zdict=shared_dict.content)
+            self.file.write(ZLIB_MAGIC + shared_dict.dict_id)
+        else:
+            self.compressor = zlib.compressobj(9)
+            self.file.write(ZLIB_MAGIC + bytes(ZDICT_ID_SIZE))
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self.file.write(self.compressor.compress(b))
+        return len(b)
+
+    def close(self):
+        if not self.closed:
+            self.file.write(self.compressor.flush())
+            if self.own_file:
+                self.file.close()
+        super().close()
+
+
+def open_compress_writer(file_path: str, way: DataCompress, shared_dict: SharedDict | None = None) -> BinaryIO:
+    """以二进制流的方式创建数据文件, 写入的数据会被流式压缩"""
+    if way == DataCompress.ZLIB:
+        return io.BufferedWriter(ZlibDictWriter(file_path, shared_dict), STREAM_BLOCK_SIZE)
+    elif way == DataCompress.LZMA:
+        return lzma.open(file_path, "wb")
+    elif way == DataCompress.BZ2:
+        return bz2.open(file_path, "wb")
+    return open(file_path, "wb")
+
+
+def compress_bytes(data: bytes, way: DataCompress, shared_dict: SharedDict | None = None) -> bytes:
+    """把数据文件的内容压缩为与压缩文件相同的格式, 用于写入打包文件"""
+    if way == DataCompress.ZLIB:
+        buffer = io.BytesIO()
+        with ZlibDictWriter("", shared_dict, buffer) as writer:
+            writer.write(data)
+        return buffer.getvalue()
+    elif way == DataCompress.LZMA:
+        return lzma.compress(data)
+    elif way == DataCompress.BZ2:
+        return bz2.compress(data)
+    return data
+
+
+def open_data_file(file_path: str, data: bytes | None = None) -> BinaryIO:
+    """
+    以二进制流的方式打开数据文件, 压缩文件会被流式解压
+    :param data: 不为None时从内存中的文件内容 (如打包文件中的数据块) 读取, file_path 只用于判断压缩方式和查找共享字典
+    """
+    way = get_compress_way(file_path)
+    if way == DataCompress.ZLIB:
+        return io.BufferedReader(ZlibDictReader(file_path, data), STREAM_BLOCK_SIZE)
+    source = file_path if data is None else io.BytesIO(data)
+    if way == DataCompress.LZMA:
+        return lzma.open(source, "rb")
+    elif way == DataCompress.BZ2:
+        return bz2.open(source, "rb")
+    return open(file_path, "rb") if data is None else source
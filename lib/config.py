@@ -13,6 +13,16 @@ class DataSaveFmt(Enum):
     NORMAL = 0
     PLAYER_LIST_MAPPING = 1
     PLAYER_MAPPING = 2
+    COLUMNAR = 3
+    RUN_LENGTH = 4
+
+
+class DataCompress(Enum):
+    NONE = 0
+    ZLIB = 1
+    LZMA = 2
+    BZ2 = 3
+
 
 class SkinLoadWay(Enum):
     MOJANG = 0
@@ -35,14 +45,32 @@ class Configer:
     addr: str = "127.0.0.1:25565"
     server_name: str = "MC服务器"
     check_inv: int = 60.0
-    points_per_file: int = 1200
+    chunk_span_hours: int = 24
     saved_per_points: int = 10
+    checkpoint_per_points: int = 1200
     fix_sep: float = 300.0
     min_online_time: int = 60
     data_load_threads: int = 8
+    data_load_process: bool = False
+    lazy_load: bool = False
+    chunk_cache_mb: int = 256
+    hot_window_hours: int = 72
+    startup_load_hours: int = 6
+    startup_snapshot: bool = True
     data_dir: str = "./data"
     enable_data_save: bool = True
     data_save_fmt: DataSaveFmt = DataSaveFmt.NORMAL
+    data_compress: DataCompress = DataCompress.NONE
+    pack_chunks: bool = False
+    background_compact: bool = True
+    compact_interval: float = 1.0
+    raw_retention_days: int = 0
+    archive_old_data: bool = True
+    enable_backup: bool = False
+    backup_dir: str = "./backup"
+    backup_interval_hours: float = 24.0
+    backup_keep: int = 7
+    backup_io_mb: float = 8.0
     time_out: float = 3.0
     retry_times: int = 3
     enable_full_players: bool = False
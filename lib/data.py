@@ -4,27 +4,80 @@
 定义数据存储类
 定义数据过滤类
 """
+import re
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from calendar import timegm
+from collections import Counter as CountDict
+from concurrent.futures import ProcessPoolExecutor
 from copy import copy
 from ctypes import windll
 from dataclasses import dataclass
 from hashlib import md5
-from os import listdir, remove, mkdir
-from os.path import join, basename, isfile
-from random import randbytes
-from threading import Lock, Thread, current_thread
+from heapq import merge
+from itertools import count, repeat
+from os import listdir, remove, mkdir, replace
+from os.path import join, basename, isfile, splitext
+from threading import Event, Lock, Thread, current_thread
+from time import time, gmtime, strftime, strptime
+from typing import Any, Iterable, Iterator
 
+import numpy as np
+
+from lib.archive import ArchiveEntry, ArchiveStore, ARCHIVE_COMPRESS, ARCHIVE_DIR_NAME, ARCHIVE_FMT, ARCHIVE_MIN_TIER
+from lib.chunk_cache import ChunkCache
+from lib.compress import COMPRESS_EXTS, SharedDict, SharedDictStore, compress_bytes, open_compress_writer, \
+    open_data_file, strip_compress_ext, get_compress_way
 from lib.config import *
+from lib.json_stream import JsonStream
 from lib.log import logger
+from lib.manifest import ChunkManifest, ManifestEntry, MANIFEST_FILE_NAME, stat_file
+from lib.pack import PackStore, read_pack_data
 from lib.perf import Counter
+from lib.point_arrays import PointArrays
+from lib.point_store import PointStore
+from lib.rollup import ChunkRollup, RollupBucket, ROLLUP_TIERS, load_rollup, remove_rollup, save_rollup, select_tier
+from lib.snapshot import Snapshot, SnapshotChunk, load_snapshot, remove_snapshot, save_snapshot
+from lib.wal import PointsWAL, WAL_FILE_NAME, OP_ADD, OP_REMOVE
 
 MAX_SIZE = (windll.user32.GetSystemMetrics(0), windll.user32.GetSystemMetrics(1))
+DATA_FILE_EXTS = (".json", ".bin", *COMPRESS_EXTS.values())
+COLUMNAR_MAGIC = b"CSCD"
+COLUMNAR_VERSION = 1
+# 魔数, 版本, 数据点数, 玩家列表数, 玩家数, 玩家列表内容长度, 名字表长度, UUID表长度
+COLUMNAR_HEADER = struct.Struct("<4sBIIIIII")
+JSON_FMT_RE = re.compile(rb'\s*\{"fmt":\s*(\d+)')
+WINDOW_FILE_RE = re.compile(r"^(\d{8}-\d{2})-(\d+)h\.")  # 按时间窗口命名的数据文件, 如 20250101-00-24h.json
+POINT_MEMORY_SIZE = 160  # 估算单个数据点对象 (含时间、延迟和id) 占用的内存 (字节)
+PLAYER_MEMORY_SIZE = 120  # 估算数据点中每个玩家占用的内存 (字节)
+WRITE_BUFFER_SIZE = 64 * 1024  # 流式写入json时每次写入的文本大小
+SAVE_RETRY_WAIT = 60.0  # 后台保存发生意外错误后, 等待多久再重试 (秒)
+SHIFT_LOG_SIZE = 256  # 保留的最近数据块加载/释放记录数, 供界面换算列表行号
+RUN_INTERVAL_TOLERANCE = 0.5  # 游程格式中, 间隔偏离游程平均间隔超过该比例时开始新的游程
+RUN_MEMORY_SIZE = 120  # 估算单个游程对象占用的内存 (字节)
+RUNS_CACHE_SUFFIX = "#runs"  # 数据块缓存中游程的键为数据文件名加上这个后缀
+POINT_IDS = count()  # 数据点id, 只在本次运行中有效, 不会写入文件
+DEFAULT_UUID = "00000000-0000-0000-0000-000000000000"
+# 映射格式的json数据文件中存放数据点的键, 以及展开数据点需要的映射表
+MAPPED_POINTS_KEYS = {
+    DataSaveFmt.PLAYER_LIST_MAPPING: "points",
+    DataSaveFmt.PLAYER_MAPPING: "points",
+    DataSaveFmt.RUN_LENGTH: "runs",
+}
+MAPPED_TABLE_KEYS = {
+    DataSaveFmt.PLAYER_LIST_MAPPING: ("players_mapping",),
+    DataSaveFmt.PLAYER_MAPPING: ("player_list_mapping", "players_mapping"),
+    DataSaveFmt.RUN_LENGTH: ("player_lists", "uuids"),
+}
 
 
-@dataclass
+@dataclass(slots=True)
 class Player:
     """一只玩家"""
     name: str
-    uuid: str = "00000000-0000-0000-0000-000000000000"
+    uuid: str = DEFAULT_UUID
 
     def to_dict(self):
         return {"name": self.name, "uuid": self.uuid}
@@ -42,50 +95,86 @@ class Player:
         return False
 
 
-def slice_dict(d: dict, start: int, end: int) -> dict:
+class PlayerPool:
+    """
+    玩家和玩家列表的享元池
+    相同 (玩家名, UUID) 的玩家只有一个对象, 相同的玩家列表是同一个元组, 所有数据点共享
+    玩家列表相同等价于元组是同一个对象, 比较时可以直接用 is
     """
-    按照key值对字典进行排序，并返回指定开始和结束位置的片段。
 
-    参数:
-    :param d: 要排序+切片的字典
-    :param start: 切片的起始位置
-    :param end: 切片的结束位置
+    def __init__(self):
+        self.players: dict[tuple[str, str], Player] = {}
+        self.lists: dict[tuple[tuple[str, str], ...], tuple[Player, ...]] = {}
+        self.list_ids: set[int] = set()  # 池中的元组永远不会被回收, 可以用 id 判断
+        self.player_keys: dict[int, tuple[str, str]] = {}  # 玩家对象的 id -> 池中的 (玩家名, UUID) 键, 玩家列表的键共用
+        self.names: dict[int, frozenset[str]] = {}
 
-    返回:
-    - 排序并切片后的字典。
-    """
-    # 按照key值对字典进行排序，并提取排序后的key列表
-    sorted_keys = sorted(d.keys())
+    def get_player(self, name: str, uuid: str) -> Player:
+        player = self.players.get((name, uuid))
+        if player is None:
+            player = self.players.setdefault((name, uuid), Player(name, uuid))
+        return player
+
+    def get_list(self, key: tuple[tuple[str, str], ...]) -> tuple[Player, ...]:
+        """
+        获取玩家列表
+        :param key: (玩家名, UUID) 元组
+        """
+        players = self.lists.get(key)
+        if players is None:
+            players = tuple(self.get_player(name, uuid) for name, uuid in key)
+            # 键改用池中玩家的键组成, 不保留调用方 (如json解码) 新建的元组和字符串
+            key = tuple(self.player_keys.setdefault(id(player), (player.name, player.uuid)) for player in players)
+            players = self.lists.setdefault(key, players)
+            self.list_ids.add(id(players))
+        return players
+
+    def intern(self, players: Iterable[Player]) -> tuple[Player, ...]:
+        """把玩家列表换成池中共享的元组"""
+        if id(players) in self.list_ids:
+            return players
+        return self.get_list(tuple((player.name, player.uuid) for player in players))
+
+    def from_dicts(self, player_dicts: list[dict[str, str]] | tuple[Player, ...]) -> tuple[Player, ...]:
+        """从玩家字典列表获取玩家列表, 不需要先构建玩家对象; 已经是池中的元组时 (映射格式的文件) 直接返回"""
+        if id(player_dicts) in self.list_ids:
+            return player_dicts
+        return self.get_list(tuple((p["name"], p.get("uuid", DEFAULT_UUID)) for p in player_dicts))
+
+    def get_names(self, players: tuple[Player, ...]) -> frozenset[str]:
+        """池中玩家列表的玩家名集合, 每个玩家列表只计算一次"""
+        names = self.names.get(id(players))
+        if names is None:
+            names = self.names[id(self.intern(players))] = frozenset(player.name for player in players)
+        return names
 
-    # 使用切片操作获取指定范围内的key
-    sliced_keys = sorted_keys[start:end]
 
-    # 构建并返回新的字典
-    return {k: d[k] for k in sliced_keys}
+player_pool = PlayerPool()
 
 
-def get_players_hash(players: list[dict[str, str]]) -> str:
+def get_players_hash(players: Iterable[tuple[str, str]]) -> str:
     """
     计算玩家列表的哈希值
-    :param players: 玩家列表
+    :param players: (玩家名, UUID) 列表
     :return: 哈希值
     """
     players_hash = md5()
-    for player in players:
-        players_hash.update(player["name"].encode())
-        players_hash.update(player["uuid"].encode())
+    for name, uuid in players:
+        players_hash.update(name.encode())
+        players_hash.update(uuid.encode())
     return players_hash.hexdigest()
 
 
 class ServerPoint:
-    """数据点类"""
+    """数据点类, 使用 __slots__ 去掉每个实例的 __dict__, 数据点多时可以节省大量内存"""
+    __slots__ = ("time", "online", "players", "ping", "id_")
 
-    def __init__(self, time: float, online: int, players: list[Player], ping: float = 0, **_):
+    def __init__(self, time: float, online: int, players: Iterable[Player], ping: float = 0, **_):
         self.time = time  # (sec)
         self.online = online
-        self.players = players
+        self.players = player_pool.intern(players)  # 共享的不可变元组, 修改时需要整体替换
         self.ping = ping  # (ms)
-        self.id_ = randbytes(8).hex()
+        self.id_ = next(POINT_IDS)
 
     def to_dict(self):
         return {
@@ -101,46 +190,420 @@ class ServerPoint:
 
     @staticmethod
     def from_dict(dic: dict) -> "ServerPoint":
-        players = [Player.from_dict(p) for p in dic.pop("players")]
+        players = player_pool.from_dicts(dic.pop("players"))
         return ServerPoint(**dic, players=players)
 
 
-def dumps_player_list_mapping(points: list[dict]):
-    player_list_map: dict[str, list[dict[str, str]]] = {}
-    for i, pt in enumerate(points):
-        players: list[dict[str, str]] = copy(pt["players"])
-        player_list_id: str = get_players_hash(players)
-        if player_list_id not in player_list_map:
-            player_list_map[player_list_id] = players
-        pt["players"] = player_list_id
-    return {
-        "fmt": DataSaveFmt.PLAYER_LIST_MAPPING.value,
-        "points": points,
-        "players_mapping": player_list_map,
-    }
-
-
-def dumps_player_mapping(points: list[dict]):
-    player_list_map: dict[str, list[str]] = {}
-    players_map: dict[str, dict[str, str]] = {}
-    mapped_players = set()
-    for i, pt in enumerate(points):
-        raw_players: list[dict[str, str]] = copy(pt["players"])
-        players = [p["name"] for p in raw_players]
-        player_list_id: str = get_players_hash(raw_players)
-        if player_list_id not in player_list_map:
-            player_list_map[player_list_id] = players
-        pt["players"] = player_list_id
-        for player in raw_players:
-            if player["name"] not in mapped_players:
-                players_map[player["name"]] = player
-                mapped_players.add(player["name"])
-    return {
-        "fmt": DataSaveFmt.PLAYER_MAPPING.value,
-        "points": points,
-        "player_list_mapping": player_list_map,
-        "players_mapping": players_map,
-    }
+@dataclass
+class PointRun:
+    """游程: 一段在线人数和玩家列表都没有变化的连续数据点"""
+    start: float
+    end: float
+    count: int
+    online: int
+    players: tuple[Player, ...]
+    pings: list[float] | None = None  # 每个数据点的延迟, 只在存储时收集
+
+    def iter_times(self) -> Iterator[float]:
+        """按均匀间隔重建游程中每个数据点的时间"""
+        if self.count == 1:
+            yield self.start
+            return
+        step = (self.end - self.start) / (self.count - 1)
+        for i in range(self.count - 1):
+            yield self.start + i * step
+        yield self.end
+
+
+def iter_point_runs(points: Iterable[ServerPoint], split_gaps: bool = False) -> Iterator[PointRun]:
+    """
+    把按时间排序的数据点合并为游程
+    :param points: 数据点
+    :param split_gaps: 数据点间隔不均匀时是否开始新的游程, 并收集每个数据点的延迟 (存储时需要, 以便均匀地重建时间)
+    """
+    run: PointRun | None = None
+    for point in points:
+        if run is not None and point.players is run.players and point.online == run.online:  # 共享的玩家列表直接比较对象
+            interval = (run.end - run.start) / (run.count - 1) if run.count > 1 else None
+            if not split_gaps or interval is None or \
+                    abs(point.time - run.end - interval) <= interval * RUN_INTERVAL_TOLERANCE:
+                run.end = point.time
+                run.count += 1
+                if split_gaps:
+                    run.pings.append(point.ping)
+                continue
+        if run is not None:
+            yield run
+        run = PointRun(point.time, point.time, 1, point.online, point.players, [point.ping] if split_gaps else None)
+    if run is not None:
+        yield run
+
+
+def iter_run_length_parts(points: Iterable[ServerPoint]) -> Iterator[str]:
+    """
+    把数据点编码为游程格式的json文本片段, 玩家列表表写在游程之前, 读取时只需要顺序读一遍
+    每个游程记录为 [开始时间, 结束时间, 数据点数, 在线人数, 玩家列表序号, 延迟]
+    延迟全部相同时只写一个数, 否则按顺序写出每个数据点的延迟; 只有游程中的时间按均匀间隔重建
+    """
+    runs = list(iter_point_runs(points, split_gaps=True))  # 游程数远少于数据点数
+    list_index_map: dict[tuple[str, ...], int] = {}
+    run_list_indexes: list[int] = []
+    player_uuids: dict[str, str] = {}
+    for run in runs:
+        key = tuple(p.name for p in run.players)
+        run_list_indexes.append(list_index_map.setdefault(key, len(list_index_map)))
+        for player in run.players:
+            player_uuids.setdefault(player.name, player.uuid)
+    yield f'{{"fmt": {DataSaveFmt.RUN_LENGTH.value}, "player_lists": {json.dumps(list(list_index_map))}, ' \
+          f'"uuids": {json.dumps(player_uuids)}, "runs": ['
+    for i, (run, list_index) in enumerate(zip(runs, run_list_indexes)):
+        pings = run.pings[0] if run.pings.count(run.pings[0]) == run.count else run.pings
+        yield f'{", " if i else ""}[{run.start!r}, {run.end!r}, {run.count}, {run.online!r}, {list_index}, ' \
+              f'{json.dumps(pings)}]'
+    yield "]}"
+
+
+def iter_json_parts(points: Iterable[ServerPoint], fmt: DataSaveFmt) -> Iterator[str]:
+    """
+    把数据点逐个编码为json文本片段, 不生成中间的数据点字典列表
+    相同的玩家列表只编码一次; 映射格式先遍历一遍数据点收集玩家列表, 映射表写在数据点之前, 读取时只需要顺序读一遍
+    :param points: 数据点, 映射格式会遍历两次
+    :param fmt: json存储格式 (NORMAL / PLAYER_LIST_MAPPING / PLAYER_MAPPING)
+    """
+    players_texts: dict[int, str] = {}  # 共享的玩家列表的id -> 编码后的文本 (或映射哈希)
+    if fmt == DataSaveFmt.NORMAL:
+        yield "["
+    else:
+        list_mapping: dict[str, tuple[tuple[str, str], ...]] = {}  # 映射哈希 -> 玩家列表
+        for point in points:
+            if id(point.players) not in players_texts:  # 池中的元组按 id 去重, 不需要逐个比较玩家
+                key = tuple((player.name, player.uuid) for player in point.players)
+                list_id = get_players_hash(key)
+                list_mapping[list_id] = key
+                players_texts[id(point.players)] = f'"{list_id}"'
+        yield f'{{"fmt": {fmt.value}, '
+        yield from iter_mapping_table_parts(list_mapping, fmt)
+        yield '"points": ['
+    for i, point in enumerate(points):
+        players_text = players_texts.get(id(point.players))
+        if players_text is None:
+            players_text = players_texts[id(point.players)] = \
+                json.dumps([{"name": player.name, "uuid": player.uuid} for player in point.players])
+        ping_text = f', "ping": {point.ping!r}' if point.ping != 0 else ""
+        yield f'{", " if i else ""}{{"time": {point.time!r}, "online": {point.online!r}, ' \
+              f'"players": {players_text}{ping_text}}}'
+    yield "]" if fmt == DataSaveFmt.NORMAL else "]}"
+
+
+def iter_mapping_table_parts(list_mapping: dict[str, tuple[tuple[str, str], ...]], fmt: DataSaveFmt) -> Iterator[str]:
+    """把映射表编码为json对象中的键值对片段, 每个表后面都带有逗号"""
+    if fmt == DataSaveFmt.PLAYER_LIST_MAPPING:
+        yield '"players_mapping": {'
+        for i, (list_id, key) in enumerate(list_mapping.items()):
+            yield f'{", " if i else ""}"{list_id}": {json.dumps([{"name": n, "uuid": u} for n, u in key])}'
+        yield "}, "
+        return
+    player_uuids: dict[str, str] = {}  # 同名玩家只记录第一次出现时的UUID
+    for key in list_mapping.values():
+        for name, uuid in key:
+            player_uuids.setdefault(name, uuid)
+    # 玩家表写在玩家列表表之前, 读取玩家列表表时就能直接换成池中的元组
+    yield '"players_mapping": {'
+    for i, (name, uuid) in enumerate(player_uuids.items()):
+        yield f'{", " if i else ""}{json.dumps(name)}: {json.dumps({"name": name, "uuid": uuid})}'
+    yield '}, "player_list_mapping": {'
+    for i, (list_id, key) in enumerate(list_mapping.items()):
+        yield f'{", " if i else ""}"{list_id}": {json.dumps([name for name, _ in key])}'
+    yield "}, "
+
+
+def _array_to_le_bytes(arr: array) -> bytes:
+    if sys.byteorder != "little":
+        arr = array(arr.typecode, arr)
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _array_from_le_bytes(typecode: str, data: bytes | memoryview) -> array:
+    arr = array(typecode)
+    arr.frombytes(data)
+    if sys.byteorder != "little":
+        arr.byteswap()
+    return arr
+
+
+def encode_columnar(points: list[ServerPoint]) -> list[bytes]:
+    """
+    把数据点编码为列式二进制格式, 返回按顺序写入文件的各个部分
+    列: 时间 float64, 在线人数 uint16, 延迟 float32, 玩家列表id uint32
+    玩家列表id指向块内的玩家列表表, 玩家列表表再指向块内的名字表
+    """
+    times = array("d")
+    onlines = array("H")
+    pings = array("f")
+    list_ids = array("I")
+    list_offsets = array("I", [0])
+    list_items = array("I")
+    list_index_map: dict[tuple[str, ...], int] = {}
+    shared_list_ids: dict[int, int] = {}  # 共享的玩家列表的id -> 块内玩家列表id
+    name_index_map: dict[str, int] = {}
+    names: list[str] = []
+    uuids: list[str] = []
+    for pt in points:
+        list_id = shared_list_ids.get(id(pt.players))
+        if list_id is None:
+            key = tuple(p.name for p in pt.players)
+            list_id = shared_list_ids[id(pt.players)] = list_index_map.setdefault(key, len(list_index_map))
+        if list_id == len(list_offsets) - 1:  # 新的玩家列表
+            for player in pt.players:
+                name_id = name_index_map.get(player.name)
+                if name_id is None:
+                    name_id = name_index_map[player.name] = len(names)
+                    names.append(player.name)
+                    uuids.append(player.uuid)
+                list_items.append(name_id)
+            list_offsets.append(len(list_items))
+        times.append(pt.time)
+        onlines.append(min(pt.online, 0xFFFF))
+        pings.append(pt.ping)
+        list_ids.append(list_id)
+    names_blob = "\0".join(names).encode("utf-8")
+    uuids_blob = "\0".join(uuids).encode("utf-8")
+    header = COLUMNAR_HEADER.pack(COLUMNAR_MAGIC, COLUMNAR_VERSION, len(times), len(list_index_map), len(names),
+                                  len(list_items), len(names_blob), len(uuids_blob))
+    return [
+        header, names_blob, uuids_blob,
+        _array_to_le_bytes(list_offsets), _array_to_le_bytes(list_items),
+        _array_to_le_bytes(times), _array_to_le_bytes(onlines),
+        _array_to_le_bytes(pings), _array_to_le_bytes(list_ids),
+    ]
+
+
+def loads_columnar(data: bytes) -> list[ServerPoint]:
+    """从列式二进制格式解码数据点, 相同的玩家列表在块内只构建一次"""
+    magic, version, points_count, lists_count, names_count, items_count, names_len, uuids_len = \
+        COLUMNAR_HEADER.unpack_from(data)
+    if magic != COLUMNAR_MAGIC:
+        raise ValueError("不是列式数据文件")
+    if version != COLUMNAR_VERSION:
+        raise ValueError(f"不支持的列式数据版本 -> {version}")
+    view = memoryview(data)
+    offset = COLUMNAR_HEADER.size
+
+    def take(size: int) -> memoryview:
+        nonlocal offset
+        part = view[offset:offset + size]
+        offset += size
+        return part
+
+    names = bytes(take(names_len)).decode("utf-8").split("\0") if names_count else []
+    uuids = bytes(take(uuids_len)).decode("utf-8").split("\0") if names_count else []
+    list_offsets = _array_from_le_bytes("I", take(4 * (lists_count + 1)))
+    list_items = _array_from_le_bytes("I", take(4 * items_count))
+    times = _array_from_le_bytes("d", take(8 * points_count))
+    onlines = _array_from_le_bytes("H", take(2 * points_count))
+    pings = _array_from_le_bytes("f", take(4 * points_count))
+    list_ids = _array_from_le_bytes("I", take(4 * points_count))
+
+    keys = list(zip(names, uuids))
+    player_lists = [player_pool.get_list(tuple(keys[i] for i in list_items[list_offsets[j]:list_offsets[j + 1]]))
+                    for j in range(lists_count)]
+    return [ServerPoint(t, o, player_lists[l], p) for t, o, p, l in zip(times, onlines, pings, list_ids)]
+
+
+def points_to_columns(point_dicts: Iterable[dict]) -> tuple:
+    """
+    把数据点字典转换为紧凑的列数据, 用于在进程间传递加载结果
+    :return: (时间, 在线人数, 延迟, 玩家列表id, 玩家列表表)
+    """
+    times = array("d")
+    onlines = array("q")
+    pings = array("d")
+    list_ids = array("I")
+    player_lists: list[tuple[tuple[str, str], ...]] = []
+    list_index_map: dict[tuple[tuple[str, str], ...], int] = {}
+    pooled_index_map: dict[int, int] = {}  # 池中的玩家列表的 id -> 序号, 每个列表只计算一次键
+    for pt in point_dicts:
+        players = pt["players"]
+        pooled = id(players) in player_pool.list_ids  # 映射格式的文件读出的玩家列表已经是池中的元组
+        list_id = pooled_index_map.get(id(players)) if pooled else None
+        if list_id is None:
+            if pooled:
+                key = tuple((p.name, p.uuid) for p in players)
+            else:
+                key = tuple((p["name"], p["uuid"]) for p in players)
+            list_id = list_index_map.get(key)
+            if list_id is None:
+                list_id = list_index_map[key] = len(player_lists)
+                player_lists.append(key)
+            if pooled:
+                pooled_index_map[id(players)] = list_id
+        times.append(pt["time"])
+        onlines.append(pt["online"])
+        pings.append(pt.get("ping", 0))
+        list_ids.append(list_id)
+    return times, onlines, pings, list_ids, player_lists
+
+
+def points_from_columns(columns: tuple) -> list[ServerPoint]:
+    """从列数据构建数据点, 相同的玩家列表共享池中的同一个元组"""
+    times, onlines, pings, list_ids, player_lists = columns
+    lists = [player_pool.get_list(player_list) for player_list in player_lists]
+    return [ServerPoint(t, o, lists[l], p) for t, o, p, l in zip(times, onlines, pings, list_ids)]
+
+
+def decode_file_columns(file_path: str, location: tuple[str, int, int, str] | None = None) -> tuple:
+    """
+    在加载进程中解码数据文件, 返回列数据
+    :param location: 打包存储的数据块在打包文件中的位置, 见 PackStore.locate
+    """
+    data = read_pack_data(*location) if location is not None else None
+    if strip_compress_ext(file_path).endswith(".bin"):
+        points = [point.to_dict() for point in DataManager.read_a_file(file_path, data)]
+    else:
+        points = DataManager.iter_point_dicts(file_path, data)
+    return points_to_columns(points)
+
+
+def get_data_file_name(file_stem: str, fmt: DataSaveFmt, compress: DataCompress) -> str:
+    """根据存储格式和压缩方式生成数据文件名"""
+    return file_stem + (".bin" if fmt == DataSaveFmt.COLUMNAR else ".json") + COMPRESS_EXTS.get(compress, "")
+
+
+def get_data_file_stem(file_name: str) -> str:
+    """去掉数据文件名的格式和压缩扩展名"""
+    return splitext(strip_compress_ext(file_name))[0]
+
+
+def write_points_file(save_path: str, points: list[ServerPoint], fmt: DataSaveFmt, compress: DataCompress,
+                      shared_dict: SharedDict | None = None):
+    """
+    把数据点流式编码 (和压缩) 写入文件, 先写入临时文件再替换
+    :param save_path: 文件路径
+    :param points: 数据点列表
+    :param fmt: 数据存储格式
+    :param compress: 压缩方式
+    :param shared_dict: zlib压缩使用的共享字典
+    """
+    with open_compress_writer(save_path + ".tmp", compress, shared_dict) as f:
+        for block in iter_points_file_blocks(points, fmt):
+            f.write(block)
+    replace(save_path + ".tmp", save_path)
+
+
+def encode_points_file(points: list[ServerPoint], fmt: DataSaveFmt, compress: DataCompress,
+                       shared_dict: SharedDict | None = None) -> bytes:
+    """把数据点编码 (和压缩) 为数据文件的完整内容, 用于写入打包文件, 参数与 write_points_file 相同"""
+    return compress_bytes(b"".join(iter_points_file_blocks(points, fmt)), compress, shared_dict)
+
+
+def iter_points_file_blocks(points: list[ServerPoint], fmt: DataSaveFmt) -> Iterator[bytes]:
+    """把数据点逐块编码为数据文件的内容 (未压缩), json格式按 WRITE_BUFFER_SIZE 合并为较大的块"""
+    if fmt == DataSaveFmt.COLUMNAR:
+        yield from encode_columnar(points)
+        return
+    buffer: list[str] = []
+    buffer_size = 0
+    parts = iter_run_length_parts(points) if fmt == DataSaveFmt.RUN_LENGTH else iter_json_parts(points, fmt)
+    for part in parts:
+        buffer.append(part)
+        buffer_size += len(part)
+        if buffer_size >= WRITE_BUFFER_SIZE:
+            yield "".join(buffer).encode("utf-8")
+            buffer.clear()
+            buffer_size = 0
+    yield "".join(buffer).encode("utf-8")
+
+
+def is_data_file(file_name: str) -> bool:
+    """是否为数据文件 (排除清单等同样以json结尾的文件)"""
+    return file_name.endswith(DATA_FILE_EXTS) and file_name != MANIFEST_FILE_NAME
+
+
+def get_window_start(timestamp: float, span_hours: int) -> float:
+    """获取时间所在的数据块时间窗口的起点 (按UTC对齐)"""
+    span = span_hours * 3600
+    return timestamp - timestamp % span
+
+
+def get_window_file_stem(window_start: float, span_hours: int) -> str:
+    """时间窗口对应的数据文件名 (不含扩展名)"""
+    return f"{strftime('%Y%m%d-%H', gmtime(window_start))}-{span_hours}h"
+
+
+def parse_window_file(file_name: str, span_hours: int) -> float | None:
+    """
+    从数据文件名解析出时间窗口起点
+    :return: 窗口起点, 旧的按哈希命名的文件或时间跨度不同的文件返回None
+    """
+    match = WINDOW_FILE_RE.match(file_name)
+    if match is None or int(match.group(2)) != span_hours:
+        return None
+    return float(timegm(strptime(match.group(1), "%Y%m%d-%H")))
+
+
+def sniff_data_fmt(file_path: str, data: bytes | None = None) -> DataSaveFmt | None:
+    """
+    只读取文件开头判断数据文件的存储格式, 无法判断时返回None
+    :param data: 打包存储的数据块的内容, 见 open_data_file
+    """
+    if strip_compress_ext(file_path).endswith(".bin"):
+        return DataSaveFmt.COLUMNAR
+    with open_data_file(file_path, data) as f:
+        head = f.read(32)
+    if head.lstrip().startswith(b"["):
+        return DataSaveFmt.NORMAL
+    match = JSON_FMT_RE.match(head)
+    if match is not None and int(match.group(1)) in DataSaveFmt._value2member_map_:
+        return DataSaveFmt(int(match.group(1)))
+    return None
+
+
+def get_points_players(points: list[ServerPoint]) -> set[str]:
+    """数据点中出现过的所有玩家名"""
+    return {player.name for point in points for player in point.players}
+
+
+def estimate_points_size(points: list[ServerPoint]) -> int:
+    """粗略估算数据点占用的内存 (字节), 用于数据块缓存的预算, 共享的玩家列表只计算一次"""
+    lists = {id(pt.players): pt.players for pt in points}
+    return len(points) * POINT_MEMORY_SIZE + sum(len(players) for players in lists.values()) * PLAYER_MEMORY_SIZE
+
+
+class DataChunk:
+    """
+    数据块, 对应一个数据文件
+    每个数据块对应一个固定的时间窗口 (chunk_span_hours), 文件名由窗口起点决定
+    记录属于它的数据点, 数据点被增删时标记为脏块, 保存时只重写脏块
+    按需加载模式下, 不常驻的数据块只保留元数据, 数据点在查询时从文件加载
+    """
+
+    def __init__(self, file_name: str | None = None, window_start: float | None = None):
+        self.file_name = file_name  # 已写入的文件名, None 表示还没写入过
+        self.window_start = window_start  # 时间窗口起点, None 表示旧的按数量切分的数据块
+        self.point_ids: list[int] = []
+        self.dirty = file_name is None
+        self.resident = True  # 数据点是否常驻在 point_store 中
+        self.min_time: float = 0
+        self.max_time: float = 0
+        self.count: int = 0  # 非常驻数据块的数据点数量
+        self.players: set[str] = set()  # 非常驻数据块中出现过的玩家名
+        self.rollup: ChunkRollup | None = None  # 各级精度的汇总, None 表示还没有加载或计算
+        self.fmt_name: str | None = None  # 清单中没有记录时判断出的存储格式, None 表示还不知道
+
+    def set_cold(self, points: list[ServerPoint]):
+        """把数据块设为非常驻, 只记录元数据"""
+        self.set_cold_meta(min(pt.time for pt in points), max(pt.time for pt in points), len(points),
+                           get_points_players(points))
+
+    def set_cold_meta(self, min_time: float, max_time: float, count: int, players: set[str]):
+        """根据已知的元数据 (如清单记录) 把数据块设为非常驻"""
+        self.resident = False
+        self.point_ids = []
+        self.count = count
+        self.min_time = min_time
+        self.max_time = max_time
+        self.players = players
 
 
 class DataManager:
@@ -152,17 +615,215 @@ class DataManager:
         self.data_ctl_lock = Lock()
         self.data_dir = data_dir
         self.non_saved_counter = 0
-        self.points_map: dict[str, ServerPoint] = {}
-        self.data_files: list[str] = []
+        self.point_store: PointStore[ServerPoint] = PointStore(arrays=PointArrays())
+        self.chunks: list[DataChunk] = []
+        self.window_chunks: dict[float, DataChunk] = {}  # 时间窗口起点 -> 数据块
+        self.point_chunk: dict[int, DataChunk] = {}  # 数据点id -> 所在的数据块
+        self.hot_start = float("-inf")
+        self.unloaded_files: list[str] = []  # 渐进加载时还没有加载的旧文件, 从新到旧排列
+        self.pending_removes: set[float] = set()  # 预写日志中删除过的、所在文件还没有加载的数据点的时间
+        self.save_deferred = False  # 历史数据加载期间是否有被推迟的保存请求
+        self.shift_seq = 0  # 运行中加载/释放数据块的次数, 每次都会让后面的数据点在 points 中的位置移动
+        self.shift_log: list[tuple[int, int, int]] = []  # 最近的位置移动记录: (序号, 起始位置, 加入(正)或移除(负)的数据点数)
+        self.chunk_span_hours = config.chunk_span_hours
         self.ranges_cache: dict[Player, list[tuple[float, float]]] = {}
         if not exists(self.data_dir):
             logger.info(f"创建目录 [{self.data_dir}]...")
             mkdir(self.data_dir)
         self.last_fmt: DataSaveFmt = config.data_save_fmt
+        self.last_compress: DataCompress = config.data_compress
+        self.zdict_store = SharedDictStore(self.data_dir)
+        self.wal = PointsWAL(join(self.data_dir, WAL_FILE_NAME), config.saved_per_points)
+        self.chunk_cache = ChunkCache(config.chunk_cache_mb * 1024 * 1024)
+        self.manifest = ChunkManifest(self.data_dir, self.chunk_span_hours)
+        self.archive = ArchiveStore(self.data_dir)
+        self.packs = PackStore(self.data_dir)
+        self.save_lock = Lock()  # 保存和压实写文件时持有, 保证同一时间只有一方在写数据文件
+        self.save_event = Event()
+        self.saver_stop_flag = Event()
+        self.saver_thread: Thread | None = None
+
+    @property
+    def points(self) -> PointStore[ServerPoint]:
+        """按时间排序的常驻内存的数据点, 按需加载模式下只包含最近的数据"""
+        return self.point_store
+
+    @property
+    def arrays(self) -> PointArrays:
+        """常驻内存的数据点的列式数组, 位置与 points 一一对应, 读取时需持有锁"""
+        return self.point_store.arrays
 
     @property
-    def points(self):
-        return self.points_map.values()
+    def all_resident(self) -> bool:
+        """全部数据块都常驻内存, 此时列式数组包含全部数据点"""
+        return all(chunk.resident for chunk in self.chunks)
+
+    @property
+    def points_count(self) -> int:
+        """全部数据点的数量, 包括未加载到内存的数据块"""
+        return len(self.point_store) + sum(c.count for c in self.chunks if not c.resident)
+
+    def iter_points(self, from_time: float = None, to_time: float = None) -> Iterator[ServerPoint]:
+        """
+        按时间顺序遍历全部 (或指定时间范围内的) 数据点, 非常驻的数据块通过缓存按需加载
+        调用时需持有锁
+        :param from_time: 开始时间, None 表示不限
+        :param to_time: 结束时间, None 表示不限
+        """
+        resident = self.point_store.range(from_time, to_time)
+        from_time = float("-inf") if from_time is None else from_time
+        to_time = float("inf") if to_time is None else to_time
+        cold_parts = []
+        for chunk in self.chunks:
+            if chunk.resident or chunk.max_time < from_time or chunk.min_time > to_time:
+                continue
+            points = self.get_cold_points(chunk)
+            lo = bisect_left(points, from_time, key=lambda pt: pt.time)
+            hi = bisect_right(points, to_time, key=lambda pt: pt.time)
+            cold_parts.append(points[lo:hi])
+        if not cold_parts:
+            yield from resident
+            return
+        yield from merge(*cold_parts, resident, key=lambda pt: pt.time)
+
+    def get_points_range(self, from_time: float, to_time: float, include_archive: bool = False) -> list[ServerPoint]:
+        """
+        获取时间范围内的数据点, 包括未加载到内存的数据块
+        :param include_archive: 是否包括已归档的数据点
+        """
+        with self.data_ctl_lock:
+            points = list(self.iter_points(from_time, to_time))
+            if include_archive:
+                points = list(self.iter_archive_points(from_time, to_time)) + points
+        return points
+
+    def iter_archive_points(self, from_time: float = None, to_time: float = None) -> Iterator[ServerPoint]:
+        """按时间顺序遍历时间范围内已归档的数据点, 归档文件通过缓存按需加载, 调用时需持有锁"""
+        from_time = float("-inf") if from_time is None else from_time
+        to_time = float("inf") if to_time is None else to_time
+        for entry in self.archive.iter_range(from_time, to_time):
+            if entry.file_name is None:
+                continue
+            file_path = join(self.archive.dir_path, entry.file_name)
+
+            def loader():
+                points = sorted(self.read_a_file(file_path), key=lambda pt: pt.time)
+                return points, estimate_points_size(points)
+
+            for point in self.chunk_cache.get(join(ARCHIVE_DIR_NAME, entry.file_name), loader):
+                if from_time <= point.time <= to_time:
+                    yield point
+
+    def get_chunk_points(self, chunk: DataChunk) -> list[ServerPoint]:
+        """按时间顺序获取数据块中的数据点, 调用时需持有锁"""
+        if chunk.resident:
+            return [self.point_store.by_id(pt_id) for pt_id in chunk.point_ids]
+        return self.get_cold_points(chunk)
+
+    def get_chunk_rollup(self, chunk: DataChunk) -> ChunkRollup:
+        """获取数据块的汇总, 第一次使用时从汇总文件读取或从数据点计算, 调用时需持有锁"""
+        if chunk.rollup is None:
+            if not chunk.resident:
+                chunk.rollup = load_rollup(self.data_dir, chunk.file_name, self.stat_chunk(chunk.file_name))
+            if chunk.rollup is None:
+                chunk.rollup = ChunkRollup.build(self.get_chunk_points(chunk))
+        return chunk.rollup
+
+    def get_rollup(self, from_time: float, to_time: float, max_buckets: int,
+                   include_archive: bool = False) -> tuple[int, list[tuple[float, RollupBucket]]] | None:
+        """
+        从精度足够的最粗一级汇总中获取时间范围内的数据, 包括未加载到内存的数据块
+        :param from_time: 开始时间
+        :param to_time: 结束时间
+        :param max_buckets: 需要的最高分辨率, 一般为图表的像素宽度
+        :param include_archive: 是否包括已归档的数据, 归档只保留了按小时和按天的汇总
+        :return: (汇总精度, [(时间段起点, 汇总)]), 时间范围太小不需要汇总时返回None
+        """
+        tier = select_tier(to_time - from_time, max_buckets)
+        if tier is None:
+            return None
+        result: list[tuple[float, RollupBucket]] = []
+
+        def add_buckets(buckets: dict[float, RollupBucket]):
+            for start in sorted(buckets):
+                if not from_time - tier < start <= to_time:
+                    continue
+                if result and result[-1][0] == start:  # 同一时间段跨越了两个数据块
+                    merged = RollupBucket()
+                    merged.merge(result[-1][1])
+                    merged.merge(buckets[start])
+                    result[-1] = (start, merged)
+                else:
+                    result.append((start, buckets[start]))
+
+        with self.data_ctl_lock:
+            if include_archive and tier >= ARCHIVE_MIN_TIER:
+                for entry in self.archive.iter_range(from_time - tier, to_time):
+                    add_buckets(entry.rollup.tiers[tier])
+            for chunk in self.chunks:
+                if chunk.resident:
+                    if not chunk.point_ids or chunk.min_time > to_time or \
+                            self.point_store.by_id(chunk.point_ids[-1]).time < from_time - tier:
+                        continue
+                elif chunk.max_time < from_time - tier or chunk.min_time > to_time:
+                    continue
+                add_buckets(self.get_chunk_rollup(chunk).tiers[tier])
+        return tier, result
+
+    def get_cold_points(self, chunk: DataChunk) -> list[ServerPoint]:
+        """从缓存或文件中获取非常驻数据块的数据点"""
+
+        def loader():
+            points = sorted(self.read_chunk(chunk.file_name), key=lambda pt: pt.time)
+            return points, estimate_points_size(points)
+
+        return self.chunk_cache.get(chunk.file_name, loader)
+
+    def get_chunk_runs(self, chunk: DataChunk) -> Iterable[PointRun]:
+        """
+        按时间顺序获取数据块中玩家列表不变的游程, 调用时需持有锁
+        非常驻的游程格式数据块直接缓存文件中的游程, 统计在线时间段时不需要展开为数据点
+        """
+        if chunk.resident or self.get_chunk_fmt_name(chunk) != DataSaveFmt.RUN_LENGTH.name:
+            return iter_point_runs(self.get_chunk_points(chunk))
+
+        def loader():
+            runs = self.read_file_runs(join(self.data_dir, chunk.file_name), self.packs.read(chunk.file_name))
+            if runs is None:  # 记录的格式与文件不符
+                runs = list(iter_point_runs(self.get_cold_points(chunk)))
+            return runs, len(runs) * RUN_MEMORY_SIZE
+
+        return self.chunk_cache.get(chunk.file_name + RUNS_CACHE_SUFFIX, loader)
+
+    def get_chunk_fmt_name(self, chunk: DataChunk) -> str | None:
+        """清单或数据块上记录的存储格式名, None 表示不知道, 调用时需持有锁"""
+        entry = self.manifest.get(chunk.file_name)
+        return entry.fmt if entry is not None and entry.fmt is not None else chunk.fmt_name
+
+    def discard_cached_chunk(self, file_name: str):
+        """从缓存中移除数据文件的数据点和游程"""
+        self.chunk_cache.discard(file_name)
+        self.chunk_cache.discard(file_name + RUNS_CACHE_SUFFIX)
+
+    def make_resident(self, chunk: DataChunk):
+        """把非常驻的数据块加载进 point_store, 调用时需持有锁"""
+        if chunk.resident:
+            return
+        points = self.get_cold_points(chunk)
+        self.discard_cached_chunk(chunk.file_name)
+        chunk.resident = True
+        chunk.count = 0
+        for point in points:
+            self.attach_point(point, chunk)
+        self.point_store.sort()
+        if points:
+            self.log_shift(self.point_store.bisect(points[0].time)[0], len(points))
+
+    def log_shift(self, start: int, delta: int):
+        """记录一次数据点位置的整体移动, 界面据此换算列表行号, 调用时需持有锁"""
+        self.shift_log.append((self.shift_seq + 1, start, delta))
+        del self.shift_log[:-SHIFT_LOG_SIZE]
+        self.shift_seq += 1  # 记录先于序号写入, 读到新序号时对应的记录一定已经存在
 
     def add_point(self, point: ServerPoint):
         """
@@ -170,43 +831,132 @@ class DataManager:
         :param point: 数据点
         """
         with self.data_ctl_lock:
-            self.points_map[point.id_] = point
-            self.non_saved_counter += 1
-        if self.non_saved_counter >= config.saved_per_points:
-            self.save_data()
-            self.non_saved_counter = 0
+            self.attach_point(point)
+            if config.enable_data_save:
+                self.wal.append_add(point.to_dict())
+                self.non_saved_counter += 1
+        if self.non_saved_counter >= config.checkpoint_per_points:
+            self.request_save()
         self.ranges_cache.clear()
 
-    def get_point(self, point_id: str) -> ServerPoint:
+    def get_point(self, point_id: int) -> ServerPoint:
         """
         获取一个数据点
         :param point_id: 数据点的id
         :return: 数据点
         """
-        return self.points_map[point_id]
+        return self.point_store.by_id(point_id)
 
     def remove_point(self, point: ServerPoint):
         """
         删除一个数据点
-        :param point: 数据点
+        :param point: 数据点, 可以来自非常驻的数据块 (如 get_points_range 的结果), 这时数据块会先被加载进内存
         """
         with self.data_ctl_lock:
-            self.points_map.pop(point.id_)
+            if point.id_ not in self.point_chunk:
+                resident = self.find_resident_point(point.time)
+                if resident is None:
+                    logger.warning(f"要删除的数据点 [{point.time}] 不存在, 跳过删除")
+                    return
+                point = resident
+            self.detach_point(point)
+            if config.enable_data_save:
+                self.wal.append_remove(point.time)
+                self.non_saved_counter += 1
         self.ranges_cache.clear()
 
-    def load_data(self):
-        """从文件夹中查找并加载数据点"""
+    def find_resident_point(self, point_time: float) -> ServerPoint | None:
+        """
+        按时间查找常驻内存的数据点, 时间所在的非常驻数据块会先被加载进内存, 调用时需持有锁
+        非常驻数据块的数据点在加载进内存后是新的对象, 只能按时间对应
+        """
+        for chunk in self.chunks:
+            if not chunk.resident and chunk.min_time <= point_time <= chunk.max_time:
+                self.make_resident(chunk)
+        start, end = self.point_store.bisect(point_time, point_time)
+        return self.point_store[start] if start < end else None
+
+    def attach_point(self, point: ServerPoint, chunk: DataChunk | None = None):
+        """
+        把数据点放入数据块, 调用时需持有锁
+        :param point: 数据点
+        :param chunk: 指定的数据块, 为None时放入数据点时间所在窗口的数据块并标记为脏块;
+                      指定数据块时为批量加入, 数据点只追加到 point_store 末尾, 加入完成后需调用 point_store.sort
+        """
+        if point.id_ not in self.point_store:  # 重新切分旧数据块时数据点已在存储中
+            if chunk is None:
+                self.point_store.add(point)
+            else:
+                self.point_store.append(point)
+        if chunk is None:
+            window_start = get_window_start(point.time, self.chunk_span_hours)
+            chunk = self.window_chunks.get(window_start)
+            if chunk is None:
+                chunk = DataChunk(window_start=window_start)
+                chunk.rollup = ChunkRollup()
+                chunk.min_time = point.time
+                self.window_chunks[window_start] = chunk
+                insort(self.chunks, chunk, key=lambda c: c.min_time)
+            elif not chunk.resident:
+                self.make_resident(chunk)
+            chunk.dirty = True
+            if chunk.rollup is not None:
+                chunk.rollup.add_point(point)
+            if chunk.point_ids and point.time < self.point_store.by_id(chunk.point_ids[-1]).time:  # 比窗口内已有的点早
+                insort(chunk.point_ids, point.id_, key=lambda pt_id: self.point_store.by_id(pt_id).time)
+                if point.time < chunk.min_time:
+                    chunk.min_time = point.time
+                    self.chunks.sort(key=lambda c: c.min_time)
+            else:
+                chunk.point_ids.append(point.id_)
+                if len(chunk.point_ids) == 1:
+                    chunk.min_time = point.time
+        else:
+            chunk.point_ids.append(point.id_)
+        self.point_chunk[point.id_] = chunk
+
+    def detach_point(self, point: ServerPoint):
+        """把数据点从所在的数据块中移除并标记为脏块, 调用时需持有锁"""
+        chunk = self.point_chunk.pop(point.id_)
+        chunk.point_ids.remove(point.id_)
+        chunk.dirty = True
+        self.point_store.remove(point)
+        if chunk.rollup is not None:
+            chunk.rollup.rebuild_at(point.time, [self.point_store.by_id(pt_id) for pt_id in chunk.point_ids])
+
+    def load_data(self, startup_hours: float = 0):
+        """
+        从文件夹中查找并加载数据点
+        按需加载模式下, 只有最近 hot_window_hours 小时内的数据块常驻内存
+        清单中记录过且未被改动的旧数据块直接使用清单中的元数据, 不需要解析文件
+        :param startup_hours: 大于0时只加载最近这么多小时的数据文件, 其余文件记入 unloaded_files,
+                              之后用 load_older_files 分批加载, 全部加载完成之前不会保存数据
+        """
         logger.info(f"从 [{self.data_dir}] 加载数据...")
         load_threads = []
         lock = Lock()
+        hot_start = self.hot_start = time() - config.hot_window_hours * 3600 if config.lazy_load else float("-inf")
+        files = self.list_chunk_files()
+        self.manifest.load()
+        self.manifest.retain(set(files))
+        self.zdict_store.load_latest()
         with self.data_ctl_lock:
             timer = Counter()
             timer.start()
-            for file in listdir(self.data_dir):
-                self.data_files.append(file)  # 把启动时加载的文件名记录下来
+            snapshot = load_snapshot(self.data_dir, self.chunk_span_hours) if config.startup_snapshot else None
+            if snapshot is not None:
+                files = self.restore_snapshot(snapshot, files)
+            restored_count = len(self.chunks)
+            if config.lazy_load:
+                files = self.add_manifest_chunks(files, hot_start)
+            if startup_hours > 0:
+                files, self.unloaded_files = self.split_startup_files(files, time() - startup_hours * 3600)
+            if config.data_load_process:
+                self.load_files_process(files, hot_start)
+            for file, data in self.iter_chunk_data(files) if not config.data_load_process else []:
                 full_path = join(self.data_dir, file)
                 thread = Thread(name=f"Loader-{str(len(load_threads)).zfill(2)}", target=self.load_a_file,
-                                args=(full_path, lock), daemon=True)
+                                args=(full_path, lock, hot_start, data), daemon=True)
                 thread.start()
                 load_threads.append(thread)
                 if len(load_threads) >= config.data_load_threads:
@@ -222,129 +972,1046 @@ class DataManager:
                         load_threads.pop(0)
             for thread in load_threads:
                 thread.join()
+            self.settle_loaded_chunks(self.chunks[restored_count:])  # 快照中的数据块已经整理过
+            self.replay_wal()
+        logger.info(f"加载完成, 共 {self.points_count} 个数据点, 常驻 {len(self.point_store)} 个, 耗时 {timer.endT()}")
+        if self.unloaded_files:
+            logger.info(f"已加载最近 {startup_hours} 小时的数据, 还有 {len(self.unloaded_files)} 个文件等待加载")
 
-            sorted_points = sorted(self.points_map.values(), key=lambda pt: pt.time)
-            self.points_map = {point.id_: point for point in sorted_points}
-        logger.info(f"加载完成, 共 {len(self.points_map)} 个数据点, 耗时 {timer.endT()}")
+    def restore_snapshot(self, snapshot: Snapshot, files: list[str]) -> list[str]:
+        """
+        从启动快照恢复数据块和数据点, 调用时需持有锁
+        文件被改动过或已删除的数据块会被跳过; 关闭按需加载后, 快照中非常驻的数据块也需要重新加载
+        :return: 仍需解析的文件
+        """
+        file_set = set(files)
+        chunks: list[DataChunk | None] = []
+        for entry in snapshot.chunks:
+            if entry.file_name not in file_set or not entry.match_stat(self.stat_chunk(entry.file_name)) or \
+                    not entry.resident and not config.lazy_load:
+                chunks.append(None)
+                continue
+            chunk = DataChunk(entry.file_name, entry.window_start)
+            if not entry.resident:
+                chunk.set_cold_meta(entry.min_time, entry.max_time, entry.count, entry.players)
+            if chunk.window_start is None and not config.background_compact:
+                chunk.dirty = True  # 旧的数据块, 下次保存时按时间窗口重新切分
+            chunks.append(chunk)
+            self.chunks.append(chunk)
+            if chunk.window_start is not None:
+                self.window_chunks[chunk.window_start] = chunk
+        columns = snapshot.columns
+        keep = np.flatnonzero(np.array([chunk is not None for chunk in chunks], np.bool_)[columns["chunk_index"]]) \
+            if chunks else np.empty(0, np.int64)
+        columns = {name: column[keep] for name, column in columns.items()}
+        lists = [player_pool.get_list(key) for key in snapshot.player_lists]
+        for time_, online, ping, list_index, chunk_index in zip(*(columns[name].tolist() for name in (
+                "times", "online", "ping", "list_index", "chunk_index"))):
+            point = ServerPoint(time_, online, lists[list_index], ping)
+            chunk = chunks[chunk_index]
+            if not chunk.point_ids:
+                chunk.min_time = time_
+            chunk.point_ids.append(point.id_)
+            self.point_chunk[point.id_] = chunk
+            self.point_store.append(point)
+        self.point_store.arrays.load_columns(lists, columns)
+        self.chunks.sort(key=lambda c: c.min_time)
+        restored = {chunk.file_name for chunk in chunks if chunk is not None}
+        logger.info(f"已从启动快照恢复 {len(restored)} 个数据块, {len(keep)} 个数据点")
+        return [file for file in files if file not in restored]
 
-    def load_a_file(self, file_path: str, lock: Lock):
+    def save_snapshot(self):
+        """
+        正常退出时写入启动快照, 只在全部数据都已写入数据文件时写入, 否则删除旧的快照
+        """
+        with self.data_ctl_lock:
+            if not config.startup_snapshot or self.unloaded_files or self.non_saved_counter or \
+                    any(chunk.dirty or chunk.file_name is None for chunk in self.chunks):
+                remove_snapshot(self.data_dir)
+                return
+            timer = Counter(create_start=True)
+            entries = []
+            for chunk in self.chunks:
+                file_stat = self.stat_chunk(chunk.file_name)
+                if file_stat is None:
+                    logger.warning(f"数据文件 [{chunk.file_name}] 不存在, 不写入启动快照")
+                    remove_snapshot(self.data_dir)
+                    return
+                size, mtime = file_stat
+                entries.append(SnapshotChunk(chunk.file_name, chunk.window_start, size, mtime,
+                                             chunk.resident, chunk.min_time, chunk.max_time, chunk.count,
+                                             chunk.players))
+            chunk_indexes = {id(chunk): i for i, chunk in enumerate(self.chunks)}
+            list_indexes: dict[int, int] = {}
+            player_lists = []
+            points = self.point_store.items
+            for point in points:
+                if id(point.players) not in list_indexes:
+                    list_indexes[id(point.players)] = len(player_lists)
+                    player_lists.append(tuple((player.name, player.uuid) for player in point.players))
+            columns = {
+                "times": np.fromiter((pt.time for pt in points), np.float64, len(points)),
+                "online": np.fromiter((pt.online for pt in points), np.int32, len(points)),
+                "ping": np.fromiter((pt.ping for pt in points), np.float64, len(points)),
+                "list_index": np.fromiter((list_indexes[id(pt.players)] for pt in points), np.int32, len(points)),
+                "chunk_index": np.fromiter((chunk_indexes[id(self.point_chunk[pt.id_])] for pt in points), np.int32,
+                                           len(points)),
+            }
+        try:
+            save_snapshot(self.data_dir, Snapshot(self.chunk_span_hours, entries, player_lists, columns))
+        except OSError as e:
+            logger.error(f"写入启动快照失败 -> {e}")
+            return
+        logger.info(f"已写入启动快照, 共 {len(points)} 个数据点, 耗时 {timer.endT()}")
+
+    def settle_loaded_chunks(self, chunks: list[DataChunk]):
+        """整理刚从文件加载的数据块, 并恢复数据块和数据点的时间顺序, 调用时需持有锁"""
+        for chunk in chunks:
+            if chunk.resident:
+                chunk.point_ids.sort(key=lambda pt_id: self.point_store.by_id(pt_id).time)
+                chunk.min_time = self.point_store.by_id(chunk.point_ids[0]).time if chunk.point_ids else float("-inf")
+            if chunk.window_start is None and (chunk.point_ids or chunk.count) and not config.background_compact:
+                chunk.dirty = True  # 旧的数据块, 下次保存时按时间窗口重新切分
+        self.chunks.sort(key=lambda c: c.min_time)
+        self.point_store.sort()  # 各个文件内的数据点已经有序, 只需要合并
+
+    def get_file_end_time(self, file: str) -> float | None:
+        """数据文件中数据点的最晚时间 (上限), 按文件名的时间窗口或清单记录判断, 无法判断时返回None"""
+        window_start = parse_window_file(file, self.chunk_span_hours)
+        if window_start is not None:
+            return window_start + self.chunk_span_hours * 3600
+        entry = self.manifest.get(file)
+        if entry is not None and entry.match_stat(self.stat_chunk(file)):
+            return entry.max_time
+        return None
+
+    def split_startup_files(self, files: list[str], recent_start: float) -> tuple[list[str], list[str]]:
+        """
+        把数据文件分为启动时加载的最近的文件和之后加载的旧文件, 无法判断时间的文件在启动时加载
+        :return: (启动时加载的文件, 从新到旧排列的旧文件)
+        """
+        recent = []
+        older = []
+        for file in files:
+            end_time = self.get_file_end_time(file)
+            if end_time is None or end_time >= recent_start:
+                recent.append(file)
+            else:
+                older.append((end_time, file))
+        older.sort(reverse=True)
+        return recent, [file for _, file in older]
+
+    def load_older_files(self, count: int) -> list[ServerPoint]:
+        """
+        渐进加载时加载下一批旧文件, 文件在锁外解析, 只有放入数据块时持有锁
+        :param count: 这一批的文件数
+        :return: 这一批加入常驻内存的数据点
+        """
+        parsed: list[tuple[str, list[ServerPoint]]] = []
+        for file in self.unloaded_files[:count]:
+            try:
+                parsed.append((join(self.data_dir, file), self.read_chunk(file)))
+            except Exception as e:  # 单个文件损坏时跳过, 文件保留在数据文件夹中
+                logger.error(f"加载文件 [{file}] 失败 -> {e}")
+        with self.data_ctl_lock:
+            chunks_count = len(self.chunks)
+            lock = Lock()
+            for file_path, points in parsed:
+                self.add_file_points(file_path, points, lock, self.hot_start)
+            new_chunks = self.chunks[chunks_count:]
+            self.settle_loaded_chunks(new_chunks)
+            removed_times = {pt.time for _, points in parsed for pt in points} & self.pending_removes
+            self.pending_removes -= removed_times
+            for value in removed_times:
+                for chunk in new_chunks:
+                    if not chunk.resident and chunk.min_time <= value <= chunk.max_time:
+                        self.make_resident(chunk)
+                points_at = self.point_store.range(value, value)
+                if points_at:
+                    self.detach_point(points_at[0])
+            del self.unloaded_files[:count]
+            loaded = [pt for _, points in parsed for pt in points if pt.id_ in self.point_store]
+        self.ranges_cache.clear()
+        if not self.unloaded_files:
+            logger.info(f"历史数据加载完成, 共 {self.points_count} 个数据点")
+            if self.save_deferred or self.non_saved_counter >= config.checkpoint_per_points:  # 加载期间的请求合并为一次
+                self.save_deferred = False
+                self.request_save()
+        return loaded
+
+    def add_manifest_chunks(self, files: list[str], hot_start: float) -> list[str]:
+        """
+        按清单添加非常驻的数据块, 调用时需持有锁
+        :return: 仍需解析的文件
+        """
+        remaining = []
+        for file in files:
+            entry = self.manifest.get(file)
+            if entry is None or entry.max_time >= hot_start or not entry.match_stat(self.stat_chunk(file)):
+                remaining.append(file)
+                continue
+            chunk = DataChunk(file, parse_window_file(file, self.chunk_span_hours))
+            chunk.set_cold_meta(entry.min_time, entry.max_time, entry.count, entry.players)
+            self.chunks.append(chunk)
+            if chunk.window_start is not None:
+                self.window_chunks[chunk.window_start] = chunk
+        if len(remaining) < len(files):
+            logger.info(f"已从清单获取 {len(files) - len(remaining)} 个数据块的信息")
+        return remaining
+
+    def load_files_process(self, files: list[str], hot_start: float):
+        """
+        使用进程池解码数据文件, 绕开GIL
+        子进程只返回紧凑的列数据, 由主进程构建数据点对象
+        """
+        lock = Lock()
+        paths = [join(self.data_dir, file) for file in files]
+        locations = [self.packs.locate(file) for file in files]
+        with ProcessPoolExecutor(max_workers=config.data_load_threads) as executor:
+            for path, columns in zip(paths, executor.map(decode_file_columns, paths, locations, chunksize=4)):
+                self.add_file_points(path, points_from_columns(columns), lock, hot_start)
+
+    def replay_wal(self):
+        """
+        在已加载的数据文件之上重放预写日志, 恢复上次检查点之后的数据点
+        检查点已写入但日志未清空时会出现重复, 记录的时间落在非常驻数据块中时先把该数据块加载进内存再对比
+        """
+        time_id_map = {point.time: point.id_ for point in self.point_store}
+        cold_chunks = [chunk for chunk in self.chunks if not chunk.resident]
+        loaded_chunks: list[DataChunk] = []
+
+        def load_cold_chunks(point_time: float):
+            for chunk in [c for c in cold_chunks if c.min_time <= point_time <= c.max_time]:
+                cold_chunks.remove(chunk)
+                self.make_resident(chunk)  # 已经因为加入数据点变为常驻时不会重复加载
+                loaded_chunks.append(chunk)
+                time_id_map.update((self.point_store.by_id(pt_id).time, pt_id) for pt_id in chunk.point_ids)
+
+        replayed = 0
+        for op, value in self.wal.replay():
+            if op == OP_ADD:
+                point = ServerPoint.from_dict(value)
+                if point.time not in time_id_map:
+                    load_cold_chunks(point.time)
+                if point.time not in time_id_map:
+                    self.attach_point(point)
+                    time_id_map[point.time] = point.id_
+            elif op == OP_REMOVE:
+                if value not in time_id_map:  # 被删除的数据点在非常驻数据块中
+                    load_cold_chunks(value)
+                point_id = time_id_map.pop(value, None)
+                if point_id is not None:
+                    self.detach_point(self.point_store.by_id(point_id))
+                elif self.unloaded_files:  # 所在的文件还没有加载
+                    self.pending_removes.add(value)
+            replayed += 1
+        self.release_old_chunks([chunk for chunk in loaded_chunks if not chunk.dirty])  # 只用来对比的数据块重新释放
+        self.non_saved_counter = replayed
+        if replayed:
+            logger.info(f"已从预写日志恢复 {replayed} 条记录")
+
+    def load_a_file(self, file_path: str, lock: Lock, hot_start: float = float("-inf"),
+                    data: bytes | Exception | None = None):
         """
         从给定的文件路径加载数据点
-        旧格式: list[dict[]], 新格式: dict[str, Any]
         :param file_path: 文件路径
         :param lock: 字典操作的锁
+        :param hot_start: 最后一个数据点早于该时间的数据块不常驻内存, 只记录元数据并放入缓存
+        :param data: 打包存储的数据块的内容, 从打包文件读取失败时为异常
         """
-        thr_name = current_thread().name
-        with open(file_path, "r") as f:
-            data_obj: list[dict] = json.load(f)
-        logger.info(f"[{thr_name}] 已加载文件 [{basename(file_path)}]")
+        if isinstance(data, Exception):
+            logger.error(f"从打包文件读取 [{basename(file_path)}] 失败 -> {data}")
+            return
+        self.add_file_points(file_path, self.read_a_file(file_path, data), lock, hot_start)
+
+    def list_chunk_files(self) -> list[str]:
+        """
+        列出数据文件夹中的单独的数据文件和打包存储的数据块
+        同时存在时以打包存储的为准 (转换为打包存储后没能删除的旧文件), 旧文件会被删除
+        """
+        try:
+            self.packs.load()
+        except OSError as e:
+            logger.error(f"读取打包文件失败 -> {e}")
+        files = set(self.packs.names())
+        for file in listdir(self.data_dir):
+            if not is_data_file(file):
+                continue
+            if file in files:
+                try:
+                    remove(join(self.data_dir, file))
+                    logger.info(f"删除已打包的文件 [{file}]")
+                except OSError as e:
+                    logger.warning(f"删除已打包的文件 [{file}] 失败 -> {e}")
+                continue
+            files.add(file)
+        return list(files)
+
+    def iter_chunk_data(self, files: list[str]) -> Iterator[tuple[str, bytes | Exception | None]]:
+        """
+        产出 (文件名, 数据块内容), 单独的文件内容为None (由加载线程自己读取)
+        打包存储的数据块按打包文件中的顺序一次读出, 读取失败时内容为异常
+        """
+        packed = []
+        for file in files:
+            if file in self.packs:
+                packed.append(file)
+            else:
+                yield file, None
+        try:
+            yield from self.packs.iter_read(packed)
+        except OSError as e:
+            logger.error(f"读取打包文件失败 -> {e}")
+
+    def stat_chunk(self, file_name: str) -> tuple[int, float] | None:
+        """数据块的 (大小, 修改时间), 打包存储的数据块为打包记录中的值, 不存在时返回None"""
+        entry = self.packs.get(file_name)
+        if entry is not None:
+            return entry.length, entry.mtime
+        return stat_file(join(self.data_dir, file_name))
+
+    def read_chunk(self, file_name: str) -> list[ServerPoint]:
+        """
+        读取数据块中的数据点, 打包存储的数据块从打包文件读取
+        :raises OSError: 读取失败
+        :raises ValueError: 数据块已损坏
+        """
+        return self.read_a_file(join(self.data_dir, file_name), self.packs.read(file_name))
+
+    def sniff_chunk_fmt(self, file_name: str) -> DataSaveFmt | None:
+        """判断数据块的存储格式, 见 sniff_data_fmt"""
+        try:
+            return sniff_data_fmt(join(self.data_dir, file_name), self.packs.read(file_name))
+        except (OSError, ValueError) as e:
+            logger.warning(f"判断数据块 [{file_name}] 的存储格式失败 -> {e}")
+            return None
+
+    def add_file_points(self, file_path: str, points: list[ServerPoint], lock: Lock,
+                        hot_start: float = float("-inf")):
+        """把从文件中读取的数据点放入对应的数据块"""
+        file_name = basename(file_path)
+        chunk = DataChunk(file_name, parse_window_file(file_name, self.chunk_span_hours))
+        entry = self.manifest.get(file_name)
+        if points and (entry is None or not entry.match_stat(self.stat_chunk(file_name))):
+            self.manifest.put(file_name, self.make_manifest_entry(file_name, points, self.sniff_chunk_fmt(file_name)))
+        existing = self.window_chunks.get(chunk.window_start) if chunk.window_start is not None else None
+        if existing is not None and existing.file_name is None:  # 渐进加载时, 这个时间窗口的新数据点先于文件加入
+            with lock:
+                self.point_store.sort()  # 同一批中先加入的文件的数据点可能还没有排序
+                known_times = {self.point_store.by_id(pt_id).time for pt_id in existing.point_ids}
+                for point in points:
+                    if point.time not in known_times:
+                        self.attach_point(point)
+                existing.file_name = file_name  # 下次保存时写入合并后的数据并替换这个文件
+            return
+        if points and max(pt.time for pt in points) < hot_start:
+            chunk.set_cold(points)
+            points.sort(key=lambda pt: pt.time)
+            self.chunk_cache.put(chunk.file_name, points, estimate_points_size(points))
+            with lock:
+                self.chunks.append(chunk)
+                if chunk.window_start is not None:
+                    self.window_chunks[chunk.window_start] = chunk
+            return
         with lock:
-            if isinstance(data_obj, list):
-                for point_dict in data_obj:
-                    point = ServerPoint.from_dict(point_dict)
-                    self.points_map[point.id_] = point
-            elif isinstance(data_obj, dict) and data_obj["fmt"] == DataSaveFmt.PLAYER_LIST_MAPPING.value:
-                player_list_map_t1: dict[str, list[dict[str, str]]] = data_obj["players_mapping"]
-                for point_dict in data_obj["points"]:
-                    players_list_id: str = point_dict["players"]
-                    if players_list_id in player_list_map_t1:
-                        point_dict["players"] = player_list_map_t1[players_list_id]
-                    else:
-                        point_dict["players"] = []
-                        logger.warning(
-                            f"[{thr_name}] 玩家映射文件 [{basename(file_path)}] 中找不到玩家映射 {players_list_id}")
-                    point = ServerPoint.from_dict(point_dict)
-                    self.points_map[point.id_] = point
-            elif isinstance(data_obj, dict) and data_obj["fmt"] == DataSaveFmt.PLAYER_MAPPING.value:
-                player_list_map_t2: dict[str, list[str]] = data_obj["player_list_mapping"]
-                players_map: dict[str, dict[str, str]] = data_obj["players_mapping"]
-                for point_dict in data_obj["points"]:
-                    player_list_id = point_dict["players"]
-                    if player_list_id in player_list_map_t2:
-                        players = player_list_map_t2[player_list_id]
-                    else:
-                        players = []
-                        logger.warning(
-                            f"[{thr_name}] 玩家映射文件 [{basename(file_path)}] 中找不到玩家映射 {player_list_id}")
-                    raw_players = [players_map[name] for name in players]
-                    point_dict["players"] = raw_players
+            self.chunks.append(chunk)
+            if chunk.window_start is not None:
+                self.window_chunks[chunk.window_start] = chunk
+            for point in points:
+                self.attach_point(point, chunk)
+
+    @staticmethod
+    def read_a_file(file_path: str, data: bytes | None = None) -> list[ServerPoint]:
+        """
+        从给定的文件路径读取数据点
+        旧格式: list[dict[]], 新格式: dict[str, Any], 列式格式: .bin 二进制文件
+        文件名带压缩扩展名时会被流式解压
+        :param file_path: 文件路径
+        :param data: 打包存储的数据块的内容, 不为None时 file_path 只用于判断格式和压缩方式
+        """
+        thr_name = current_thread().name
+        if strip_compress_ext(file_path).endswith(".bin"):
+            with open_data_file(file_path, data) as f:
+                points = loads_columnar(f.read())
+            logger.info(f"[{thr_name}] 已加载文件 [{basename(file_path)}]")
+            return points
+        return [ServerPoint.from_dict(point_dict) for point_dict in DataManager.iter_point_dicts(file_path, data)]
+
+    @staticmethod
+    def iter_point_dicts(file_path: str, data: bytes | None = None) -> Iterator[dict]:
+        """
+        流式读取json数据文件中的数据点字典, 玩家映射会被展开
+        每次只解析一个数据点, 内存占用与文件大小无关, 只需要额外存放映射表
+        映射表写在数据点之前, 顺序读一遍即可; 旧版本写出的文件映射表在数据点之后, 见 iter_legacy_point_dicts
+        :param file_path: 文件路径
+        :param data: 打包存储的数据块的内容, 见 read_a_file
+        """
+        thr_name = current_thread().name
+        file_name = basename(file_path)
+        with open_data_file(file_path, data) as f:
+            stream = JsonStream(f)
+            if stream.peek() == "[":
+                yield from stream.iter_values()
+                logger.info(f"[{thr_name}] 已加载文件 [{file_name}]")
+                return
+            fmt: DataSaveFmt | None = None
+            tables: dict[str, Any] = {}
+            for key in stream.iter_object():
+                if key == "fmt":
+                    fmt = DataSaveFmt(stream.read_value())
+                    if fmt not in MAPPED_POINTS_KEYS:
+                        raise ValueError(f"未知的数据文件格式 -> {fmt}")
+                elif key in MAPPED_POINTS_KEYS.values():
+                    if fmt is None or not all(name in tables for name in MAPPED_TABLE_KEYS[fmt]):
+                        break
+                    yield from DataManager.expand_point_dicts(stream, fmt, tables, file_name)
+                    logger.info(f"[{thr_name}] 已加载文件 [{file_name}]")
+                    return
+                else:
+                    tables[key] = DataManager.read_mapping_table(stream, fmt, key, tables)
+        yield from DataManager.iter_legacy_point_dicts(file_path, data)
+
+    @staticmethod
+    def iter_legacy_point_dicts(file_path: str, data: bytes | None = None) -> Iterator[dict]:
+        """
+        读取映射表写在数据点之后的旧文件 (最初的 json.dump 格式也是这样), 先扫描一遍文件读取映射表, 再从头读取数据点
+        这样的文件在数据块下次被重写 (保存或压实) 时会换成新的顺序
+        """
+        thr_name = current_thread().name
+        file_name = basename(file_path)
+        fmt: DataSaveFmt | None = None
+        tables: dict[str, Any] = {}
+        with open_data_file(file_path, data) as f:
+            stream = JsonStream(f)
+            for key in stream.iter_object():
+                if key == "fmt":
+                    fmt = DataSaveFmt(stream.read_value())
+                elif key in MAPPED_POINTS_KEYS.values():
+                    stream.skip_value()
+                else:
+                    tables[key] = DataManager.read_mapping_table(stream, fmt, key, tables)
+        if fmt not in MAPPED_POINTS_KEYS or not all(name in tables for name in MAPPED_TABLE_KEYS[fmt]):
+            raise ValueError(f"数据文件 [{file_name}] 的格式错误 -> {fmt}")
+        with open_data_file(file_path, data) as f:
+            stream = JsonStream(f)
+            for key in stream.iter_object():
+                if key == MAPPED_POINTS_KEYS[fmt]:
+                    yield from DataManager.expand_point_dicts(stream, fmt, tables, file_name)
+                else:
+                    stream.skip_value()
+        logger.info(f"[{thr_name}] 已加载文件 [{file_name}]")
+
+    @staticmethod
+    def read_mapping_table(stream: JsonStream, fmt: DataSaveFmt | None, name: str, tables: dict[str, Any]) -> Any:
+        """
+        读取一个映射表, 玩家列表逐项换成池中共享的元组, 不保留解析出的玩家字典
+        PLAYER_MAPPING 的玩家列表表在玩家表之前时 (旧文件) 只能先保留玩家名, 展开数据点时再换成元组
+        """
+        if fmt == DataSaveFmt.PLAYER_LIST_MAPPING and name == "players_mapping":
+            return {list_id: player_pool.from_dicts(players) for list_id, players in stream.read_object_items()}
+        if fmt == DataSaveFmt.PLAYER_MAPPING and name == "players_mapping":
+            return {player_name: player.get("uuid", DEFAULT_UUID) for player_name, player in stream.read_object_items()}
+        if fmt == DataSaveFmt.PLAYER_MAPPING and name == "player_list_mapping" and "players_mapping" in tables:
+            uuids: dict[str, str] = tables["players_mapping"]
+            return {list_id: player_pool.get_list(tuple((player_name, uuids[player_name]) for player_name in names))
+                    for list_id, names in stream.read_object_items()}
+        return stream.read_large_value()
+
+    @staticmethod
+    def expand_point_dicts(stream: JsonStream, fmt: DataSaveFmt, tables: dict[str, Any],
+                           file_name: str) -> Iterator[dict]:
+        """逐个读取数据点数组中的元素, 用映射表展开玩家列表, 映射格式的玩家列表是池中共享的元组, 见 read_mapping_table"""
+        thr_name = current_thread().name
+        if fmt == DataSaveFmt.PLAYER_LIST_MAPPING:
+            player_list_map_t1: dict[str, tuple[Player, ...]] = tables["players_mapping"]
+            for point_dict in stream.iter_values():
+                players_list_id: str = point_dict["players"]
+                if players_list_id in player_list_map_t1:
+                    point_dict["players"] = player_list_map_t1[players_list_id]
+                else:
+                    point_dict["players"] = player_pool.get_list(())
+                    logger.warning(f"[{thr_name}] 玩家映射文件 [{file_name}] 中找不到玩家映射 {players_list_id}")
+                yield point_dict
+        elif fmt == DataSaveFmt.PLAYER_MAPPING:
+            player_list_map_t2: dict[str, tuple[Player, ...] | list[str]] = tables["player_list_mapping"]
+            uuids: dict[str, str] = tables["players_mapping"]
+            for point_dict in stream.iter_values():
+                player_list_id = point_dict["players"]
+                players = player_list_map_t2.get(player_list_id)
+                if players is None:
+                    logger.warning(f"[{thr_name}] 玩家映射文件 [{file_name}] 中找不到玩家映射 {player_list_id}")
+                    players = player_list_map_t2[player_list_id] = player_pool.get_list(())
+                elif id(players) not in player_pool.list_ids:  # 旧文件的玩家列表表只有玩家名, 每个列表只转换一次
+                    players = player_list_map_t2[player_list_id] = \
+                        player_pool.get_list(tuple((name, uuids[name]) for name in players))
+                point_dict["players"] = players
+                yield point_dict
+        elif fmt == DataSaveFmt.RUN_LENGTH:
+            player_lists = DataManager.get_run_player_lists(tables)
+            for start, end, run_count, online, list_index, pings in stream.iter_values():
+                run = PointRun(start, end, run_count, online, player_lists[list_index])
+                if not isinstance(pings, list):  # 延迟全部相同 (旧版本写出的文件是平均延迟)
+                    pings = repeat(pings)
+                for point_time, ping in zip(run.iter_times(), pings):
+                    yield {"time": point_time, "online": online, "players": run.players, "ping": ping}
+
+    @staticmethod
+    def get_run_player_lists(tables: dict[str, Any]) -> list[tuple[Player, ...]]:
+        """游程格式的玩家列表表, 换成池中共享的元组"""
+        uuids: dict[str, str] = tables["uuids"]
+        return [player_pool.get_list(tuple((name, uuids[name]) for name in names)) for names in tables["player_lists"]]
+
+    @staticmethod
+    def read_file_runs(file_path: str, data: bytes | None = None) -> list[PointRun] | None:
+        """
+        读取游程格式数据文件中的游程, 不展开为数据点, 也不保留延迟, 用于统计在线时间段
+        :param file_path: 文件路径
+        :param data: 打包存储的数据块的内容, 见 read_a_file
+        :return: 按时间顺序的游程, 文件不是游程格式时返回None
+        """
+        if strip_compress_ext(file_path).endswith(".bin"):
+            return None
+        tables: dict[str, Any] = {}
+        with open_data_file(file_path, data) as f:
+            stream = JsonStream(f)
+            if stream.peek() == "[":
+                return None
+            for key in stream.iter_object():
+                if key == "fmt":
+                    if stream.read_value() != DataSaveFmt.RUN_LENGTH.value:
+                        return None
+                elif key == MAPPED_POINTS_KEYS[DataSaveFmt.RUN_LENGTH]:
+                    if not all(name in tables for name in MAPPED_TABLE_KEYS[DataSaveFmt.RUN_LENGTH]):
+                        return None
+                    player_lists = DataManager.get_run_player_lists(tables)
+                    return [PointRun(start, end, run_count, online, player_lists[list_index])
+                            for start, end, run_count, online, list_index, _ in stream.iter_values()]
+                else:
+                    tables[key] = stream.read_large_value()
+        return None
 
     def save_data(self) -> None | str:
         """
-        保存数据到预设好的文件夹中
-        tip: 会比对文件哈希值并删除失效的数据文件
+        保存数据到预设好的文件夹中 (检查点)
+        tip: 只重写脏数据块并删除被替换掉的旧文件, 成功写入后删除轮换出的预写日志
+        持有数据锁的时间只有获取快照和更新数据块信息两步, 编码和写入文件时不阻塞数据点的获取和查询
         """
         if not config.enable_data_save:
             logger.info("数据保存已禁用，跳过保存")
             return None
+        if self.unloaded_files:  # 旧文件还没有加载时写入的文件可能覆盖它们, 新数据点保留在预写日志中
+            logger.info("历史数据还在加载中, 跳过保存")
+            return None
         data_save_fmt: DataSaveFmt = copy(config.data_save_fmt)
-        logger.info(f"保存数据到 [{self.data_dir}]... 格式: {data_save_fmt.name}")
-        self.data_files.clear()
-        ready_points: list[dict] = []
-        points_counter = 0
-        rewrite_data = False
-        if self.last_fmt != data_save_fmt:
-            self.last_fmt = data_save_fmt
-            rewrite_data = True
+        data_compress: DataCompress = copy(config.data_compress)
+        logger.info(f"保存数据到 [{self.data_dir}]... 格式: {data_save_fmt.name}, 压缩: {data_compress.name}")
+        failure_files: list[str] = []
 
-        with self.data_ctl_lock:
-            points_length = len(self.points_map)
-            for index, point in enumerate(self.points_map.values()):
-                ready_points.append(point.to_dict())
-                points_counter += 1
-                if points_counter >= config.points_per_file or index == points_length - 1:
-                    try:
-                        self.dump_points(ready_points, data_save_fmt, rewrite_data)
-                    except OSError as e:
-                        logger.error(f"保存数据时发生错误, 终止保存 -> {e}")
-                        return f"保存数据时发生错误, 终止保存 -> {e}"
-                    ready_points = []
-                    points_counter = 0
-
-        failure_files = listdir(self.data_dir)
-        for file in self.data_files:
-            if file in failure_files:
-                failure_files.remove(file)
+        with self.save_lock:
+            with self.data_ctl_lock:
+                try:  # 先轮换日志, 失败时数据块保持为脏, 新数据点继续写入当前日志
+                    self.wal.rotate()
+                except OSError as e:
+                    logger.error(f"轮换预写日志失败, 跳过本次保存 -> {e}")
+                    return f"轮换预写日志失败, 跳过本次保存 -> {e}"
+                if self.last_fmt != data_save_fmt or self.last_compress != data_compress:
+                    self.last_fmt = data_save_fmt
+                    self.last_compress = data_compress
+                    if not config.background_compact:  # 格式变化, 所有数据块都需要重写, 否则交给后台压实逐个转换
+                        for chunk in self.chunks:
+                            chunk.dirty = True
+                for chunk in [c for c in self.chunks if c.dirty and c.window_start is None]:
+                    self.split_legacy_chunk(chunk)
+                snapshot = [(chunk, self.get_chunk_points(chunk)) for chunk in self.chunks if chunk.dirty]
+                for chunk, _ in snapshot:
+                    chunk.dirty = False
+                dict_source = list(self.point_store) if self.zdict_store.current is None else None
+                self.non_saved_counter = 0
+
+            shared_dict = None
+            if data_compress == DataCompress.ZLIB and snapshot:
+                # 首次保存时用全部常驻数据构建字典, 之后只看要写入的数据块
+                shared_dict = self.update_shared_dict(
+                    dict_source if dict_source is not None else [pt for _, points in snapshot for pt in points])
+            written: list[tuple[DataChunk, list[ServerPoint], str | None, ManifestEntry | None]] = []
+            error = None
+            for chunk, points in snapshot:
+                try:
+                    file_name, entry = self.dump_chunk_file(chunk, points, data_save_fmt, data_compress, shared_dict)
+                except OSError as e:
+                    logger.error(f"保存数据时发生错误, 终止保存 -> {e}")
+                    error = f"保存数据时发生错误, 终止保存 -> {e}"
+                    break
+                except ValueError:
+                    error = f"未知的存储格式, 终止保存 -> {data_save_fmt}"
+                    break
+                written.append((chunk, points, file_name, entry))
+
+            with self.data_ctl_lock:
+                for chunk, points, file_name, entry in written:
+                    old_file = self.finish_chunk_write(chunk, points, file_name, entry)
+                    if old_file is not None:
+                        failure_files.append(old_file)
+                for chunk, _ in snapshot[len(written):]:  # 没有写入的数据块留到下次保存
+                    chunk.dirty = True
+                self.release_old_chunks([chunk for chunk, *_ in written])
+            self.save_manifest()
+            if error is not None:  # 保留轮换出的预写日志, 下次启动时重放
+                return error
+            self.wal.discard_rotated()
+            return self.remove_failure_files(failure_files)
+
+    def start_saver(self):
+        """启动后台保存线程, 之后达到检查点时由该线程保存数据, 不阻塞获取数据点的线程"""
+        if self.saver_thread is None:
+            self.saver_thread = Thread(name="Saver", target=self.saver_thread_func, daemon=True)
+            self.saver_thread.start()
+
+    def request_save(self):
+        """
+        请求保存数据, 后台保存线程正在保存时, 多次请求会合并为一次
+        历史数据加载完成之前不能保存, 请求先记下来, 由 load_older_files 在加载完成后发出一次
+        """
+        if self.unloaded_files:
+            self.save_deferred = True
+            return
+        if self.saver_thread is None:
+            self.save_data()
+        else:
+            self.save_event.set()
+
+    def stop_saver(self):
+        """停止后台保存线程, 阻塞到最后一次保存完成; 没有启动后台保存线程时直接保存"""
+        if self.saver_thread is None:
+            self.save_data()
+            return
+        self.saver_stop_flag.set()
+        self.save_event.set()
+        self.saver_thread.join()
+        self.saver_thread = None
+
+    def saver_thread_func(self):
+        while True:
+            self.save_event.wait()
+            self.save_event.clear()
+            try:
+                msg = self.save_data()
+            except Exception as e:  # 意外的错误不能结束保存线程, 之后的检查点都依赖它
+                logger.error(f"后台保存时发生意外错误, {SAVE_RETRY_WAIT:.0f} 秒后重试 -> {e}")
+                self.saver_stop_flag.wait(SAVE_RETRY_WAIT)
+                self.save_event.set()
+                continue
+            if msg is not None:
+                logger.warning(f"后台保存失败 -> {msg}")
+            if self.saver_stop_flag.is_set() and not self.save_event.is_set():  # 停止前的请求都已保存
+                return
+
+    def save_manifest(self):
+        """清单或打包索引有变化时写入, 调用时需持有保存锁"""
+        if self.manifest.changed:
+            try:
+                self.manifest.save()
+            except OSError as e:  # 清单只是缓存, 写入失败不影响数据
+                logger.warning(f"保存数据块清单失败 -> {e}")
+        try:
+            self.packs.save()
+        except OSError as e:  # 索引之后追加的记录会在下次加载时从打包文件扫描恢复
+            logger.warning(f"保存打包索引失败 -> {e}")
+
+    def remove_failure_files(self, failure_files: list[str]) -> None | str:
+        """删除被新文件替换掉的旧数据文件"""
         for file in failure_files:
             full_path = join(self.data_dir, file)
             try:
+                removed = self.packs.remove(file)
                 if exists(full_path) and isfile(full_path):
                     remove(full_path)
+                    removed = True
+                if removed:
+                    remove_rollup(self.data_dir, file)
                     logger.info(f"移除失效文件 [{file}]...")
                 else:
                     logger.warning(f"文件 [{file}] 不存在, 跳过删除")
             except OSError as e:
                 logger.error(f"移除失效文件时发生系统错误, 终止保存 -> {e}")
                 return f"移除失效文件时发生错误, 终止保存 -> {e}"
+        return None
+
+    def get_compact_chunk(self) -> DataChunk | None:
+        """
+        查找一个需要压实的数据块, 调用时不需要持有锁
+        旧的按数量切分的数据块需要按时间窗口重新切分, 存储格式或压缩方式与当前设置不同的数据块需要转换格式
+        清单中没有记录格式的数据块在锁外读取文件判断格式, 结果记在数据块上
+        """
+        unknown: list[tuple[DataChunk, str]] = []
+        with self.data_ctl_lock:
+            for chunk in self.chunks:
+                if chunk.file_name is None or chunk.dirty:  # 脏块会在下次保存时重写
+                    continue
+                if not chunk.point_ids and not chunk.count:  # 没能读出数据点的文件不动, 以免被当作空数据块删除
+                    continue
+                if chunk.window_start is None:
+                    return chunk
+                if get_compress_way(chunk.file_name) != config.data_compress:
+                    return chunk
+                if (chunk.file_name in self.packs) != config.pack_chunks:
+                    return chunk
+                fmt_name = self.get_chunk_fmt_name(chunk)
+                if fmt_name is None:
+                    unknown.append((chunk, chunk.file_name))
+                elif fmt_name != config.data_save_fmt.name:
+                    return chunk
+        for chunk, file_name in unknown:
+            fmt = self.sniff_chunk_fmt(file_name)
+            fmt_name = fmt.name if fmt is not None else None
+            with self.data_ctl_lock:
+                if chunk.file_name != file_name:  # 判断期间已被重写或移除
+                    continue
+                chunk.fmt_name = fmt_name
+            if fmt_name != config.data_save_fmt.name:
+                return chunk
+        return None
+
+    def compact_chunk(self, chunk: DataChunk) -> None | str:
+        """
+        压实一个数据块: 切分旧数据块或转换存储格式, 并去掉时间重复的数据点
+        新文件写入完成后才删除旧文件, 中途崩溃时重复的数据点会在下次压实时去掉
+        与 save_data 一样只在获取快照和更新数据块信息时持有数据锁, 非常驻数据块的文件也在锁外读取
+        """
+        data_save_fmt: DataSaveFmt = copy(config.data_save_fmt)
+        data_compress: DataCompress = copy(config.data_compress)
+        failure_files: list[str] = []
+        with self.save_lock:
+            cold_file, cold_points = None, None
+            if chunk.window_start is not None and not chunk.resident:
+                cold_file = chunk.file_name
+                try:
+                    cold_points = sorted(self.read_chunk(cold_file), key=lambda pt: pt.time)
+                except (OSError, ValueError) as e:
+                    logger.error(f"压实数据块时读取 [{cold_file}] 失败 -> {e}")
+                    return f"压实数据块时读取 [{cold_file}] 失败 -> {e}"
 
-    def dump_points(self, points: list[dict], fmt: DataSaveFmt, rewrite_data: bool = False):
+            with self.data_ctl_lock:
+                if chunk not in self.chunks or chunk.dirty:  # 已经被移除, 或者有新的改动等待保存
+                    return None
+                if chunk.window_start is None:
+                    moved_ids = self.split_legacy_chunk(chunk)
+                    targets = list({id(c): c for c in (self.point_chunk[i] for i in moved_ids)}.values()) + [chunk]
+                elif cold_points is not None and not chunk.resident and chunk.file_name == cold_file:
+                    targets = []  # 非常驻数据块直接在快照中去重, 不需要加载进 point_store
+                else:
+                    self.make_resident(chunk)
+                    targets = [chunk]
+                removed = sum(self.drop_duplicate_points(c) for c in targets)
+                snapshot = [(target, self.get_chunk_points(target)) for target in targets]
+                if not targets:
+                    points = [pt for i, pt in enumerate(cold_points) if i == 0 or pt.time != cold_points[i - 1].time]
+                    removed = len(cold_points) - len(points)
+                    snapshot = [(chunk, points)]
+                for target, _ in snapshot:
+                    target.dirty = False
+                dict_source = None
+                if data_compress == DataCompress.ZLIB and self.zdict_store.current is None:
+                    dict_source = list(self.point_store)
+
+            shared_dict = None
+            if data_compress == DataCompress.ZLIB:
+                shared_dict = self.zdict_store.current if dict_source is None else self.update_shared_dict(dict_source)
+            written: list[tuple[DataChunk, list[ServerPoint], str | None, ManifestEntry | None]] = []
+            error = None
+            for target, points in snapshot:
+                try:
+                    file_name, entry = self.dump_chunk_file(target, points, data_save_fmt, data_compress, shared_dict)
+                except OSError as e:
+                    logger.error(f"压实数据块时发生错误 -> {e}")
+                    error = f"压实数据块时发生错误 -> {e}"
+                    break
+                except ValueError:
+                    error = f"未知的存储格式 -> {data_save_fmt}"
+                    break
+                written.append((target, points, file_name, entry))
+
+            with self.data_ctl_lock:
+                for target, points, file_name, entry in written:
+                    old_file = self.finish_chunk_write(target, points, file_name, entry)
+                    if old_file is not None:
+                        failure_files.append(old_file)
+                    if not target.resident and removed and points:  # 去重后更新非常驻数据块的元数据
+                        target.set_cold(points)
+                        target.rollup = None
+                for target, _ in snapshot[len(written):]:  # 没有写入的数据块留到下次保存
+                    target.dirty = True
+                self.release_old_chunks([target for target, *_ in written])
+            self.save_manifest()
+        if error is not None:
+            return error
+        if removed:
+            logger.info(f"压实数据块时去掉了 {removed} 个重复的数据点")
+            self.ranges_cache.clear()
+        return self.remove_failure_files(failure_files)
+
+    def drop_duplicate_points(self, chunk: DataChunk) -> int:
+        """
+        去掉数据块中时间相同的数据点, 调用时需持有锁
+        :return: 去掉的数据点数
         """
-        存储给定的数据点字典到文件, 把所有数据点的时间作md5哈希作为文件名
-        :param points: 数据点字典列表
+        duplicates = []
+        last_time = None
+        for pt_id in chunk.point_ids:
+            point = self.point_store.by_id(pt_id)
+            if point.time == last_time:
+                duplicates.append(point)
+            last_time = point.time
+        for point in duplicates:
+            self.detach_point(point)
+        return len(duplicates)
+
+    def dump_chunk_file(self, chunk: DataChunk, points: list[ServerPoint], fmt: DataSaveFmt, compress: DataCompress,
+                        shared_dict: SharedDict | None) -> tuple[str | None, ManifestEntry | None]:
+        """
+        把数据块的数据点写入文件, 不需要持有锁
+        :return: 文件名和清单记录, 没有数据点时都为None
+        :raises OSError: 写入文件失败
+        :raises ValueError: 未知的存储格式
+        """
+        if not points:
+            return None, None
+        file_stem = get_window_file_stem(chunk.window_start, self.chunk_span_hours)
+        if config.pack_chunks:
+            file_name = self.pack_points(points, fmt, compress, shared_dict, file_stem)
+        else:
+            file_name = self.dump_points(points, fmt, True, compress, shared_dict, file_stem)
+            if file_name is None:
+                raise ValueError(fmt)
+            self.packs.remove(file_name)  # 从打包存储转换回单独的文件
+        save_rollup(self.data_dir, file_name, ChunkRollup.build(points), self.stat_chunk(file_name))
+        return file_name, self.make_manifest_entry(file_name, points, fmt)
+
+    def pack_points(self, points: list[ServerPoint], fmt: DataSaveFmt, compress: DataCompress,
+                    shared_dict: SharedDict | None, file_stem: str) -> str:
+        """
+        把数据点追加写入打包文件, 同名的单独文件 (从单独的文件转换为打包存储时) 会被删除
+        :return: 数据块文件名
+        :raises OSError: 写入失败
+        :raises ValueError: 未知的存储格式
+        """
+        if not isinstance(fmt, DataSaveFmt):
+            logger.error(f"未知的存储格式 -> {fmt}")
+            raise ValueError(fmt)
+        file_name = get_data_file_name(file_stem, fmt, compress)
+        self.packs.append(file_name, encode_points_file(points, fmt, compress, shared_dict))
+        logger.info(f"保存数据块 [{file_name}] 到打包文件")
+        loose_path = join(self.data_dir, file_name)
+        if exists(loose_path):
+            try:
+                remove(loose_path)
+            except OSError as e:  # 打包存储的数据块优先, 留下的文件会在下次加载时删除
+                logger.warning(f"删除已打包的文件 [{file_name}] 失败 -> {e}")
+        return file_name
+
+    def finish_chunk_write(self, chunk: DataChunk, points: list[ServerPoint], file_name: str | None,
+                           entry: ManifestEntry | None) -> str | None:
+        """
+        文件写入后更新数据块和清单, 数据块为空时移除该数据块, 调用时需持有锁
+        :return: 需要删除的旧文件名
+        """
+        old_file = chunk.file_name
+        if file_name is not None:
+            chunk.file_name = file_name
+            chunk.fmt_name = entry.fmt if entry is not None else None
+            self.manifest.put(file_name, entry)
+            if not chunk.resident:  # 文件名相同时 (如压实时只去掉了重复的数据点) 也要替换缓存
+                self.discard_cached_chunk(old_file)
+                self.chunk_cache.put(file_name, points, estimate_points_size(points))
+        else:
+            chunk.file_name = None
+            if not chunk.dirty and chunk in self.chunks:  # 写入期间没有新的数据点加入
+                self.chunks.remove(chunk)
+                self.window_chunks.pop(chunk.window_start, None)
+        if old_file is not None and old_file != chunk.file_name:
+            self.manifest.discard(old_file)
+            return old_file
+        return None
+
+    def split_legacy_chunk(self, chunk: DataChunk) -> list[int]:
+        """
+        把旧的按数量切分的数据块拆分到对应时间窗口的数据块中, 调用时需持有锁
+        数据点一直留在 point_store 中, 只改变所属的数据块
+        :return: 被移动的数据点id
+        """
+        self.make_resident(chunk)
+        chunk.rollup = None  # 数据块会被清空, 不需要逐个更新汇总
+        moved_ids = list(chunk.point_ids)
+        chunk.point_ids.clear()
+        chunk.dirty = True
+        for pt_id in moved_ids:
+            self.point_chunk.pop(pt_id)
+            self.attach_point(self.point_store.by_id(pt_id))
+        logger.info(f"已将旧数据块 [{chunk.file_name}] 按时间窗口重新切分")
+        return moved_ids
+
+    def release_old_chunks(self, chunks: list[DataChunk]):
+        """按需加载模式下, 把写入后已经不在常驻时间范围内的数据块重新释放, 调用时需持有锁"""
+        for chunk in chunks:
+            if chunk.resident and chunk.point_ids and self.point_store.by_id(chunk.point_ids[-1]).time < self.hot_start:
+                self.release_chunk(chunk)
+
+    def release_chunk(self, chunk: DataChunk):
+        """把已保存的常驻数据块释放为非常驻, 数据点移入缓存, 调用时需持有锁"""
+        points = [self.point_store.by_id(pt_id) for pt_id in chunk.point_ids]
+        start, _ = self.point_store.bisect(min(pt.time for pt in points))
+        self.point_store.remove_many(points)
+        self.log_shift(start, -len(points))
+        for point in points:
+            self.point_chunk.pop(point.id_)
+        chunk.set_cold(points)
+        self.chunk_cache.put(chunk.file_name, points, estimate_points_size(points))
+
+    def repack(self, pack: str) -> None | str:
+        """重新打包一个被覆盖的记录占比过高的打包文件, 回收旧记录占用的空间"""
+        with self.save_lock, self.data_ctl_lock:
+            try:
+                self.packs.repack(pack)
+            except (OSError, ValueError) as e:
+                logger.error(f"重新打包 [{pack}] 失败 -> {e}")
+                return f"重新打包 [{pack}] 失败 -> {e}"
+        return None
+
+    def get_expired_chunk(self) -> DataChunk | None:
+        """查找一个时间窗口已经超过保留期限的数据块, 只处理已保存且没有新改动的数据块, 调用时需持有锁"""
+        if config.raw_retention_days <= 0:
+            return None
+        expire_time = time() - config.raw_retention_days * 86400
+        for chunk in self.chunks:
+            if chunk.window_start is None or chunk.file_name is None or chunk.dirty:
+                continue
+            if chunk.window_start + self.chunk_span_hours * 3600 <= expire_time:
+                return chunk
+        return None
+
+    def archive_chunk(self, chunk: DataChunk) -> None | str:
+        """
+        把超过保留期限的数据块移入归档文件夹, 并从内存、清单和数据文件夹中移除
+        归档文件和索引写入完成后才删除原文件, 中途崩溃时数据块会在下次启动后重新归档, 重复的数据点会被合并
+        与 save_data 一样只在获取快照和移除数据块时持有数据锁, 读写归档文件时不阻塞数据点的获取和查询
+        """
+        archive_data = config.archive_old_data
+        with self.save_lock:
+            with self.data_ctl_lock:
+                if chunk not in self.chunks or chunk.dirty:
+                    return None
+                source_file = chunk.file_name
+                points = self.get_chunk_points(chunk) if chunk.resident else None
+
+            def loader():
+                cold_points = sorted(self.read_chunk(source_file), key=lambda pt: pt.time)
+                return cold_points, estimate_points_size(cold_points)
+
+            stem = get_window_file_stem(chunk.window_start, self.chunk_span_hours)
+            old_entry = self.archive.get(stem)  # 同一时间窗口之前已经归档过 (如归档后又导入了旧数据)
+            file_name = old_entry.file_name if old_entry is not None else None
+            try:
+                if points is None:  # 非常驻数据块在锁外从缓存或文件读取
+                    points = self.chunk_cache.get(source_file, loader)
+                times = [pt.time for pt in points]
+                if old_entry is not None:
+                    times += [old_entry.min_time, old_entry.max_time]
+                if archive_data and file_name is not None:  # 合并已归档的数据点, 时间相同时以新的为准
+                    merged = {pt.time: pt for pt in self.read_a_file(join(self.archive.dir_path, file_name))}
+                    merged.update((pt.time, pt) for pt in points)
+                    points = [merged[t] for t in sorted(merged)]
+                rollup = ChunkRollup.build(points)
+                if old_entry is not None and (file_name is None or not archive_data):  # 旧汇总中的数据点没有被合并
+                    rollup.merge(old_entry.rollup)
+                if archive_data:
+                    self.archive.ensure_dir()
+                    file_name = self.dump_points(points, ARCHIVE_FMT, True, ARCHIVE_COMPRESS, None, stem,
+                                                 self.archive.dir_path)
+                    self.chunk_cache.discard(join(ARCHIVE_DIR_NAME, file_name))
+            except (OSError, ValueError) as e:
+                logger.error(f"归档数据块时发生错误 -> {e}")
+                return f"归档数据块时发生错误 -> {e}"
+            count = sum(bucket.count for bucket in rollup.tiers[ROLLUP_TIERS[-1]].values())
+
+            with self.data_ctl_lock:
+                if chunk not in self.chunks or chunk.dirty or chunk.file_name != source_file:
+                    # 归档文件中多出的数据点会在下次归档时按时间合并
+                    logger.info(f"数据块 [{source_file}] 在归档期间被改动, 留到下次归档")
+                    return None
+                self.archive.put(stem, ArchiveEntry(file_name, min(times), max(times), count, rollup))
+                if chunk.point_ids:
+                    chunk_points = [self.point_store.by_id(pt_id) for pt_id in chunk.point_ids]
+                    start, _ = self.point_store.bisect(chunk_points[0].time)
+                    self.point_store.remove_many(chunk_points)
+                    self.log_shift(start, -len(chunk_points))
+                    for pt_id in chunk.point_ids:
+                        self.point_chunk.pop(pt_id)
+                self.chunks.remove(chunk)
+                self.window_chunks.pop(chunk.window_start, None)
+                self.discard_cached_chunk(source_file)
+                self.manifest.discard(source_file)
+            try:
+                self.archive.save()
+            except OSError as e:  # 原文件还在, 下次启动后重新归档
+                logger.error(f"保存归档索引时发生错误 -> {e}")
+                return f"保存归档索引时发生错误 -> {e}"
+            self.save_manifest()
+        self.ranges_cache.clear()
+        logger.info(f"已归档数据块 [{source_file}]" + ("" if archive_data else ", 只保留了汇总"))
+        return self.remove_failure_files([source_file])
+
+    def make_manifest_entry(self, file_name: str, points: list[ServerPoint], fmt: DataSaveFmt | None) -> ManifestEntry:
+        """根据数据文件和其中的数据点生成清单记录"""
+        times = [pt.time for pt in points]
+        fmt_name = fmt.name if fmt is not None else None
+        pack_entry = self.packs.get(file_name)
+        if pack_entry is not None:
+            return ManifestEntry(min(times), max(times), len(points), pack_entry.length, pack_entry.mtime, fmt_name,
+                                 pack_entry.checksum, get_points_players(points))
+        return ManifestEntry.from_file(join(self.data_dir, file_name), min(times), max(times), len(points),
+                                       get_points_players(points), fmt_name)
+
+    def update_shared_dict(self, points: list[ServerPoint]) -> SharedDict:
+        """按玩家和玩家列表的出现次数更新zlib共享字典"""
+        player_counter = CountDict()
+        list_counter = CountDict()
+        for point in points:
+            player_counter.update((p.name, p.uuid) for p in point.players)
+            list_counter[tuple((p.name, p.uuid) for p in point.players)] += 1
+        players = [player for player, _ in reversed(player_counter.most_common())]
+        list_hashes = [get_players_hash(players_key) for players_key, _ in reversed(list_counter.most_common(256))]
+        return self.zdict_store.update(players, list_hashes)
+
+    def dump_points(self, points: list[ServerPoint], fmt: DataSaveFmt, rewrite_data: bool = False,
+                    compress: DataCompress = DataCompress.NONE, shared_dict: SharedDict | None = None,
+                    file_stem: str | None = None, data_dir: str | None = None) -> str | None:
+        """
+        存储给定的数据点到文件, 先写入临时文件再替换, 避免写到一半时崩溃损坏原文件
+        数据点被逐个编码并流式写入 (和压缩), 内存中不会同时存在整个文件的内容
+        :param points: 数据点列表
         :param fmt: 数据存储格式
         :param rewrite_data: 是否覆盖已存在的文件
+        :param compress: 压缩方式
+        :param shared_dict: zlib压缩使用的共享字典
+        :param file_stem: 文件名 (不含扩展名), 为None时把所有数据点的时间作md5哈希作为文件名
+        :param data_dir: 存放文件的文件夹, 为None时使用数据文件夹
+        :return: 文件名, 格式未知时返回None
         """
-        points_hash = md5(usedforsecurity=False)
-        for ready_point in points:
-            points_hash.update(str(ready_point["time"]).encode())
-        hash_hex = points_hash.hexdigest()
-        save_path = join(self.data_dir, hash_hex + ".json")
+        if not isinstance(fmt, DataSaveFmt):
+            logger.error(f"未知的存储格式 -> {fmt}")
+            return None
+        if file_stem is None:
+            points_hash = md5(usedforsecurity=False)
+            for point in points:
+                points_hash.update(str(point.time).encode())
+            file_stem = points_hash.hexdigest()
+        file_name = get_data_file_name(file_stem, fmt, compress)
+        save_path = join(data_dir or self.data_dir, file_name)
 
         if not exists(save_path) or rewrite_data:
-            if fmt == DataSaveFmt.NORMAL:
-                final_content = points
-            elif fmt == DataSaveFmt.PLAYER_LIST_MAPPING:
-                final_content = dumps_player_list_mapping(points)
-            elif fmt == DataSaveFmt.PLAYER_MAPPING:
-                final_content = dumps_player_mapping(points)
-            else:
-                logger.error(f"未知的存储格式 -> {fmt}")
-                return
-            with open(save_path, "w") as f:
-                # noinspection PyTypeChecker
-                json.dump(final_content, f)
-            logger.info(f"保存文件 [{hash_hex + '.json'}]")
-        self.data_files.append(hash_hex + ".json")
+            write_points_file(save_path, points, fmt, compress, shared_dict)
+            logger.info(f"保存文件 [{file_name}]")
+        return file_name
 
     def get_all_online_ranges(self) -> dict[str, list[tuple[float, float]]]:
         """
@@ -353,32 +2020,34 @@ class DataManager:
         """
         player_active_times: dict[str, list[tuple[float, float | None]]] = {}  # 记录每个玩家的在线时间段
         range_start_players: dict[str, float] = {}
-        last_players = set()  # 上一个数据点中的玩家集合
-        last_point = None
-        points_len = len(self.points_map)
+        last_players = set()  # 上一个游程中的玩家集合
+        last_time = 0
         with self.data_ctl_lock:
-            for i, point in enumerate(self.points):
-                now_players = set(p.name for p in point.players)  # 当前数据点中的玩家集合
+            if self.all_resident:  # 数据点都在内存中时直接用列式数组计算
+                return self.arrays.all_player_ranges()
+            run_parts = [self.get_chunk_runs(chunk) for chunk in self.chunks if not chunk.resident]
+            run_parts.append(iter_point_runs(self.point_store))
+            for run in merge(*run_parts, key=lambda r: r.start):  # 玩家列表不变的连续数据点只需要处理一次
+                now_players = player_pool.get_names(run.players)  # 当前游程中的玩家集合
 
                 # 处理新上线的玩家
                 for player in now_players - last_players:
-                    range_start_players[player] = point.time
+                    range_start_players[player] = run.start
 
                 # 处理下线的玩家
                 for player in last_players - now_players:
                     if player not in player_active_times:
                         player_active_times[player] = []
-                    player_active_times[player].append((range_start_players.pop(player), point.time))  # 记录上线时间
+                    player_active_times[player].append((range_start_players.pop(player), run.start))  # 记录上线时间
 
                 last_players = now_players
-                if i == points_len - 1:
-                    last_point = point
+                last_time = run.end
 
         # 处理仍然在线的玩家
         for player, start in range_start_players.items():
             if player not in player_active_times:
                 player_active_times[player] = []
-            player_active_times[player].append((start, last_point.time))
+            player_active_times[player].append((start, last_time))
 
         # 转换为元组形式
         return player_active_times
@@ -390,25 +2059,30 @@ class DataManager:
         """
         if Player(player_name) in self.ranges_cache:
             return self.ranges_cache[Player(player_name)]
-        last_players: set[str] = set()
         active_start: float = 0
+        last_time: float = 0
         result: list[tuple[float, float]] = []
-        points_count = len(self.points_map)
         with self.data_ctl_lock:
-            for i, point in enumerate(self.points):
-                if i == 0:
-                    active_start = point.time
-                now_players = set(p.name for p in point.players)
-                for player in now_players - last_players:
-                    if player == player_name:
-                        active_start = point.time
-                for player in last_players - now_players:
-                    if player == player_name:
-                        result.append((active_start, point.time))
+            if self.all_resident:
+                result = self.arrays.player_ranges(player_name)
+                self.ranges_cache[Player(player_name)] = result
+                return result
+            for chunk in self.chunks:
+                if not chunk.resident and player_name not in chunk.players:  # 清单表明玩家不在这个数据块中, 跳过
+                    if active_start != 0:
+                        result.append((active_start, chunk.min_time))
                         active_start = 0
-                last_players = now_players
-                if i >= points_count - 1 and active_start != 0:
-                    result.append((active_start, point.time))
+                    continue
+                for run in self.get_chunk_runs(chunk):
+                    online = player_name in player_pool.get_names(run.players)
+                    if online and active_start == 0:
+                        active_start = run.start
+                    elif not online and active_start != 0:
+                        result.append((active_start, run.start))
+                        active_start = 0
+                    last_time = run.end
+        if active_start != 0:
+            result.append((active_start, last_time))
         self.ranges_cache[Player(player_name)] = result
         return result
 
@@ -420,10 +2094,9 @@ class DataFilter:
         self.from_time = from_time
         self.to_time = to_time
 
-    def filter_points(self, points: dict[float, ServerPoint]):
-        if self.from_time is None and self.to_time is None:
-            return list(points.values())
-        return [point for point in points.values() if self.from_time <= point.time <= self.to_time]
+    def filter_points(self, points: PointStore[ServerPoint]) -> list[ServerPoint]:
+        """二分查找时间范围内的数据点"""
+        return points.range(self.from_time, self.to_time)
 
     def check(self, point: ServerPoint):
         if self.from_time is None and self.to_time is None:
@@ -0,0 +1,156 @@
+"""
+流式json读取
+按块读取和解码文件, 每次只解析一个值 (如数组中的一个元素), 内存占用与单个值的大小成正比, 与文件大小无关
+数据点之类的小对象直接交给标准库的 json 解码器 (C实现) 解析, 只有外层的数组和对象由这里逐个元素地遍历
+"""
+import json
+import re
+from codecs import getincrementaldecoder
+from typing import Any, BinaryIO, Iterator
+
+READ_BLOCK_SIZE = 1 << 20
+NOT_WHITESPACE_RE = re.compile(r"[^ \t\n\r]")
+NUMBER_CHARS = "0123456789.eE+-"
+SKIP_SPAN = 64 * 1024  # 跳过值时每次正则匹配的最大长度, 正则引擎回溯用的内存与匹配到的元素数成正比
+JSON_STRING = r'"[^"\\]*(?:\\.[^"\\]*)*"'
+JSON_STRING_RE = re.compile(JSON_STRING)
+FLAT_CONTENT = rf'[^"\[\]{{}}]*(?:{JSON_STRING}[^"\[\]{{}}]*)*'  # 不含括号的内容, 字符串中的括号不算
+# 跳过值时一次匹配掉括号以外的内容和不再嵌套的容器 (如单个数据点), 逐层处理的只有外层的括号
+SKIP_RE = re.compile(rf'{FLAT_CONTENT}(?:(?:\[{FLAT_CONTENT}\]|\{{{FLAT_CONTENT}\}}){FLAT_CONTENT})*')
+
+
+class JsonStream:
+    """
+    从二进制流中逐个读取json值
+    用法: 先调用 iter_object / iter_array 进入外层容器, 再对每个元素调用 read_value、skip_value 或继续进入下一层
+    """
+
+    def __init__(self, stream: BinaryIO, block_size: int = READ_BLOCK_SIZE):
+        self.stream = stream
+        self.block_size = block_size
+        self.decoder = getincrementaldecoder("utf-8")()
+        self.json_decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        """再读入一块数据, 已经解析过的部分会被丢弃, 文件已经读完时返回False"""
+        if self.eof:
+            return False
+        data = self.stream.read(self.block_size)
+        self.eof = not data
+        self.buffer = self.buffer[self.pos:] + self.decoder.decode(data, final=self.eof)
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """跳过空白, 返回下一个字符, 文件结束时返回空字符串"""
+        while True:
+            match = NOT_WHITESPACE_RE.search(self.buffer, self.pos)
+            if match is not None:
+                self.pos = match.start()
+                return self.buffer[self.pos]
+            self.pos = len(self.buffer)
+            if not self.fill():
+                return ""
+
+    def expect(self, chars: str) -> str:
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f"json格式错误: 在位置 {self.pos} 需要 {chars!r}, 实际为 {char!r}")
+        self.pos += 1
+        return char
+
+    def read_value(self) -> Any:
+        """
+        读取一个完整的值
+        值的后面还有字符 (或已到文件结尾) 时才认为解析完整, 数字后面的字符还不能是数字的一部分,
+        避免 "12.5" 在块的边界处被截断为 "12"
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buffer, self.pos)
+                if self.eof or end < len(self.buffer) and \
+                        (not isinstance(value, (int, float)) or self.buffer[end] not in NUMBER_CHARS):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+    def read_large_value(self) -> Any:
+        """读取一个可能很大的值 (如映射表), 外层容器逐个元素读取, 避免整个值在块的边界处被反复解析"""
+        char = self.peek()
+        if char == "[":
+            return list(self.iter_values())
+        if char == "{":
+            return dict(self.read_object_items())
+        return self.read_value()
+
+    def skip_value(self):
+        """
+        跳过一个值, 容器只按括号的层数扫描文本, 不解析其中的元素, 也不检查内容是否合法
+        字符串在块的边界处被截断时, 读入下一块后从字符串开头重新扫描
+        """
+        if self.peek() not in "[{":
+            self.read_value()
+            return
+        self.pos += 1
+        depth = 1
+        while True:
+            end = min(len(self.buffer), self.pos + SKIP_SPAN)
+            self.pos = SKIP_RE.match(self.buffer, self.pos, end).end()
+            if self.pos == end < len(self.buffer):
+                continue
+            if self.pos < len(self.buffer) and self.buffer[self.pos] == '"':
+                string = JSON_STRING_RE.match(self.buffer, self.pos)  # 可能只是被这次匹配的长度截断
+                if string is not None:
+                    self.pos = string.end()
+                    continue
+            if self.pos == len(self.buffer) or self.buffer[self.pos] == '"':
+                if not self.fill():
+                    raise ValueError("json格式错误: 文件在容器结束之前结束")
+                continue
+            depth += 1 if self.buffer[self.pos] in "[{" else -1
+            self.pos += 1
+            if depth == 0:
+                return
+
+    def iter_array(self) -> Iterator[None]:
+        """进入数组, 每个元素产出一次, 调用方需要在下一次迭代前读取或跳过这个元素"""
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield
+            if self.expect(",]") == "]":
+                return
+
+    def iter_object(self) -> Iterator[str]:
+        """进入对象, 逐个产出键, 调用方需要在下一次迭代前读取或跳过对应的值"""
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.read_value()
+            if not isinstance(key, str):
+                raise ValueError(f"json格式错误: 对象的键不是字符串 -> {key!r}")
+            self.expect(":")
+            yield key
+            if self.expect(",}") == "}":
+                return
+
+    def iter_values(self) -> Iterator[Any]:
+        """逐个读取数组的元素"""
+        for _ in self.iter_array():
+            yield self.read_value()
+
+    def read_object_items(self) -> Iterator[tuple[str, Any]]:
+        """逐个读取对象的键值对"""
+        for key in self.iter_object():
+            yield key, self.read_value()
@@ -0,0 +1,127 @@
+"""
+数据块清单
+记录每个数据文件的时间范围、数据点数、文件大小、格式、校验和以及出现过的玩家
+启动时可以用清单代替解析文件, 查询时可以只打开可能匹配的数据块
+清单只是缓存, 丢失或过期时会从数据文件重新生成
+"""
+import json
+import zlib
+from dataclasses import dataclass, field
+from os import replace, stat
+from os.path import join, exists
+
+from lib.log import logger
+
+MANIFEST_FILE_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+CHECKSUM_BLOCK_SIZE = 1024 * 1024
+
+
+def file_checksum(file_path: str) -> str:
+    """计算文件的crc32校验和"""
+    crc = 0
+    with open(file_path, "rb") as f:
+        while block := f.read(CHECKSUM_BLOCK_SIZE):
+            crc = zlib.crc32(block, crc)
+    return f"{crc:08x}"
+
+
+def stat_file(file_path: str) -> tuple[int, float] | None:
+    """文件的 (大小, 修改时间), 文件不存在时返回None"""
+    try:
+        st = stat(file_path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime
+
+
+@dataclass
+class ManifestEntry:
+    """一个数据文件的清单记录"""
+    min_time: float
+    max_time: float
+    count: int
+    size: int
+    mtime: float
+    fmt: str | None  # 存储格式名, None 表示未知
+    checksum: str
+    players: set[str] = field(default_factory=set)
+
+    @staticmethod
+    def from_file(file_path: str, min_time: float, max_time: float, count: int, players: set[str],
+                  fmt: str | None) -> "ManifestEntry":
+        """根据刚写入或刚读取的数据文件生成记录"""
+        st = stat(file_path)
+        return ManifestEntry(min_time, max_time, count, st.st_size, st.st_mtime, fmt, file_checksum(file_path),
+                             players)
+
+    def match_file(self, file_path: str) -> bool:
+        """文件大小和修改时间与记录一致时认为文件没有被改动过"""
+        return self.match_stat(stat_file(file_path))
+
+    def match_stat(self, file_stat: tuple[int, float] | None) -> bool:
+        """(大小, 修改时间) 与记录一致时认为数据块没有被改动过, 数据块不存在时为None"""
+        return file_stat is not None and file_stat == (self.size, self.mtime)
+
+
+class ChunkManifest:
+    """数据文件夹的清单, 键为数据文件名"""
+
+    def __init__(self, data_dir: str, span_hours: int | None):
+        self.file_path = join(data_dir, MANIFEST_FILE_NAME)
+        self.span_hours = span_hours
+        self.entries: dict[str, ManifestEntry] = {}
+        self.changed = False
+
+    def load(self):
+        """读取清单, 版本或时间跨度不同时丢弃, span_hours 为None时不检查时间跨度 (只读取记录)"""
+        self.entries.clear()
+        if not exists(self.file_path):
+            return
+        try:
+            with open(self.file_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data["version"] != MANIFEST_VERSION or \
+                    self.span_hours is not None and data["span_hours"] != self.span_hours:
+                logger.info("数据块清单已过期, 将重新生成")
+                self.changed = True
+                return
+            names: list[str] = data["names"]
+            for file_name, raw in data["chunks"].items():
+                players = {names[i] for i in raw.pop("players")}
+                self.entries[file_name] = ManifestEntry(**raw, players=players)
+        except (OSError, ValueError, KeyError, TypeError, IndexError) as e:
+            logger.warning(f"读取数据块清单失败, 将重新生成 -> {e}")
+            self.entries.clear()
+            self.changed = True
+
+    def save(self):
+        """写入清单, 玩家名统一存放在名字表中, 数据块只记录名字的序号"""
+        names = sorted({name for entry in self.entries.values() for name in entry.players})
+        name_ids = {name: i for i, name in enumerate(names)}
+        chunks = {}
+        for file_name, entry in sorted(self.entries.items()):
+            raw = entry.__dict__.copy()
+            raw["players"] = sorted(name_ids[name] for name in entry.players)
+            chunks[file_name] = raw
+        data = {"version": MANIFEST_VERSION, "span_hours": self.span_hours, "names": names, "chunks": chunks}
+        with open(self.file_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        replace(self.file_path + ".tmp", self.file_path)
+        self.changed = False
+
+    def get(self, file_name: str) -> ManifestEntry | None:
+        return self.entries.get(file_name)
+
+    def put(self, file_name: str, entry: ManifestEntry):
+        self.entries[file_name] = entry
+        self.changed = True
+
+    def discard(self, file_name: str):
+        if self.entries.pop(file_name, None) is not None:
+            self.changed = True
+
+    def retain(self, file_names: set[str]):
+        """删除已不存在的数据文件的记录"""
+        for file_name in set(self.entries) - file_names:
+            self.discard(file_name)
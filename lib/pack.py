@@ -0,0 +1,318 @@
+"""
+数据块打包存储
+把许多数据块追加写入 packs 文件夹中少量的大打包文件, 代替每个数据块一个小文件, 减少加载和保存时的文件系统元数据开销
+每条记录: 头部 (魔数, 类型, 名称长度, 数据长度, crc32, 写入时间) + 数据块文件名 + 数据文件的完整内容 (编码和压缩方式与单独的文件相同)
+同名的新记录覆盖旧记录, 删除数据块时追加一条删除记录; 被覆盖的旧记录由后台压实重新打包时回收
+索引 (index.json) 记录每个数据块所在的打包文件、偏移和长度, 保存索引之后追加的记录在下次加载时从打包文件末尾扫描恢复
+"""
+import json
+import struct
+import zlib
+from dataclasses import dataclass
+from os import fsync, listdir, mkdir, remove, replace
+from os.path import join, exists, getsize
+from threading import Lock
+from time import time
+from typing import Iterable, Iterator
+
+from lib.log import logger
+
+PACK_DIR_NAME = "packs"
+PACK_INDEX_NAME = "index.json"
+PACK_INDEX_VERSION = 1
+PACK_EXT = ".pack"
+PACK_MAX_SIZE = 16 * 1024 * 1024  # 超过该大小后写入新的打包文件, 已经写满的打包文件不再改动, 增量备份时不会被重复复制
+PACK_SPARSE_RATIO = 0.5  # 被覆盖的记录占打包文件的比例超过该值时重新打包
+RECORD_MAGIC = b"CSPK"
+RECORD_HEADER = struct.Struct("<4sBHIId")  # 魔数, 类型, 名称长度, 数据长度, crc32, 写入时间
+RECORD_DATA = 0
+RECORD_REMOVE = 1
+
+
+@dataclass
+class PackEntry:
+    """一个数据块在打包文件中的位置"""
+    pack: str  # 打包文件名
+    offset: int  # 数据在打包文件中的偏移 (不含头部和名称)
+    length: int
+    mtime: float  # 写入时间, 与单独的文件的修改时间作用相同
+    checksum: str  # 数据的crc32, 与 file_checksum 的结果一致
+
+
+@dataclass
+class PackRecord:
+    """打包文件中的一条记录"""
+    kind: int
+    file_name: str
+    entry: PackEntry
+
+
+def iter_records(pack_path: str, pack: str, start: int = 0) -> Iterator[PackRecord | int]:
+    """
+    从指定位置开始顺序读取打包文件中的完整记录, 最后产出最后一条完整记录的结束位置
+    遇到不完整或损坏的记录 (一般是写入时崩溃导致的) 时停止
+    """
+    end = start
+    with open(pack_path, "rb") as f:
+        f.seek(start)
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                break
+            magic, kind, name_len, length, crc, mtime = RECORD_HEADER.unpack(header)
+            if magic != RECORD_MAGIC:
+                break
+            name = f.read(name_len)
+            data = f.read(length)
+            if len(name) < name_len or len(data) < length or zlib.crc32(data) != crc:
+                break
+            entry = PackEntry(pack, end + RECORD_HEADER.size + name_len, length, mtime, f"{crc:08x}")
+            yield PackRecord(kind, name.decode("utf-8"), entry)
+            end = f.tell()
+    yield end
+
+
+def read_pack_data(pack_path: str, offset: int, length: int, checksum: str) -> bytes:
+    """
+    读取打包文件中的一段数据并校验
+    :raises OSError: 读取失败
+    :raises ValueError: 校验失败
+    """
+    with open(pack_path, "rb") as f:
+        f.seek(offset)
+        data = f.read(length)
+    if len(data) != length or f"{zlib.crc32(data):08x}" != checksum:
+        raise ValueError(f"打包文件 [{pack_path}] 中偏移 {offset} 处的数据已损坏")
+    return data
+
+
+class PackStore:
+    """数据文件夹中的打包文件, 键为数据块文件名, 所有修改都持有内部锁, 可以在多个线程中使用"""
+
+    def __init__(self, data_dir: str):
+        self.dir_path = join(data_dir, PACK_DIR_NAME)
+        self.index_path = join(self.dir_path, PACK_INDEX_NAME)
+        self.entries: dict[str, PackEntry] = {}
+        self.pack_sizes: dict[str, int] = {}  # 打包文件名 -> 已经索引到的大小
+        self.changed = False
+        self.lock = Lock()
+
+    def __contains__(self, file_name: str) -> bool:
+        return file_name in self.entries
+
+    def names(self) -> list[str]:
+        return list(self.entries)
+
+    def get(self, file_name: str) -> PackEntry | None:
+        return self.entries.get(file_name)
+
+    def pack_path(self, pack: str) -> str:
+        return join(self.dir_path, pack)
+
+    def locate(self, file_name: str) -> tuple[str, int, int, str] | None:
+        """数据块的位置 (打包文件路径, 偏移, 长度, 校验和), 用于在其他进程中读取"""
+        entry = self.entries.get(file_name)
+        if entry is None:
+            return None
+        return self.pack_path(entry.pack), entry.offset, entry.length, entry.checksum
+
+    def load(self):
+        """读取索引, 并从打包文件末尾扫描恢复索引之后追加的记录; 索引丢失或损坏时扫描全部打包文件"""
+        with self.lock:
+            self.entries.clear()
+            self.pack_sizes.clear()
+            if not exists(self.dir_path):
+                return
+            if exists(self.index_path):
+                try:
+                    with open(self.index_path, "r", encoding="utf-8") as f:
+                        data = json.load(f)
+                    if data["version"] != PACK_INDEX_VERSION:
+                        raise ValueError(f"版本不同 -> {data['version']}")
+                    self.pack_sizes.update(data["packs"])
+                    for file_name, raw in data["chunks"].items():
+                        self.entries[file_name] = PackEntry(*raw)
+                except (OSError, ValueError, KeyError, TypeError) as e:
+                    logger.warning(f"读取打包索引失败, 将扫描全部打包文件 -> {e}")
+                    self.entries.clear()
+                    self.pack_sizes.clear()
+            packs = self.list_packs()
+            for pack in set(self.pack_sizes) - set(packs):
+                logger.warning(f"打包文件 [{pack}] 不存在, 其中的数据块已丢失")
+                self.pack_sizes.pop(pack)
+                for file_name in [name for name, entry in self.entries.items() if entry.pack == pack]:
+                    self.entries.pop(file_name)
+                self.changed = True
+            for pack in packs:
+                indexed = self.pack_sizes.get(pack, 0)
+                if getsize(self.pack_path(pack)) != indexed:
+                    self.scan_pack(pack, indexed)
+            if self.changed:
+                logger.info(f"已从打包文件恢复索引, 共 {len(self.entries)} 个数据块")
+
+    def list_packs(self) -> list[str]:
+        """按写入顺序排列的打包文件名"""
+        if not exists(self.dir_path):
+            return []
+        return sorted(file for file in listdir(self.dir_path) if file.endswith(PACK_EXT))
+
+    def scan_pack(self, pack: str, start: int):
+        """从指定位置开始顺序扫描打包文件中的记录并更新索引, 末尾不完整的记录 (写入时崩溃) 会被截断"""
+        path = self.pack_path(pack)
+        if getsize(path) < start:  # 打包文件比索引记录的短, 重新扫描整个文件
+            for file_name in [name for name, entry in self.entries.items() if entry.pack == pack]:
+                self.entries.pop(file_name)
+            start = 0
+        end = start
+        for record in iter_records(path, pack, start):
+            if isinstance(record, int):
+                end = record
+            elif record.kind == RECORD_DATA:
+                self.entries[record.file_name] = record.entry
+            else:
+                self.entries.pop(record.file_name, None)
+        if end != getsize(path):
+            logger.warning(f"打包文件 [{pack}] 末尾存在不完整的记录, 已丢弃")
+            with open(path, "r+b") as f:
+                f.truncate(end)
+        self.pack_sizes[pack] = end
+        self.changed = True
+
+    def save(self):
+        """索引有变化时写入索引"""
+        with self.lock:
+            if not self.changed:
+                return
+            data = {"version": PACK_INDEX_VERSION, "packs": self.pack_sizes,
+                    "chunks": {name: [e.pack, e.offset, e.length, e.mtime, e.checksum]
+                               for name, e in sorted(self.entries.items())}}
+            with open(self.index_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(data, f, separators=(",", ":"))
+            replace(self.index_path + ".tmp", self.index_path)
+            self.changed = False
+
+    def current_pack(self) -> str:
+        """正在追加的打包文件, 写满时换一个新的, 调用时需持有锁"""
+        packs = sorted(self.pack_sizes)
+        if packs and self.pack_sizes[packs[-1]] < PACK_MAX_SIZE:
+            return packs[-1]
+        number = int(packs[-1][len("pack-"):-len(PACK_EXT)]) + 1 if packs else 1
+        return f"pack-{number:06d}{PACK_EXT}"
+
+    def append_record(self, kind: int, file_name: str, data: bytes, mtime: float | None = None) -> PackEntry:
+        """
+        在打包文件末尾追加一条记录并同步到磁盘, 调用时需持有锁
+        :param mtime: 写入时间, 默认为当前时间; 重新打包时沿用原记录的, 清单和汇总等缓存不会因此失效
+        """
+        if not exists(self.dir_path):
+            mkdir(self.dir_path)
+        pack = self.current_pack()
+        name = file_name.encode("utf-8")
+        crc = zlib.crc32(data)
+        mtime = time() if mtime is None else mtime
+        offset = self.pack_sizes.get(pack, 0)
+        with open(self.pack_path(pack), "ab") as f:
+            if f.tell() != offset:  # 上次追加失败留下了不完整的记录
+                f.truncate(offset)
+                f.seek(offset)
+            f.write(RECORD_HEADER.pack(RECORD_MAGIC, kind, len(name), len(data), crc, mtime) + name + data)
+            f.flush()
+            fsync(f.fileno())
+        self.pack_sizes[pack] = offset + RECORD_HEADER.size + len(name) + len(data)
+        self.changed = True
+        return PackEntry(pack, offset + RECORD_HEADER.size + len(name), len(data), mtime, f"{crc:08x}")
+
+    def append(self, file_name: str, data: bytes) -> PackEntry:
+        """
+        写入一个数据块, 覆盖同名的旧数据块
+        :raises OSError: 写入失败
+        """
+        with self.lock:
+            entry = self.entries[file_name] = self.append_record(RECORD_DATA, file_name, data)
+            return entry
+
+    def remove(self, file_name: str) -> bool:
+        """
+        删除一个数据块
+        :return: 是否存在这个数据块
+        :raises OSError: 写入删除记录失败
+        """
+        with self.lock:
+            if file_name not in self.entries:
+                return False
+            self.append_record(RECORD_REMOVE, file_name, b"")
+            self.entries.pop(file_name)
+            return True
+
+    def read(self, file_name: str) -> bytes | None:
+        """
+        读取一个数据块的内容, 不存在时返回None
+        :raises OSError: 读取失败
+        :raises ValueError: 校验失败
+        """
+        with self.lock:
+            location = self.locate(file_name)
+            if location is None:
+                return None
+            return read_pack_data(*location)
+
+    def iter_read(self, file_names: Iterable[str]) -> Iterator[tuple[str, bytes | Exception]]:
+        """
+        按打包文件和偏移的顺序读取多个数据块, 每个打包文件只打开一次并从前往后顺序读取
+        读取失败的数据块产出异常, 不影响其他数据块
+        """
+        by_pack: dict[str, list[tuple[int, str, PackEntry]]] = {}
+        for file_name in file_names:
+            entry = self.entries.get(file_name)
+            if entry is not None:
+                by_pack.setdefault(entry.pack, []).append((entry.offset, file_name, entry))
+        for pack in sorted(by_pack):
+            with open(self.pack_path(pack), "rb") as f:
+                for offset, file_name, entry in sorted(by_pack[pack]):
+                    f.seek(offset)
+                    data = f.read(entry.length)
+                    if len(data) != entry.length or f"{zlib.crc32(data):08x}" != entry.checksum:
+                        yield file_name, ValueError(f"打包文件 [{pack}] 中的数据块 [{file_name}] 已损坏")
+                    else:
+                        yield file_name, data
+
+    def get_sparse_pack(self) -> str | None:
+        """查找一个被覆盖的记录占比过高、需要重新打包的打包文件 (正在追加的打包文件除外)"""
+        with self.lock:
+            live: dict[str, int] = {}
+            for file_name, entry in self.entries.items():
+                record_size = RECORD_HEADER.size + len(file_name.encode("utf-8")) + entry.length
+                live[entry.pack] = live.get(entry.pack, 0) + record_size
+            packs = sorted(self.pack_sizes)
+            for pack in packs[:-1]:
+                if live.get(pack, 0) < self.pack_sizes[pack] * (1 - PACK_SPARSE_RATIO):
+                    return pack
+        return None
+
+    def repack(self, pack: str) -> int:
+        """
+        顺序读取打包文件, 把仍然有效的数据块追加到当前的打包文件, 保存索引后删除原打包文件
+        更早的打包文件中可能还有被删除的数据块, 这时删除记录也会被保留, 避免扫描恢复索引时被删除的数据块重新出现
+        :return: 移动的数据块数
+        :raises OSError: 读写失败
+        """
+        with self.lock:
+            keep_removes = sorted(self.pack_sizes)[0] != pack
+            moved = 0
+            for record in iter_records(self.pack_path(pack), pack):
+                if isinstance(record, int):
+                    break
+                if record.kind == RECORD_DATA and self.entries.get(record.file_name) == record.entry:
+                    data = read_pack_data(self.pack_path(pack), record.entry.offset, record.entry.length,
+                                          record.entry.checksum)
+                    self.entries[record.file_name] = self.append_record(RECORD_DATA, record.file_name, data,
+                                                                        record.entry.mtime)
+                    moved += 1
+                elif record.kind == RECORD_REMOVE and keep_removes and record.file_name not in self.entries:
+                    self.append_record(RECORD_REMOVE, record.file_name, b"")
+            self.pack_sizes.pop(pack)
+            self.changed = True
+        self.save()
+        remove(self.pack_path(pack))
+        logger.info(f"已重新打包 [{pack}], 移动了 {moved} 个数据块")
+        return moved
@@ -0,0 +1,227 @@
+"""
+数据点的列式存储
+时间、在线人数、延迟和玩家列表编号各存放在一个连续的 NumPy 数组中
+玩家列表与 PlayerPool 一样只存一份, 以 CSR 形式存放: 第 i 个玩家列表的玩家id为 player_ids[offsets[i]:offsets[i + 1]]
+由 PointStore 维护, 位置与 PointStore 中的数据点一一对应, 用于向量化地切片和统计历史数据
+"""
+from array import array
+from time import localtime
+from typing import Iterable, Protocol, Sequence
+
+import numpy as np
+
+INITIAL_CAPACITY = 1024
+HOUR_SECONDS = 3600
+COLUMNS = {"times": np.float64, "online": np.int32, "ping": np.float32, "list_index": np.int32}
+
+
+class ArrayPoint(Protocol):
+    time: float
+    online: int
+    ping: float
+    players: Sequence  # 玩家对象需要有 name 属性
+
+
+class PointArrays:
+    """
+    按位置与 PointStore 对应的列式数组, 缓冲区按倍数扩容, 末尾追加的均摊开销为 O(1)
+    追加的数据点先放入待处理列表, 读取数组时再批量编码
+    玩家列表按元组的 id 编号, 要求数据点的玩家列表是 PlayerPool 中共享的元组
+    """
+
+    def __init__(self):
+        self.size = 0
+        self.buffers = {name: np.empty(INITIAL_CAPACITY, dtype) for name, dtype in COLUMNS.items()}
+        self.pending: list[ArrayPoint] = []  # 已追加但还没有编码的数据点
+        self.names: list[str] = []  # 玩家id -> 玩家名
+        self.name_ids: dict[str, int] = {}
+        self.list_keys: dict[int, int] = {}  # 玩家列表元组的 id -> 玩家列表编号
+        self.list_offsets = array("q", [0])
+        self.list_players = array("i")
+        self.lists_cache: tuple[np.ndarray, np.ndarray] | None = None
+
+    def __len__(self) -> int:
+        return self.size + len(self.pending)
+
+    def column(self, name: str) -> np.ndarray:
+        self.flush()
+        return self.buffers[name][:self.size]
+
+    @property
+    def times(self) -> np.ndarray:
+        return self.column("times")
+
+    @property
+    def online(self) -> np.ndarray:
+        return self.column("online")
+
+    @property
+    def ping(self) -> np.ndarray:
+        return self.column("ping")
+
+    @property
+    def list_index(self) -> np.ndarray:
+        """每个数据点的玩家列表编号"""
+        return self.column("list_index")
+
+    @property
+    def lists(self) -> tuple[np.ndarray, np.ndarray]:
+        """全部玩家列表的 (offsets, player_ids), offsets 的长度为玩家列表数 + 1"""
+        if self.lists_cache is None or len(self.lists_cache[0]) != len(self.list_offsets):
+            self.lists_cache = (np.array(self.list_offsets, np.int64), np.array(self.list_players, np.int32))
+        return self.lists_cache
+
+    def get_players(self, index: int) -> list[str]:
+        """某个位置的数据点的玩家名列表"""
+        list_index = int(self.list_index[index])
+        start, end = self.list_offsets[list_index], self.list_offsets[list_index + 1]
+        return [self.names[name_id] for name_id in self.list_players[start:end]]
+
+    def get_name_id(self, name: str) -> int:
+        name_id = self.name_ids.get(name)
+        if name_id is None:
+            name_id = self.name_ids[name] = len(self.names)
+            self.names.append(name)
+        return name_id
+
+    def get_list_index(self, players: Sequence) -> int:
+        list_index = self.list_keys.get(id(players))
+        if list_index is None:
+            list_index = self.list_keys[id(players)] = len(self.list_offsets) - 1
+            self.list_players.extend(self.get_name_id(player.name) for player in players)
+            self.list_offsets.append(len(self.list_players))
+        return list_index
+
+    def reserve(self, size: int):
+        """确保缓冲区能放下指定数量的数据点, 不够时按倍数扩容"""
+        capacity = len(self.buffers["times"])
+        if size <= capacity:
+            return
+        capacity = max(size, capacity * 2)
+        for name, old in self.buffers.items():
+            new = np.empty(capacity, old.dtype)
+            new[:self.size] = old[:self.size]
+            self.buffers[name] = new
+
+    def append(self, point: ArrayPoint):
+        self.pending.append(point)
+
+    def flush(self):
+        """批量编码待处理的数据点"""
+        if self.pending:
+            points, self.pending = self.pending, []
+            self.splice(self.size, self.size, points)
+
+    def replace(self, lo: int, hi: int, points: Iterable[ArrayPoint]):
+        """把位置 [lo, hi) 的数据点替换为给定的数据点, 与 list[lo:hi] = points 相同"""
+        self.flush()
+        self.splice(lo, hi, list(points))
+
+    def truncate(self, size: int):
+        """只保留前 size 个数据点, 还没有编码的数据点直接丢弃"""
+        if size >= self.size:
+            del self.pending[size - self.size:]
+        else:
+            self.pending = []
+            self.splice(size, self.size, [])
+
+    def load_columns(self, lists: list[Sequence], columns: dict[str, np.ndarray]):
+        """
+        用预先算好的列 (如启动快照) 代替待处理数据点的编码, 只能在还没有编码过数据点时调用
+        :param lists: 玩家列表, 列中的 list_index 是它们在这里的位置
+        :param columns: 与待处理的数据点一一对应的各列
+        """
+        assert self.size == 0 and len(self.pending) == len(columns["times"])
+        mapping = np.array([self.get_list_index(players) for players in lists], np.int32)
+        self.reserve(len(self.pending))
+        for name, buf in self.buffers.items():
+            values = columns[name] if name != "list_index" else mapping[columns[name]]
+            buf[:len(values)] = values
+        self.size, self.pending = len(self.pending), []
+
+    def splice(self, lo: int, hi: int, points: list[ArrayPoint]):
+        count = len(points)
+        new_size = self.size + count - (hi - lo)
+        self.reserve(new_size)
+        values = {
+            "times": (point.time for point in points),
+            "online": (point.online for point in points),
+            "ping": (point.ping for point in points),
+            "list_index": (self.get_list_index(point.players) for point in points),
+        }
+        for name, buf in self.buffers.items():
+            if hi != lo + count:
+                buf[lo + count:new_size] = buf[hi:self.size]  # NumPy 会处理重叠的复制
+            buf[lo:lo + count] = np.fromiter(values[name], buf.dtype, count)
+        self.size = new_size
+
+    def get_runs(self) -> np.ndarray:
+        """玩家列表不变的连续数据点 (游程) 的起始位置"""
+        list_index = self.list_index
+        if not self.size:
+            return np.empty(0, np.int64)
+        return np.concatenate(([0], np.flatnonzero(np.diff(list_index)) + 1))
+
+    def lists_with(self, name: str) -> np.ndarray:
+        """每个玩家列表中是否有该玩家"""
+        offsets, player_ids = self.lists
+        result = np.zeros(len(offsets) - 1, np.bool_)
+        name_id = self.name_ids.get(name)
+        if name_id is not None:
+            result[np.searchsorted(offsets, np.flatnonzero(player_ids == name_id), "right") - 1] = True
+        return result
+
+    def player_mask(self, name: str) -> np.ndarray:
+        """每个数据点中是否有该玩家"""
+        return self.lists_with(name)[self.list_index]
+
+    def get_ranges(self, runs: np.ndarray, run_indexes: np.ndarray) -> list[tuple[float, float]]:
+        """
+        把有序且不重复的游程序号合并为在线时间段, 与逐个数据点计算的结果相同
+        时间段从第一个在线的数据点开始, 到下一个不在线的数据点结束, 一直在线到最后时结束于最后一个数据点
+        """
+        if not len(run_indexes):
+            return []
+        breaks = np.flatnonzero(np.diff(run_indexes) != 1)
+        starts = runs[run_indexes[np.concatenate(([0], breaks + 1))]]
+        next_runs = run_indexes[np.concatenate((breaks, [len(run_indexes) - 1]))] + 1
+        ends = np.append(runs, self.size - 1)[next_runs]
+        times = self.times
+        return list(zip(times[starts].tolist(), times[ends].tolist()))
+
+    def player_ranges(self, name: str) -> list[tuple[float, float]]:
+        """某个玩家的在线时间段"""
+        runs = self.get_runs()
+        return self.get_ranges(runs, np.flatnonzero(self.lists_with(name)[self.list_index[runs]]))
+
+    def all_player_ranges(self) -> dict[str, list[tuple[float, float]]]:
+        """所有玩家的在线时间段, 把每个游程的玩家展开后按玩家id稳定排序, 再按玩家切分"""
+        runs = self.get_runs()
+        offsets, player_ids = self.lists
+        run_lists = self.list_index[runs]
+        lengths = offsets[run_lists + 1] - offsets[run_lists]
+        entry_starts = np.cumsum(lengths) - lengths
+        positions = np.repeat(offsets[run_lists] - entry_starts, lengths) + np.arange(lengths.sum())
+        name_ids = player_ids[positions]
+        run_indexes = np.repeat(np.arange(len(runs)), lengths)
+        order = np.argsort(name_ids, kind="stable")  # 同一个玩家的游程序号仍然有序
+        name_ids, run_indexes = name_ids[order], run_indexes[order]
+        if len(run_indexes):  # 去掉同一个玩家列表中重复的玩家
+            unique = np.concatenate(([True], (np.diff(name_ids) != 0) | (np.diff(run_indexes) != 0)))
+            name_ids, run_indexes = name_ids[unique], run_indexes[unique]
+        bounds = np.flatnonzero(np.diff(name_ids)) + 1
+        return {self.names[int(group_ids[0])]: self.get_ranges(runs, group_indexes)
+                for group_ids, group_indexes in zip(np.split(name_ids, bounds), np.split(run_indexes, bounds))
+                if len(group_ids)}
+
+
+def to_local_datetimes(times: np.ndarray) -> np.ndarray:
+    """
+    把时间戳转换为本地时间的 datetime64 数组, 与 datetime.fromtimestamp 的结果相同
+    时间戳需要有序, 每个小时只查询一次时区偏移
+    """
+    hours = (times // HOUR_SECONDS).astype(np.int64)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(hours)) + 1)) if len(hours) else np.empty(0, np.int64)
+    gmt_offsets = np.array([localtime(int(hours[i]) * HOUR_SECONDS).tm_gmtoff for i in starts], np.float64)
+    local = times + np.repeat(gmt_offsets, np.diff(np.append(starts, len(times))))
+    return (local * 1e6).astype("datetime64[us]")
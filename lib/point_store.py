@@ -0,0 +1,145 @@
+"""
+数据点存储
+按时间顺序存放数据点, 时间单独存放在连续的 double 数组中, 可以二分查找时间范围, 也可以按位置索引
+数据点的整数id用于数据块记录成员和按id查找
+可以附带一份列式数组 (PointArrays), 随数据点的增删同步更新
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+from heapq import merge
+from typing import Generic, Iterable, Iterator, Protocol, TypeVar
+
+from lib.point_arrays import PointArrays
+
+
+class TimedPoint(Protocol):
+    time: float
+    id_: int
+
+
+P = TypeVar("P", bound=TimedPoint)
+
+
+class PointStore(Generic[P]):
+    """按时间排序的数据点存储, 时间相同的数据点按加入顺序排列"""
+
+    def __init__(self, points: Iterable[P] = (), arrays: PointArrays | None = None):
+        self.times = array("d")
+        self.items: list[P] = []
+        self.id_map: dict[int, P] = {}
+        self.sorted_count: int | None = None  # 批量追加后变得无序时, 之前已经有序的数据点数量, None 表示有序
+        self.arrays = arrays  # 位置与 items 一一对应的列式数组, 为 None 时不维护
+        for point in points:
+            self.append(point)
+        self.sort()
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __iter__(self) -> Iterator[P]:
+        return iter(self.items)
+
+    def __getitem__(self, index: int | slice):
+        """按位置获取数据点, 切片时返回列表"""
+        return self.items[index]
+
+    def __contains__(self, point_id: int) -> bool:
+        return point_id in self.id_map
+
+    def by_id(self, point_id: int) -> P:
+        return self.id_map[point_id]
+
+    def add(self, point: P):
+        """按时间插入数据点, 新数据点一般是最晚的, 直接追加到末尾"""
+        self.id_map[point.id_] = point
+        if not self.times or point.time >= self.times[-1]:
+            self.times.append(point.time)
+            self.items.append(point)
+            if self.arrays is not None:
+                self.arrays.append(point)
+            return
+        index = bisect_right(self.times, point.time)
+        self.times.insert(index, point.time)
+        self.items.insert(index, point)
+        if self.arrays is not None:
+            self.arrays.replace(index, index, (point,))
+
+    def append(self, point: P):
+        """追加数据点, 不保证顺序, 批量加入时使用, 加入完成后需调用 sort"""
+        self.id_map[point.id_] = point
+        if self.sorted_count is None and self.times and point.time < self.times[-1]:
+            self.sorted_count = len(self.items)
+        self.times.append(point.time)
+        self.items.append(point)
+        if self.arrays is not None:
+            self.arrays.append(point)
+
+    def sort(self):
+        """
+        批量追加后恢复时间顺序
+        只排序变得无序之后追加的部分, 再在对应的位置与之前的数据点合并
+        追加的一批数据点都比已有的早 (如从新到旧加载历史数据) 时只需要在开头拼接一次
+        """
+        if self.sorted_count is None:
+            return
+        head, self.sorted_count = self.sorted_count, None
+        tail = sorted(self.items[head:], key=lambda pt: pt.time)
+        del self.items[head:]
+        del self.times[head:]
+        if self.arrays is not None:
+            self.arrays.truncate(head)
+        lo = bisect_left(self.times, tail[0].time)
+        hi = bisect_right(self.times, tail[-1].time)
+        merged = list(merge(self.items[lo:hi], tail, key=lambda pt: pt.time))
+        self.items[lo:hi] = merged
+        self.times[lo:hi] = array("d", (pt.time for pt in merged))
+        if self.arrays is not None:
+            self.arrays.replace(lo, hi, merged)
+
+    def index(self, point: P) -> int:
+        """
+        数据点的位置
+        :return: 位置, 不在存储中时返回 -1
+        """
+        index = bisect_left(self.times, point.time)
+        while index < len(self.items) and self.times[index] == point.time:
+            if self.items[index] is point:
+                return index
+            index += 1
+        return -1
+
+    def remove(self, point: P):
+        index = self.index(point)
+        if index < 0:
+            raise KeyError(point.id_)
+        del self.times[index]
+        del self.items[index]
+        del self.id_map[point.id_]
+        if self.arrays is not None:
+            self.arrays.replace(index, index + 1, ())
+
+    def remove_many(self, points: list[P]):
+        """批量移除数据点, 只需要移动一次数组, 数据点一般集中在一个时间段内 (如同一个数据块)"""
+        if not points:
+            return
+        ids = {point.id_ for point in points}
+        lo = bisect_left(self.times, min(point.time for point in points))
+        hi = bisect_right(self.times, max(point.time for point in points))
+        kept = [point for point in self.items[lo:hi] if point.id_ not in ids]
+        self.items[lo:hi] = kept
+        self.times[lo:hi] = array("d", (point.time for point in kept))
+        if self.arrays is not None:
+            self.arrays.replace(lo, hi, kept)
+        for point_id in ids:
+            del self.id_map[point_id]
+
+    def bisect(self, from_time: float | None = None, to_time: float | None = None) -> tuple[int, int]:
+        """时间范围 [from_time, to_time] 对应的位置范围 [lo, hi), None 表示不限"""
+        lo = 0 if from_time is None else bisect_left(self.times, from_time)
+        hi = len(self.items) if to_time is None else bisect_right(self.times, to_time)
+        return lo, max(lo, hi)
+
+    def range(self, from_time: float | None = None, to_time: float | None = None) -> list[P]:
+        """时间范围内的数据点 (闭区间), None 表示不限"""
+        lo, hi = self.bisect(from_time, to_time)
+        return self.items[lo:hi]
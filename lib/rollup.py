@@ -0,0 +1,197 @@
+"""
+数据汇总
+按 1分钟 / 10分钟 / 1小时 / 1天 的精度预先汇总数据点: 最少/最多/平均在线人数, 平均延迟, 出现过的玩家
+每个数据块维护自己的汇总, 添加/删除数据点时增量更新, 写入数据块时一起写入 rollup 文件夹
+查询很长时间范围的数据时, 可以直接使用足够精细的最粗汇总, 不需要遍历所有原始数据点
+"""
+import json
+from os import mkdir, remove, replace
+from os.path import join, exists
+from typing import Iterable
+
+from lib.log import logger
+
+ROLLUP_TIERS = (60, 600, 3600, 86400)  # 各级汇总的时间精度 (秒)
+ROLLUP_DIR_NAME = "rollup"
+ROLLUP_VERSION = 1
+
+
+class RollupBucket:
+    """一个时间段内数据点的汇总"""
+    __slots__ = ("count", "online_min", "online_max", "online_sum", "ping_sum", "players")
+
+    def __init__(self):
+        self.count = 0
+        self.online_min = 0
+        self.online_max = 0
+        self.online_sum = 0
+        self.ping_sum = 0.0
+        self.players: set[str] = set()
+
+    def add(self, online: int, ping: float, players: Iterable[str]):
+        if self.count == 0:
+            self.online_min = self.online_max = online
+        else:
+            self.online_min = min(self.online_min, online)
+            self.online_max = max(self.online_max, online)
+        self.count += 1
+        self.online_sum += online
+        self.ping_sum += ping
+        self.players.update(players)
+
+    def merge(self, other: "RollupBucket"):
+        """合并另一个汇总 (相邻数据块中属于同一时间段的部分)"""
+        if self.count == 0:
+            self.online_min, self.online_max = other.online_min, other.online_max
+        elif other.count:
+            self.online_min = min(self.online_min, other.online_min)
+            self.online_max = max(self.online_max, other.online_max)
+        self.count += other.count
+        self.online_sum += other.online_sum
+        self.ping_sum += other.ping_sum
+        self.players |= other.players
+
+    @property
+    def online_mean(self) -> float:
+        return self.online_sum / self.count if self.count else 0
+
+    @property
+    def ping_mean(self) -> float:
+        return self.ping_sum / self.count if self.count else 0
+
+
+class ChunkRollup:
+    """一个数据块在各级精度下的汇总, 键为时间段起点"""
+
+    def __init__(self):
+        self.tiers: dict[int, dict[float, RollupBucket]] = {tier: {} for tier in ROLLUP_TIERS}
+
+    @staticmethod
+    def build(points: Iterable) -> "ChunkRollup":
+        """从数据点构建汇总"""
+        rollup = ChunkRollup()
+        for point in points:
+            rollup.add_point(point)
+        return rollup
+
+    def add_point(self, point):
+        names = [p.name for p in point.players]
+        for tier, buckets in self.tiers.items():
+            start = point.time - point.time % tier
+            bucket = buckets.get(start)
+            if bucket is None:
+                bucket = buckets[start] = RollupBucket()
+            bucket.add(point.online, point.ping, names)
+
+    def rebuild_at(self, timestamp: float, points: list):
+        """
+        删除数据点后, 用数据块中剩余的数据点重新计算包含该时间的各个时间段
+        :param timestamp: 被删除的数据点的时间
+        :param points: 数据块中剩余的数据点
+        """
+        for tier, buckets in self.tiers.items():
+            start = timestamp - timestamp % tier
+            bucket = RollupBucket()
+            for point in points:
+                if start <= point.time < start + tier:
+                    bucket.add(point.online, point.ping, [p.name for p in point.players])
+            if bucket.count:
+                buckets[start] = bucket
+            else:
+                buckets.pop(start, None)
+
+    def merge(self, other: "ChunkRollup"):
+        """合并同一时间窗口的另一份汇总"""
+        for tier, buckets in other.tiers.items():
+            own = self.tiers[tier]
+            for start, bucket in buckets.items():
+                merged = own.get(start)
+                if merged is None:
+                    merged = own[start] = RollupBucket()
+                merged.merge(bucket)
+
+    def to_json(self, min_tier: int = ROLLUP_TIERS[0]) -> dict:
+        """
+        转换为可以保存的json对象
+        :param min_tier: 只保存不低于该精度的汇总
+        """
+        names = sorted({name for bucket in self.tiers[ROLLUP_TIERS[-1]].values() for name in bucket.players})
+        name_ids = {name: i for i, name in enumerate(names)}
+        tiers = {}
+        for tier, buckets in self.tiers.items():
+            if tier < min_tier:
+                continue
+            tiers[str(tier)] = [[start, b.count, b.online_min, b.online_max, b.online_sum, round(b.ping_sum, 2),
+                                 sorted(name_ids[name] for name in b.players)] for start, b in sorted(buckets.items())]
+        return {"names": names, "tiers": tiers}
+
+    @staticmethod
+    def from_json(data: dict) -> "ChunkRollup":
+        rollup = ChunkRollup()
+        names: list[str] = data["names"]
+        for tier, raw_buckets in data["tiers"].items():
+            buckets = rollup.tiers[int(tier)]
+            for start, count, online_min, online_max, online_sum, ping_sum, name_ids in raw_buckets:
+                bucket = buckets[start] = RollupBucket()
+                bucket.count, bucket.online_min, bucket.online_max = count, online_min, online_max
+                bucket.online_sum, bucket.ping_sum = online_sum, ping_sum
+                bucket.players = {names[i] for i in name_ids}
+        return rollup
+
+
+def get_rollup_path(data_dir: str, file_name: str) -> str:
+    """数据文件对应的汇总文件路径"""
+    return join(data_dir, ROLLUP_DIR_NAME, file_name + ".json")
+
+
+def save_rollup(data_dir: str, file_name: str, rollup: ChunkRollup, file_stat: tuple[int, float]):
+    """
+    写入数据文件对应的汇总, 记录数据文件的大小和修改时间用于校验
+    :param file_stat: 数据文件的 (大小, 修改时间), 打包存储的数据块为打包记录中的值
+    """
+    dir_path = join(data_dir, ROLLUP_DIR_NAME)
+    if not exists(dir_path):
+        mkdir(dir_path)
+    size, mtime = file_stat
+    data = {"version": ROLLUP_VERSION, "size": size, "mtime": mtime, **rollup.to_json()}
+    path = get_rollup_path(data_dir, file_name)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(data, f, separators=(",", ":"))
+    replace(path + ".tmp", path)
+
+
+def load_rollup(data_dir: str, file_name: str, file_stat: tuple[int, float] | None) -> ChunkRollup | None:
+    """
+    读取数据文件对应的汇总, 不存在或与数据文件不一致时返回None
+    :param file_stat: 数据文件的 (大小, 修改时间), 数据文件不存在时为None
+    """
+    path = get_rollup_path(data_dir, file_name)
+    if file_stat is None or not exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data["version"] != ROLLUP_VERSION or [data["size"], data["mtime"]] != list(file_stat):
+            return None
+        return ChunkRollup.from_json(data)
+    except (OSError, ValueError, KeyError, TypeError, IndexError) as e:
+        logger.warning(f"读取汇总 [{file_name}] 失败 -> {e}")
+        return None
+
+
+def remove_rollup(data_dir: str, file_name: str):
+    path = get_rollup_path(data_dir, file_name)
+    if exists(path):
+        remove(path)
+
+
+def select_tier(span: float, max_buckets: int) -> int | None:
+    """
+    选择精度足够的最粗一级汇总
+    :param span: 查询的时间跨度 (秒)
+    :param max_buckets: 需要的最高分辨率, 一般为图表的像素宽度
+    :return: 汇总精度 (秒), 原始数据点的数量已经合适时返回None
+    """
+    resolution = span / max(max_buckets, 1)
+    tiers = [tier for tier in ROLLUP_TIERS if tier <= resolution]
+    return tiers[-1] if tiers else None
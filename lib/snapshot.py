@@ -0,0 +1,91 @@
+"""
+启动快照
+正常退出时把内存中已经整理好的数据 (按时间排序的数据点列、共享的玩家列表、数据块划分) 写入一个二进制文件
+下次启动时直接读取快照, 不需要逐个解析数据文件; 每个数据块按文件大小和修改时间校验,
+对不上的数据块和快照之后写入的文件再按正常方式加载
+"""
+import pickle
+from dataclasses import dataclass
+from os import remove, replace
+from os.path import exists, join
+
+import numpy as np
+
+from lib.log import logger
+
+SNAPSHOT_FILE_NAME = "startup.snapshot"  # 不使用数据文件的扩展名, 避免被当作数据文件
+SNAPSHOT_MAGIC = b"CSSN"
+SNAPSHOT_VERSION = 1
+
+
+@dataclass
+class SnapshotChunk:
+    """快照中的一个数据块, 非常驻的数据块只记录元数据"""
+    file_name: str
+    window_start: float | None
+    size: int
+    mtime: float
+    resident: bool
+    min_time: float
+    max_time: float
+    count: int
+    players: set[str]
+
+    def match_stat(self, file_stat: tuple[int, float] | None) -> bool:
+        """数据文件的 (大小, 修改时间) 与快照记录一致时认为文件没有被改动过, 数据文件不存在时为None"""
+        return file_stat is not None and file_stat == (self.size, self.mtime)
+
+
+@dataclass
+class Snapshot:
+    span_hours: int
+    chunks: list[SnapshotChunk]
+    player_lists: list[tuple[tuple[str, str], ...]]  # (玩家名, UUID) 元组, 按玩家列表编号排列
+    # 常驻数据点按时间排序的列: times, online, ping, list_index (玩家列表编号), chunk_index (所在数据块的序号)
+    columns: dict[str, np.ndarray]
+
+
+def get_snapshot_path(data_dir: str) -> str:
+    return join(data_dir, SNAPSHOT_FILE_NAME)
+
+
+def save_snapshot(data_dir: str, snapshot: Snapshot):
+    path = get_snapshot_path(data_dir)
+    data = {
+        "span_hours": snapshot.span_hours,
+        "chunks": [chunk.__dict__ for chunk in snapshot.chunks],
+        "player_lists": snapshot.player_lists,
+        "columns": snapshot.columns,
+    }
+    with open(path + ".tmp", "wb") as f:
+        f.write(SNAPSHOT_MAGIC + bytes([SNAPSHOT_VERSION]))
+        pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+    replace(path + ".tmp", path)
+
+
+def load_snapshot(data_dir: str, span_hours: int) -> Snapshot | None:
+    """读取快照, 不存在、版本或时间跨度不同、损坏时返回None"""
+    path = get_snapshot_path(data_dir)
+    if not exists(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            header = f.read(len(SNAPSHOT_MAGIC) + 1)
+            if header[:-1] != SNAPSHOT_MAGIC or header[-1] != SNAPSHOT_VERSION:
+                logger.info("启动快照版本不同, 忽略")
+                return None
+            data = pickle.load(f)
+        if data["span_hours"] != span_hours:
+            logger.info("启动快照的时间窗口跨度不同, 忽略")
+            return None
+        return Snapshot(data["span_hours"], [SnapshotChunk(**chunk) for chunk in data["chunks"]],
+                        data["player_lists"], data["columns"])
+    except (OSError, ValueError, KeyError, TypeError, IndexError, EOFError, pickle.UnpicklingError) as e:
+        logger.warning(f"读取启动快照失败 -> {e}")
+        return None
+
+
+def remove_snapshot(data_dir: str):
+    path = get_snapshot_path(data_dir)
+    if exists(path):
+        remove(path)
@@ -0,0 +1,119 @@
+"""
+数据点预写日志 (Write-Ahead Log)
+每获取到一个数据点就往日志末尾追加一行记录, 不需要重写整个数据文件
+完整的数据文件只在检查点 (DataManager.save_data) 时生成
+检查点开始时把日志轮换为 .old 文件, 新的记录写入新日志, 检查点完成后删除 .old 文件
+启动时在数据文件的基础上依次重放 .old 日志和当前日志, 以恢复上次检查点之后的数据
+"""
+import json
+from os import fsync, remove, replace
+from os.path import exists, getsize
+from typing import Any, Iterator
+
+from lib.log import logger
+
+WAL_FILE_NAME = "points.wal"
+ROTATED_SUFFIX = ".old"
+OP_ADD = "+"
+OP_REMOVE = "-"
+
+
+class PointsWAL:
+    """
+    只追加的数据点日志
+    每行一个json记录: ["+", 数据点字典] 或 ["-", 数据点时间]
+    """
+
+    def __init__(self, file_path: str, sync_per_records: int = 10):
+        self.file_path = file_path
+        self.rotated_path = file_path + ROTATED_SUFFIX
+        self.sync_per_records = max(1, sync_per_records)
+        self.records_count = 0  # 日志中的记录数
+        self.non_synced = 0  # 尚未fsync的记录数
+        self.file = None
+
+    def open(self):
+        if self.file is None:
+            self.file = open(self.file_path, "a", encoding="utf-8")
+
+    def append_add(self, point_dict: dict[str, Any]):
+        """记录新增的数据点"""
+        self.append([OP_ADD, point_dict])
+
+    def append_remove(self, point_time: float):
+        """记录删除的数据点"""
+        self.append([OP_REMOVE, point_time])
+
+    def append(self, record: list):
+        self.open()
+        self.file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self.file.flush()
+        self.records_count += 1
+        self.non_synced += 1
+        if self.non_synced >= self.sync_per_records:
+            self.sync()
+
+    def sync(self):
+        """把缓冲的记录同步到磁盘"""
+        if self.file is not None and self.non_synced:
+            fsync(self.file.fileno())
+            self.non_synced = 0
+
+    def replay(self) -> Iterator[tuple[str, Any]]:
+        """按顺序读取未完成的检查点留下的 .old 日志和当前日志中的记录"""
+        yield from self.replay_file(self.rotated_path)
+        yield from self.replay_file(self.file_path)
+
+    def replay_file(self, file_path: str) -> Iterator[tuple[str, Any]]:
+        """
+        按顺序读取日志文件中的记录
+        遇到损坏的记录 (一般是写入时崩溃导致的半行) 会截断日志到最后一条完整记录
+        """
+        if not exists(file_path):
+            return
+        valid_size = 0
+        with open(file_path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    logger.warning(f"日志 [{file_path}] 末尾存在不完整的记录, 已丢弃")
+                    break
+                try:
+                    op, value = json.loads(line)
+                except ValueError:
+                    logger.warning(f"日志 [{file_path}] 存在损坏的记录, 丢弃其后的所有记录")
+                    break
+                valid_size += len(line)
+                self.records_count += 1
+                yield op, value
+        if valid_size != getsize(file_path):
+            with open(file_path, "r+b") as f:
+                f.truncate(valid_size)
+
+    def rotate(self):
+        """
+        检查点开始时调用, 把当前日志轮换为 .old 文件, 之后的记录写入新日志
+        上一个检查点失败留下的 .old 文件会被保留, 当前日志追加到它的末尾
+        """
+        self.close()
+        if exists(self.file_path):
+            if exists(self.rotated_path):
+                with open(self.file_path, "rb") as src, open(self.rotated_path, "ab") as dst:
+                    dst.write(src.read())
+                    dst.flush()
+                    fsync(dst.fileno())
+                remove(self.file_path)
+            else:
+                replace(self.file_path, self.rotated_path)
+        self.records_count = 0
+        self.non_synced = 0
+
+    def discard_rotated(self):
+        """检查点完成后删除 .old 日志"""
+        if exists(self.rotated_path):
+            remove(self.rotated_path)
+
+    def close(self):
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+            self.file = None
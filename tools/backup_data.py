@@ -0,0 +1,82 @@
+"""
+管理数据文件夹的备份
+用法:
+    python -m tools.backup_data list <备份文件夹>
+    python -m tools.backup_data backup <数据文件夹> <备份文件夹> [--io-mb 速度限制]
+    python -m tools.backup_data restore <备份文件夹> <快照名> <目标文件夹>
+    python -m tools.backup_data prune <备份文件夹> --keep N
+备份前请先关闭程序, 或者直接使用程序中的定时备份
+"""
+import argparse
+import sys
+from contextlib import nullcontext
+from threading import Event
+from time import strftime, localtime
+
+from lib.backup import BackupStore, IoThrottle
+from lib.perf import Counter
+
+
+def list_snapshots(store: BackupStore) -> bool:
+    names = store.list_snapshots()
+    if not names:
+        print("没有备份快照")
+        return True
+    for name in names:
+        try:
+            created, files = store.load_snapshot(name)
+        except (OSError, ValueError) as e:
+            print(f"{name} 读取失败 -> {e}")
+            continue
+        total = sum(file.size for file in files.values())
+        print(f"{name}  {strftime('%Y-%m-%d %H:%M:%S', localtime(created))}  "
+              f"{len(files)} 个文件  {total / 1024 / 1024:.1f} MB")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="管理数据文件夹的备份")
+    commands = parser.add_subparsers(dest="command", required=True)
+    list_parser = commands.add_parser("list", help="列出全部备份快照")
+    list_parser.add_argument("backup_dir")
+    backup_parser = commands.add_parser("backup", help="立即备份数据文件夹")
+    backup_parser.add_argument("data_dir")
+    backup_parser.add_argument("backup_dir")
+    backup_parser.add_argument("--io-mb", type=float, default=0, help="每秒读写的数据量上限 (MB), 默认不限制")
+    restore_parser = commands.add_parser("restore", help="把快照恢复到一个空的文件夹")
+    restore_parser.add_argument("backup_dir")
+    restore_parser.add_argument("snapshot")
+    restore_parser.add_argument("target_dir")
+    prune_parser = commands.add_parser("prune", help="只保留最近的若干个快照, 并删除不再引用的文件")
+    prune_parser.add_argument("backup_dir")
+    prune_parser.add_argument("--keep", type=int, required=True)
+    args = parser.parse_args()
+    store = BackupStore(args.backup_dir)
+    timer = Counter(create_start=True)
+    try:
+        if args.command == "list":
+            ok = list_snapshots(store)
+        elif args.command == "backup":
+            stop_flag = Event()
+            name = store.backup(args.data_dir, nullcontext(), IoThrottle(args.io_mb, stop_flag), stop_flag)
+            print(f"已创建快照 {name}, 耗时 {timer.end():.2f} s")
+            ok = True
+        elif args.command == "restore":
+            count = store.restore(args.snapshot, args.target_dir)
+            print(f"已恢复 {count} 个文件, 耗时 {timer.end():.2f} s")
+            ok = True
+        else:
+            if args.keep < 1:
+                print("至少需要保留一个快照")
+                sys.exit(1)
+            snapshots, objects = store.prune(args.keep)
+            print(f"删除了 {snapshots} 个快照和 {objects} 个文件")
+            ok = True
+    except (OSError, ValueError) as e:
+        print(f"失败 -> {e}")
+        ok = False
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
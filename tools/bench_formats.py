@@ -0,0 +1,59 @@
+"""
+比较各个 DataSaveFmt 与 DataCompress 组合的保存速度、加载速度和文件大小
+用法: python -m tools.bench_formats [数据点数量] [玩家数量]
+"""
+import logging
+import sys
+from os import listdir
+from os.path import getsize, join
+from tempfile import TemporaryDirectory
+
+from lib.config import config, DataSaveFmt, DataCompress
+from lib.data import DataManager, is_data_file
+from lib.log import logger
+from lib.perf import Counter
+from tools.synthetic import make_points
+
+
+def bench_format(fmt: DataSaveFmt, compress: DataCompress, points_count: int,
+                 players: int) -> tuple[float, float, int]:
+    """返回 (保存耗时, 加载耗时, 文件总大小)"""
+    with TemporaryDirectory() as data_dir:
+        config.data_save_fmt = fmt
+        config.data_compress = compress
+        manager = DataManager(data_dir)
+        with manager.data_ctl_lock:
+            for point in make_points(points_count, players):
+                manager.attach_point(point)
+        timer = Counter(create_start=True)
+        manager.save_data()
+        save_time = timer.end()
+        size = sum(getsize(join(data_dir, f)) for f in listdir(data_dir) if is_data_file(f))
+
+        loader = DataManager(data_dir)
+        timer.start()
+        loader.load_data()
+        load_time = timer.end()
+        assert len(loader.point_store) == points_count, f"{fmt.name}/{compress.name} 加载的数据点数量不一致"
+    return save_time, load_time, size
+
+
+def main():
+    points_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    players = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    config.enable_data_save = True
+    logger.setLevel(logging.WARNING)
+    results = {}
+    for fmt in DataSaveFmt:
+        for compress in DataCompress:
+            results[fmt, compress] = bench_format(fmt, compress, points_count, players)
+    base_size = results[DataSaveFmt.NORMAL, DataCompress.NONE][2]
+    print(f"{points_count} 个数据点, {players} 个玩家")
+    print(f"{'格式':<22}{'压缩':<8}{'保存 (点/秒)':>14}{'加载 (点/秒)':>14}{'大小 (KB)':>12}{'相对大小':>10}")
+    for (fmt, compress), (save_time, load_time, size) in results.items():
+        print(f"{fmt.name:<22}{compress.name:<8}{points_count / save_time:>14.0f}{points_count / load_time:>14.0f}"
+              f"{size / 1024:>12.1f}{size / base_size:>10.1%}")
+
+
+if __name__ == "__main__":
+    main()
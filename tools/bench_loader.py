@@ -0,0 +1,50 @@
+"""
+比较线程加载和进程池加载的耗时
+用法: python -m tools.bench_loader [数据点数量] [数据格式名]
+"""
+import logging
+import sys
+from tempfile import TemporaryDirectory
+
+from lib.config import config, DataSaveFmt
+from lib.data import DataManager
+from lib.log import logger
+from lib.perf import Counter
+from tools.synthetic import make_points
+
+WORKERS = (1, 4, 8, 16)
+
+
+def load_time(data_dir: str, use_process: bool, workers: int) -> float:
+    config.data_load_process = use_process
+    config.data_load_threads = workers
+    manager = DataManager(data_dir)
+    timer = Counter(create_start=True)
+    manager.load_data()
+    return timer.end()
+
+
+def main():
+    points_count = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    fmt = DataSaveFmt[sys.argv[2]] if len(sys.argv) > 2 else DataSaveFmt.NORMAL
+    config.enable_data_save = True
+    config.lazy_load = False
+    config.data_save_fmt = fmt
+    logger.setLevel(logging.WARNING)
+    with TemporaryDirectory() as data_dir:
+        manager = DataManager(data_dir)
+        with manager.data_ctl_lock:
+            for point in make_points(points_count, players=30):
+                manager.attach_point(point)
+        manager.save_data()
+        del manager
+        print(f"{points_count} 个数据点, 格式 {fmt.name}, 每文件 {config.chunk_span_hours} 小时")
+        print(f"{'并发数':<8}{'线程 (秒)':>12}{'进程 (秒)':>12}{'加速比':>10}")
+        for workers in WORKERS:
+            thread_time = load_time(data_dir, False, workers)
+            process_time = load_time(data_dir, True, workers)
+            print(f"{workers:<8}{thread_time:>12.2f}{process_time:>12.2f}{thread_time / process_time:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+测量加载模拟历史数据后每个数据点占用的内存
+先把模拟数据点写入临时文件夹, 再用 tracemalloc 统计 DataManager 加载后的内存占用
+同时把加载出的数据点复制为使用 __dict__ 的普通对象, 对比数据点对象本身的大小
+用法: python -m tools.bench_memory [数据点数量] [玩家数量]
+"""
+import gc
+import logging
+import sys
+import tracemalloc
+from tempfile import TemporaryDirectory
+
+from lib.config import config, DataSaveFmt
+from lib.data import DataManager, ServerPoint
+from lib.log import logger
+from tools.synthetic import make_points
+
+
+class DictPoint:
+    """没有 __slots__ 的数据点, 与 ServerPoint 的字段相同, 作为对照"""
+
+    def __init__(self, point: ServerPoint):
+        self.time = point.time
+        self.online = point.online
+        self.players = point.players
+        self.ping = point.ping
+        self.id_ = point.id_
+
+
+def traced_bytes(func) -> tuple[int, object]:
+    """调用func, 返回其返回值在调用结束后仍占用的内存 (字节)"""
+    gc.collect()
+    tracemalloc.start()
+    result = func()
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return used, result
+
+
+def main():
+    points_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    players = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    config.enable_data_save = True
+    config.lazy_load = False
+    config.data_save_fmt = DataSaveFmt.COLUMNAR
+    logger.setLevel(logging.WARNING)
+    with TemporaryDirectory() as data_dir:
+        manager = DataManager(data_dir)
+        with manager.data_ctl_lock:
+            for point in make_points(points_count, players):
+                manager.attach_point(point)
+        manager.save_data()
+        del manager
+
+        def load() -> DataManager:
+            loader = DataManager(data_dir)
+            loader.load_data()
+            return loader
+
+        total, loaded = traced_bytes(load)
+        points = list(loaded.points)
+        slots_size, _ = traced_bytes(lambda: [point.copy() for point in points])
+        dict_size, _ = traced_bytes(lambda: [DictPoint(point) for point in points])
+    print(f"{points_count} 个数据点, {players} 个玩家, 共 {len({id(pt.players) for pt in points})} 种玩家列表")
+    print(f"加载后总内存: {total / points_count:.0f} 字节/点 ({total / 1024 / 1024:.1f} MB)")
+    print(f"数据点对象 (__slots__): {slots_size / points_count:.0f} 字节/点")
+    print(f"数据点对象 (__dict__):  {dict_size / points_count:.0f} 字节/点")
+
+
+if __name__ == "__main__":
+    main()
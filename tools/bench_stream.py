@@ -0,0 +1,87 @@
+"""
+比较一次性 json.load 和流式读取大型json数据文件的耗时与内存峰值
+先逐个生成模拟数据点并流式写入指定大小的数据文件, 再分别用两种方式读取全部数据点字典
+用法: python -m tools.bench_stream [文件大小 (MB)] [数据格式名 (NORMAL / PLAYER_LIST_MAPPING / PLAYER_MAPPING)]
+"""
+import gc
+import json
+import logging
+import sys
+import tracemalloc
+from os.path import getsize, join
+from tempfile import TemporaryDirectory
+
+from lib.config import DataSaveFmt, DataCompress
+from lib.data import DataManager, get_data_file_name, write_points_file
+from lib.log import logger
+from lib.perf import Counter
+from tools.synthetic import iter_points
+
+PLAYERS = 30
+SAMPLE_POINTS = 20000
+
+
+class SyntheticPoints:
+    """每次迭代都重新生成相同的模拟数据点, 映射格式写入时会遍历两次, 数据点不需要全部放在内存中"""
+
+    def __init__(self, count: int):
+        self.count = count
+
+    def __iter__(self):
+        return iter_points(self.count, PLAYERS)
+
+
+def measure(func) -> tuple[float, int, object]:
+    """返回 (耗时, 内存峰值, 返回值)"""
+    gc.collect()
+    tracemalloc.start()
+    timer = Counter(create_start=True)
+    result = func()
+    cost = timer.end()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return cost, peak, result
+
+
+def estimate_points_count(data_dir: str, fmt: DataSaveFmt, size_mb: float) -> int:
+    """写入少量数据点估算每个数据点占用的文件大小, 得到达到目标大小需要的数据点数量"""
+    path = join(data_dir, "sample.json")
+    write_points_file(path, list(iter_points(SAMPLE_POINTS, PLAYERS)), fmt, DataCompress.NONE)
+    return int(size_mb * 1024 * 1024 / (getsize(path) / SAMPLE_POINTS))
+
+
+def count_points(file_path: str) -> int:
+    return sum(1 for _ in DataManager.iter_point_dicts(file_path))
+
+
+def load_whole(file_path: str) -> int:
+    """旧的读取方式: 一次性解析整个文件, 只统计数据点数量, 不展开映射"""
+    with open(file_path, "rb") as f:
+        data_obj = json.load(f)
+    return len(data_obj) if isinstance(data_obj, list) else len(data_obj["points"])
+
+
+def main():
+    size_mb = float(sys.argv[1]) if len(sys.argv) > 1 else 500
+    fmt = DataSaveFmt[sys.argv[2]] if len(sys.argv) > 2 else DataSaveFmt.NORMAL
+    logger.setLevel(logging.WARNING)
+    with TemporaryDirectory() as data_dir:
+        points_count = estimate_points_count(data_dir, fmt, size_mb)
+        file_path = join(data_dir, get_data_file_name("bench", fmt, DataCompress.NONE))
+        timer = Counter(create_start=True)
+        write_points_file(file_path, SyntheticPoints(points_count), fmt, DataCompress.NONE)
+        file_size = getsize(file_path)
+        print(f"{fmt.name} 格式, {points_count} 个数据点, {PLAYERS} 个玩家, "
+              f"文件大小 {file_size / 1024 / 1024:.1f} MB, 生成耗时 {timer.end():.1f} 秒")
+
+        stream_time, stream_peak, stream_count = measure(lambda: count_points(file_path))
+        assert stream_count == points_count, "流式读取的数据点数量不一致"
+        whole_time, whole_peak, whole_count = measure(lambda: load_whole(file_path))
+        assert whole_count == points_count, "json.load 读取的数据点数量不一致"
+    print(f"{'方式':<14}{'耗时 (秒)':>10}{'内存峰值 (MB)':>16}{'峰值/文件大小':>14}")
+    for name, cost, peak in (("json.load", whole_time, whole_peak), ("流式读取", stream_time, stream_peak)):
+        print(f"{name:<14}{cost:>10.1f}{peak / 1024 / 1024:>16.1f}{peak / file_size:>14.2%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+离线转换和校验数据文件夹
+使用进程池把数据文件夹中的全部数据文件转换为指定的存储格式和压缩方式, 写入后重新读取, 逐个校验数据点是否一致
+也可以只校验数据文件夹: 逐个解码数据文件, 并与数据块清单中记录的数据点数和校验和对比
+打包存储的数据块也会被转换和校验, 转换后写入目标文件夹的都是单独的文件
+用法:
+    python -m tools.convert_data convert <源文件夹> <目标文件夹> <格式名> [压缩方式名] [--workers N]
+    python -m tools.convert_data verify <数据文件夹> [--workers N]
+"""
+import argparse
+import logging
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from os import cpu_count, listdir, mkdir
+from os.path import abspath, exists, join
+
+from lib.config import DataSaveFmt, DataCompress
+from lib.data import DataManager, ServerPoint, get_data_file_name, get_data_file_stem, is_data_file, \
+    write_points_file
+from lib.log import logger
+from lib.manifest import ChunkManifest, file_checksum, stat_file
+from lib.pack import PackStore, read_pack_data
+from lib.perf import Counter
+
+PING_TOLERANCE = 0.01  # 列式格式的延迟以 float32 存储
+LOSSY_FMTS = (DataSaveFmt.RUN_LENGTH,)  # 时间按均匀间隔重建的格式不校验时间
+
+
+@dataclass
+class FileResult:
+    """一个数据文件的处理结果"""
+    file_name: str
+    count: int
+    error: str | None = None
+
+
+def quiet_logger():
+    """子进程中只输出警告和错误, 避免每个文件都输出一条日志"""
+    logger.setLevel(logging.WARNING)
+
+
+def compare_points(expected: list[ServerPoint], actual: list[ServerPoint], lossy: bool) -> str | None:
+    """
+    按时间顺序逐个对比两组数据点
+    :return: 第一个不一致之处的描述, 全部一致时返回None
+    """
+    if len(expected) != len(actual):
+        return f"数据点数量不一致 {len(expected)} -> {len(actual)}"
+    for old, new in zip(expected, actual):
+        if old.online != new.online or \
+                [(p.name, p.uuid) for p in old.players] != [(p.name, p.uuid) for p in new.players]:
+            return f"数据点 [{old.time}] 的在线人数或玩家列表不一致"
+        if (not lossy and old.time != new.time) or abs(old.ping - new.ping) > PING_TOLERANCE:
+            return f"数据点 [{old.time}] 的时间或延迟不一致"
+    return None
+
+
+def list_files(data_dir: str) -> tuple[list[str], PackStore]:
+    """数据文件夹中的单独的数据文件和打包存储的数据块, 同名时以打包存储的为准"""
+    packs = PackStore(data_dir)
+    packs.load()
+    files = set(packs.names()) | {file for file in listdir(data_dir) if is_data_file(file)}
+    return sorted(files), packs
+
+
+def convert_file(src_path: str, dst_dir: str, file_name: str, fmt: DataSaveFmt, compress: DataCompress,
+                 location: tuple[str, int, int, str] | None = None) -> FileResult:
+    """转换一个数据文件, 并重新读取写入的文件校验数据点"""
+    try:
+        data = read_pack_data(*location) if location is not None else None
+        points = sorted(DataManager.read_a_file(src_path, data), key=lambda pt: pt.time)
+        new_name = get_data_file_name(get_data_file_stem(file_name), fmt, compress)
+        new_path = join(dst_dir, new_name)
+        write_points_file(new_path, points, fmt, compress)
+        written = sorted(DataManager.read_a_file(new_path), key=lambda pt: pt.time)
+    except Exception as e:  # 单个文件的任何错误都只影响这个文件
+        return FileResult(file_name, 0, f"{type(e).__name__}: {e}")
+    return FileResult(file_name, len(points), compare_points(points, written, fmt in LOSSY_FMTS))
+
+
+def verify_file(file_path: str, file_name: str, count: int | None, checksum: str | None,
+                location: tuple[str, int, int, str] | None = None) -> FileResult:
+    """解码一个数据文件, 检查重复的数据点, 并与清单记录对比"""
+    try:
+        if location is not None:  # 数据与打包记录的校验和不一致时 read_pack_data 会抛出异常
+            points = DataManager.read_a_file(file_path, read_pack_data(*location))
+            actual_checksum = location[3] if checksum is not None else None
+        else:
+            points = DataManager.read_a_file(file_path)
+            actual_checksum = file_checksum(file_path) if checksum is not None else None
+    except Exception as e:
+        return FileResult(file_name, 0, f"{type(e).__name__}: {e}")
+    if not points:
+        return FileResult(file_name, 0, "没有读取到数据点")
+    if count is not None and len(points) != count:
+        return FileResult(file_name, len(points), f"数据点数量与清单不一致 {count} -> {len(points)}")
+    if actual_checksum != checksum:
+        return FileResult(file_name, len(points), f"校验和与清单不一致 {checksum} -> {actual_checksum}")
+    duplicates = len(points) - len({pt.time for pt in points})
+    if duplicates:
+        return FileResult(file_name, len(points), f"有 {duplicates} 个时间重复的数据点")
+    return FileResult(file_name, len(points))
+
+
+def run_tasks(executor: ProcessPoolExecutor, futures: list) -> bool:
+    """等待全部任务完成并输出结果和速度, 全部成功时返回True"""
+    timer = Counter(create_start=True)
+    total_points = 0
+    failures = 0
+    for i, future in enumerate(as_completed(futures), 1):
+        result: FileResult = future.result()
+        total_points += result.count
+        if result.error is not None:
+            failures += 1
+            print(f"[{i}/{len(futures)}] {result.file_name} 失败 -> {result.error}")
+        else:
+            print(f"[{i}/{len(futures)}] {result.file_name} {result.count} 个数据点")
+    cost = timer.end()
+    executor.shutdown()
+    print(f"共 {len(futures)} 个文件, {total_points} 个数据点, 失败 {failures} 个, 耗时 {cost:.2f} s, "
+          f"{total_points / max(cost, 1e-9):.0f} 点/秒")
+    return failures == 0
+
+
+def convert(src_dir: str, dst_dir: str, fmt: DataSaveFmt, compress: DataCompress, workers: int) -> bool:
+    if abspath(src_dir) == abspath(dst_dir):
+        print("目标文件夹不能与源文件夹相同")
+        return False
+    if not exists(dst_dir):
+        mkdir(dst_dir)
+    files: dict[str, str] = {}
+    names, packs = list_files(src_dir)
+    for file in names:
+        stem = get_data_file_stem(file)
+        if stem in files:  # 转换后会写入同一个文件
+            print(f"跳过 {file} -> 与 {files[stem]} 对应同一个时间窗口, 请先在程序中完成压实")
+            continue
+        files[stem] = file
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=quiet_logger)
+    futures = [executor.submit(convert_file, join(src_dir, file), dst_dir, file, fmt, compress, packs.locate(file))
+               for file in files.values()]
+    return run_tasks(executor, futures)
+
+
+def verify(data_dir: str, workers: int) -> bool:
+    manifest = ChunkManifest(data_dir, None)
+    manifest.load()
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=quiet_logger)
+    futures = []
+    names, packs = list_files(data_dir)
+    for file in names:
+        entry = manifest.get(file)
+        pack_entry = packs.get(file)
+        file_stat = (pack_entry.length, pack_entry.mtime) if pack_entry is not None \
+            else stat_file(join(data_dir, file))
+        if entry is not None and not entry.match_stat(file_stat):  # 文件在清单写入后被改动过
+            entry = None
+        futures.append(executor.submit(verify_file, join(data_dir, file), file,
+                                       entry.count if entry is not None else None,
+                                       entry.checksum if entry is not None else None, packs.locate(file)))
+    return run_tasks(executor, futures)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线转换和校验数据文件夹")
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--workers", type=int, default=cpu_count(), help="进程数, 默认为CPU核心数")
+    commands = parser.add_subparsers(dest="command", required=True)
+    convert_parser = commands.add_parser("convert", parents=[common], help="转换数据文件夹的存储格式和压缩方式")
+    convert_parser.add_argument("src_dir")
+    convert_parser.add_argument("dst_dir")
+    convert_parser.add_argument("fmt", choices=[fmt.name for fmt in DataSaveFmt])
+    convert_parser.add_argument("compress", nargs="?", default=DataCompress.NONE.name,
+                                choices=[way.name for way in DataCompress])
+    verify_parser = commands.add_parser("verify", parents=[common], help="校验数据文件夹中的全部数据文件")
+    verify_parser.add_argument("data_dir")
+    args = parser.parse_args()
+    quiet_logger()
+    if args.command == "convert":
+        ok = convert(args.src_dir, args.dst_dir, DataSaveFmt[args.fmt], DataCompress[args.compress], args.workers)
+    else:
+        ok = verify(args.data_dir, args.workers)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
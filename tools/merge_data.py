@@ -0,0 +1,200 @@
+"""
+合并多个采集端的数据文件夹
+把几个数据文件夹 (包括其中的归档和打包存储的数据块) 中的数据文件按时间顺序做多路归并, 逐个时间窗口写入新的数据文件夹
+每个数据文件在归并进行到它的最早时间时才被读取, 读完就释放, 内存占用只与时间上重叠的数据文件数量有关, 与数据总量无关
+来自不同数据文件夹、时间相差不超过容差、玩家列表相同的数据点被认为是同一次状态获取, 只保留最早的一个
+用法: python -m tools.merge_data <目标文件夹> <数据文件夹>... [--fmt 格式名] [--compress 压缩方式名]
+                                 [--tolerance 秒] [--span-hours 小时]
+合并前请先关闭各个采集端, 未写入数据文件的预写日志不会被合并
+"""
+import argparse
+import heapq
+import logging
+import sys
+from calendar import timegm
+from dataclasses import dataclass, field
+from os import listdir, mkdir
+from os.path import abspath, exists, getsize, join
+from time import strptime
+from typing import Iterator
+
+from lib.archive import ArchiveStore
+from lib.config import config, DataSaveFmt, DataCompress
+from lib.data import DataManager, ServerPoint, WINDOW_FILE_RE, get_data_file_name, get_window_file_stem, \
+    get_window_start, is_data_file, player_pool, write_points_file
+from lib.log import logger
+from lib.manifest import ChunkManifest, stat_file
+from lib.pack import PackStore, read_pack_data
+from lib.perf import Counter
+from lib.wal import WAL_FILE_NAME
+
+DEFAULT_TOLERANCE = config.check_inv / 2  # 默认的去重容差 (秒), 两个采集端的检查间隔相同时, 玩家列表相同的数据点只保留一方的
+
+
+@dataclass(order=True)
+class MergeSource:
+    """归并堆中的一个数据文件, 读取前按文件的最早时间排序, 读取后按下一个数据点的时间排序"""
+    next_time: float
+    seq: int
+    dir_index: int = field(compare=False)
+    file_path: str = field(compare=False)
+    location: tuple[str, int, int, str] | None = field(compare=False)  # 打包存储的数据块的位置
+    points: list[ServerPoint] | None = field(default=None, compare=False)
+    index: int = field(default=0, compare=False)
+
+
+def read_source(file_path: str, location: tuple[str, int, int, str] | None) -> list[ServerPoint]:
+    """读取一个数据文件, 打包存储的数据块从打包文件读取"""
+    return DataManager.read_a_file(file_path, read_pack_data(*location) if location is not None else None)
+
+
+def get_file_min_time(data_dir: str, file_name: str, manifest: ChunkManifest, packs: PackStore) -> float:
+    """
+    数据文件中最早的数据点时间 (或它的下界)
+    优先使用清单记录, 其次使用按时间窗口命名的文件的窗口起点, 都没有时读取文件
+    """
+    entry = manifest.get(file_name)
+    pack_entry = packs.get(file_name)
+    file_stat = (pack_entry.length, pack_entry.mtime) if pack_entry is not None \
+        else stat_file(join(data_dir, file_name))
+    if entry is not None and entry.match_stat(file_stat):
+        return entry.min_time
+    match = WINDOW_FILE_RE.match(file_name)
+    if match is not None:
+        return float(timegm(strptime(match.group(1), "%Y%m%d-%H")))
+    points = read_source(join(data_dir, file_name), packs.locate(file_name))
+    return min((pt.time for pt in points), default=float("inf"))
+
+
+def list_sources(data_dir: str) -> list[tuple[float, str, tuple[str, int, int, str] | None]]:
+    """列出数据文件夹 (和归档) 中的全部数据文件及其最早时间和打包位置, 同名时以打包存储的数据块为准"""
+    manifest = ChunkManifest(data_dir, None)
+    manifest.load()
+    packs = PackStore(data_dir)
+    packs.load()
+    files = set(packs.names()) | {file for file in listdir(data_dir) if is_data_file(file)}
+    sources = [(get_file_min_time(data_dir, file, manifest, packs), join(data_dir, file), packs.locate(file))
+               for file in sorted(files)]
+    archive = ArchiveStore(data_dir)
+    for stem, entry in sorted(archive.load().items()):
+        if entry.file_name is None:
+            logger.warning(f"[{data_dir}] 的归档 [{stem}] 只保留了汇总, 无法合并原始数据点")
+            continue
+        sources.append((entry.min_time, join(archive.dir_path, entry.file_name), None))
+    wal_path = join(data_dir, WAL_FILE_NAME)
+    if exists(wal_path) and getsize(wal_path):
+        logger.warning(f"[{data_dir}] 中有尚未写入数据文件的预写日志, 这部分数据不会被合并, 请先正常关闭一次程序")
+    return sources
+
+
+def iter_merged_points(data_dirs: list[str]) -> Iterator[tuple[int, ServerPoint]]:
+    """按时间顺序逐个产出全部数据文件中的 (数据文件夹序号, 数据点), 数据文件在需要时才读取"""
+    heap: list[MergeSource] = []
+    for dir_index, data_dir in enumerate(data_dirs):
+        for min_time, file_path, location in list_sources(data_dir):
+            heap.append(MergeSource(min_time, len(heap), dir_index, file_path, location))
+    heapq.heapify(heap)
+    while heap:
+        source = heap[0]
+        if source.points is None:
+            source.points = sorted(read_source(source.file_path, source.location), key=lambda pt: pt.time)
+            if not source.points:
+                heapq.heappop(heap)
+                continue
+            source.next_time = source.points[0].time
+            heapq.heapreplace(heap, source)
+            continue
+        yield source.dir_index, source.points[source.index]
+        source.index += 1
+        if source.index < len(source.points):
+            source.next_time = source.points[source.index].time
+            heapq.heapreplace(heap, source)
+        else:
+            heapq.heappop(heap)  # 读完的文件不再被引用
+
+
+def iter_deduplicated(points: Iterator[tuple[int, ServerPoint]], tolerance: float) -> Iterator[ServerPoint]:
+    """
+    去掉与上一个保留的数据点来自不同数据文件夹、时间相差不超过容差、玩家列表相同的数据点
+    同一个数据文件夹中的数据点之间不去重 (时间完全相同的除外), 检查间隔小于容差时也不会丢失数据
+    """
+    last: ServerPoint | None = None
+    last_dir = -1
+    for dir_index, point in points:
+        if last is not None and (point.time == last.time or dir_index != last_dir and
+                                 point.time - last.time <= tolerance and
+                                 player_pool.get_names(point.players) == player_pool.get_names(last.players)):
+            continue
+        last = point
+        last_dir = dir_index
+        yield point
+
+
+def merge(dst_dir: str, data_dirs: list[str], fmt: DataSaveFmt, compress: DataCompress, tolerance: float,
+          span_hours: int) -> bool:
+    if any(abspath(dst_dir) == abspath(data_dir) for data_dir in data_dirs):
+        print("目标文件夹不能是要合并的数据文件夹")
+        return False
+    if exists(dst_dir) and listdir(dst_dir):
+        print("目标文件夹不为空")
+        return False
+    if not exists(dst_dir):
+        mkdir(dst_dir)
+    timer = Counter(create_start=True)
+    read_count = 0
+    kept_count = 0
+    files_count = 0
+    window: list[ServerPoint] = []
+    window_start: float | None = None
+
+    def flush():
+        nonlocal files_count
+        if window:
+            file_name = get_data_file_name(get_window_file_stem(window_start, span_hours), fmt, compress)
+            write_points_file(join(dst_dir, file_name), window, fmt, compress)
+            files_count += 1
+            print(f"[{files_count}] {file_name} {len(window)} 个数据点")
+            window.clear()
+
+    def counted(points: Iterator[tuple[int, ServerPoint]]) -> Iterator[tuple[int, ServerPoint]]:
+        nonlocal read_count
+        for item in points:
+            read_count += 1
+            yield item
+
+    for point in iter_deduplicated(counted(iter_merged_points(data_dirs)), tolerance):
+        point_window = get_window_start(point.time, span_hours)
+        if point_window != window_start:
+            flush()
+            window_start = point_window
+        window.append(point)
+        kept_count += 1
+    flush()
+    cost = timer.end()
+    print(f"共读取 {read_count} 个数据点, 去重后保留 {kept_count} 个, 写入 {files_count} 个文件, "
+          f"耗时 {cost:.2f} s, {read_count / max(cost, 1e-9):.0f} 点/秒")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="合并多个采集端的数据文件夹")
+    parser.add_argument("dst_dir")
+    parser.add_argument("data_dirs", nargs="+")
+    parser.add_argument("--fmt", default=config.data_save_fmt.name, choices=[fmt.name for fmt in DataSaveFmt],
+                        help="输出的存储格式, 默认为配置文件中的格式")
+    parser.add_argument("--compress", default=config.data_compress.name, choices=[way.name for way in DataCompress],
+                        help="输出的压缩方式, 默认为配置文件中的压缩方式")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help=f"来自不同文件夹、时间相差不超过该值 (秒) 且玩家列表相同的数据点只保留一个, "
+                             f"默认为检查间隔的一半 ({DEFAULT_TOLERANCE})")
+    parser.add_argument("--span-hours", type=int, default=config.chunk_span_hours,
+                        help="每个输出文件的时间跨度 (小时), 默认为配置文件中的值")
+    args = parser.parse_args()
+    logger.setLevel(logging.WARNING)
+    ok = merge(args.dst_dir, args.data_dirs, DataSaveFmt[args.fmt], DataCompress[args.compress], args.tolerance,
+               args.span_hours)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+"""
+生成模拟的数据点, 供 tools 下的基准测试使用
+模拟一个有固定玩家池的服务器, 玩家随机上下线
+"""
+from random import Random
+from typing import Iterator
+
+from lib.data import ServerPoint, Player
+
+
+def make_points(count: int, players: int = 10, inv: float = 60.0, start: float = 1735660800.0,
+                seed: int = 114514) -> list[ServerPoint]:
+    """生成模拟数据点, 参数与 iter_points 相同"""
+    return list(iter_points(count, players, inv, start, seed))
+
+
+def iter_points(count: int, players: int = 10, inv: float = 60.0, start: float = 1735660800.0,
+                seed: int = 114514) -> Iterator[ServerPoint]:
+    """
+    逐个生成模拟数据点, 不需要把所有数据点放在内存中
+    :param count: 数据点数量
+    :param players: 玩家池大小
+    :param inv: 两个数据点之间的间隔 (秒)
+    :param start: 第一个数据点的时间
+    :param seed: 随机种子, 保证每次生成的数据相同
+    """
+    rand = Random(seed)
+    pool = [Player(f"Player_{i:04d}", f"{i:08x}-0000-0000-0000-{rand.getrandbits(48):012x}") for i in range(players)]
+    online: set[int] = set()
+    for i in range(count):
+        for index in range(players):  # 每个玩家每次有小概率改变在线状态
+            if rand.random() < 0.02:
+                online.symmetric_difference_update({index})
+        point_players = [pool[index] for index in sorted(online)]
+        yield ServerPoint(start + i * inv, len(point_players), point_players, round(rand.uniform(20, 80), 2))